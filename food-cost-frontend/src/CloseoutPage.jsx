@@ -1,6 +1,7 @@
 import React, { useEffect, useMemo, useState } from 'react';
 import { useNavigate, useParams, Link } from 'react-router-dom';
 import { api } from './utils/auth';
+import { waitForSalesUpload } from './utils/salesUploads';
 
 const UPLOADS = [
   { key: 'payments_summary', label: 'Payments summary.csv', description: 'Single upload to populate tips, tax, gift cards sold, and deposits per tender.' }
@@ -88,6 +89,7 @@ function SalesUploadBox({ businessDate, onUploaded }) {
         headers: { 'Content-Type': 'multipart/form-data' }
       });
       setResult(resp.data);
+      setResult(await waitForSalesUpload(resp.data, setResult));
       onUploaded?.();
     } catch (err) {
       const msg = err?.response?.data?.error || err.message || 'Upload failed';
@@ -109,7 +111,11 @@ function SalesUploadBox({ businessDate, onUploaded }) {
       {error && <div className="mb-2 text-sm text-red-600">{error}</div>}
       {result && (
         <div className="mb-2 text-sm text-green-700">
-          Upload successful - ID {result.upload_id}, rows {result.rows}
+          {result.status === 'duplicate'
+            ? `Already uploaded - ID ${result.upload_id}, rows ${result.rows}`
+            : (result.done
+              ? `Upload successful - ID ${result.upload_id}, rows ${result.rows_inserted}`
+              : `Processing upload ${result.upload_id} (${result.stage || 'queued'})...`)}
         </div>
       )}
       <form onSubmit={handleSubmit} className="space-y-3">
@@ -195,7 +195,22 @@ function Prices() {
     setRecalcError(null);
     try {
       const res = await api.post('/api/items/recalculate_all');
-      setRecalcResult(res.data);
+      const runId = res.data?.run_id;
+      let run = res.data;
+      setRecalcResult(run);
+      // The recalculation runs in the background; poll its run until it finishes.
+      while (runId && !(run?.done)) {
+        await new Promise((resolve) => setTimeout(resolve, 1500));
+        const statusRes = await api.get(`/api/prices/recalculation_runs/${runId}`);
+        run = statusRes.data;
+        setRecalcResult(run);
+      }
+      if (run?.status === 'failed') {
+        setRecalcError({
+          message: run.summary?.fatal_error || 'Unable to recalculate all costs.',
+          details: Array.isArray(run.summary?.errors) ? run.summary.errors : []
+        });
+      }
       await refreshSnapshotsAndMargins();
     } catch (err) {
       console.error('Failed to recalculate all item costs', err);
@@ -390,6 +405,7 @@ function Prices() {
                   <div className="font-semibold">Run #{latestRun.run_id || 'current'}</div>
                   <div className="text-sm text-gray-600">
                     {latestRun.items_updated || latestRun.updated?.length || 0} updated • {latestRun.items_failed || latestRun.errors?.length || 0} failed
+                    {latestRun.done === false && latestRun.items_total ? ` • ${latestRun.items_scanned || 0} of ${latestRun.items_total} processed` : ''}
                   </div>
                 </div>
               ) : (
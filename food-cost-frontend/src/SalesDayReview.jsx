@@ -1,6 +1,7 @@
 import React, { useEffect, useMemo, useState } from 'react';
 import Select from 'react-select';
 import { api } from './utils/auth';
+import { fetchSalesLines } from './utils/salesLines';
 
 const numberOrBlank = (val) => {
   if (val === null || val === undefined) return '';
@@ -23,10 +24,10 @@ export default function SalesDayReview() {
     setError(null);
     try {
       const [linesRes, itemsRes] = await Promise.all([
-        api.get('/api/sales/lines', { params: { business_date: date, limit: 5000 } }),
+        fetchSalesLines({ business_date: date }),
         api.get('/api/items')
       ]);
-      setLines(Array.isArray(linesRes.data) ? linesRes.data : []);
+      setLines(linesRes);
       setItems(Array.isArray(itemsRes.data) ? itemsRes.data : []);
       setDirty({});
     } catch (err) {
@@ -1,5 +1,6 @@
 import React, { useState } from 'react';
 import { api } from './utils/auth';
+import { waitForSalesUpload } from './utils/salesUploads';
 import { useNavigate } from 'react-router-dom';
 
 function SalesUpload() {
@@ -38,8 +39,9 @@ function SalesUpload() {
         headers: { 'Content-Type': 'multipart/form-data' }
       });
       setResult(resp.data);
-      if (resp?.data?.upload_id) {
-        navigate(`/sales/${resp.data.upload_id}`);
+      const upload = await waitForSalesUpload(resp.data, setResult);
+      if (upload?.upload_id) {
+        navigate(`/sales/${upload.upload_id}`);
       }
     } catch (err) {
       console.error('Upload failed', err);
@@ -63,9 +65,13 @@ function SalesUpload() {
 
       {result && (
         <div className="mb-4 p-4 bg-green-100 border border-green-400 text-green-700 rounded">
-          <div>Upload successful</div>
+          <div>
+            {result.status === 'duplicate'
+              ? 'This file was already uploaded'
+              : (result.done ? 'Upload successful' : `Processing upload (${result.stage || 'queued'})...`)}
+          </div>
           <div>Upload ID: {result.upload_id}</div>
-          <div>Rows parsed: {result.rows}</div>
+          <div>Rows parsed: {result.rows ?? result.rows_parsed ?? '-'}</div>
           <div className="mt-2">
             <button onClick={() => navigate(`/sales/uploads`)} className="text-sm text-blue-600 underline">View uploads</button>
           </div>
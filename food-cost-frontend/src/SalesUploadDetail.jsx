@@ -1,6 +1,7 @@
 import React, { useEffect, useMemo, useState } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import { api } from './utils/auth';
+import { fetchSalesLines } from './utils/salesLines';
 import Select from 'react-select';
 
 const normalizeSalesName = (value) => (value || '').trim().toLowerCase();
@@ -35,11 +36,11 @@ export default function SalesUploadDetail() {
     try {
       setLoadError(null);
       const [lres, ires, mres] = await Promise.all([
-        api.get('/api/sales/lines', { params: { upload_id: id, limit: 2000 } }),
+        fetchSalesLines({ upload_id: id }),
         api.get('/api/items'),
         api.get('/api/sales/mappings')
       ]);
-      setLines(Array.isArray(lres.data) ? lres.data : []);
+      setLines(lres);
       setItems(Array.isArray(ires.data) ? ires.data : []);
       setMappings(Array.isArray(mres.data) ? mres.data : []);
     } catch (err) {
@@ -57,12 +58,12 @@ export default function SalesUploadDetail() {
       try {
         setLoadError(null);
         const [lres, ires, mres] = await Promise.all([
-          api.get('/api/sales/lines', { params: { upload_id: id, limit: 2000 } }),
+          fetchSalesLines({ upload_id: id }),
           api.get('/api/items'),
           api.get('/api/sales/mappings')
         ]);
         if (!mounted) return;
-        setLines(Array.isArray(lres.data) ? lres.data : []);
+        setLines(lres);
         setItems(Array.isArray(ires.data) ? ires.data : []);
         setMappings(Array.isArray(mres.data) ? mres.data : []);
       } catch (err) {
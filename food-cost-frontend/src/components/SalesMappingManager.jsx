@@ -92,7 +92,7 @@ export default function SalesMappingManager() {
             <input type="date" value={reconcileDate} onChange={e => setReconcileDate(e.target.value)} className="border rounded px-2 py-1" />
             <div className="col-span-2">
               <button onClick={handleReconcile} className="bg-green-600 text-white px-3 py-1 rounded">Run Reconcile</button>
-              {reconcileResult && <span className="ml-3 text-sm text-gray-700">Updated: {reconcileResult.updated ?? reconcileResult.error}</span>}
+              {reconcileResult && <span className="ml-3 text-sm text-gray-700">{reconcileResult.status === 'queued' ? 'Reconcile queued' : <>Updated: {reconcileResult.updated ?? reconcileResult.error}</>}</span>}
             </div>
           </div>
 
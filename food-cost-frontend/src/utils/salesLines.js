@@ -0,0 +1,13 @@
+import { api } from './auth';
+
+// /api/sales/lines returns one page at a time; follow X-Next-Cursor until every line is loaded.
+export const fetchSalesLines = async (params) => {
+  const lines = [];
+  let cursor;
+  do {
+    const res = await api.get('/api/sales/lines', { params: { ...params, cursor } });
+    if (Array.isArray(res.data)) lines.push(...res.data);
+    cursor = res.headers?.['x-next-cursor'];
+  } while (cursor);
+  return lines;
+};
@@ -0,0 +1,16 @@
+import { api } from './auth';
+
+// Sales uploads are ingested in the background; poll the upload's status until it finishes.
+export const waitForSalesUpload = async (upload, onProgress) => {
+  let status = upload;
+  while (status?.upload_id && status.status_url && !status.done && status.status !== 'duplicate') {
+    await new Promise((resolve) => setTimeout(resolve, 1500));
+    const res = await api.get(status.status_url);
+    status = { ...res.data, status_url: status.status_url };
+    onProgress?.(status);
+  }
+  if (status?.status === 'failed') {
+    throw new Error(status.error || 'Sales upload failed');
+  }
+  return status;
+};
@@ -0,0 +1,52 @@
+-- Cost inputs version counter
+-- Bumped by triggers whenever anything that feeds item/ingredient cost resolution changes,
+-- so every app instance can tell its in-process cost cache is stale with one cheap read.
+--
+-- Trade-off: the counter is a single row, so concurrent writers of price_quotes, conversions,
+-- recipes and item yields queue on its row lock until the first commits. Those writes are
+-- rare and short, and the row update is what makes the new version visible at commit, together
+-- with the data. A sequence (nextval) would take no lock, but readers would see the new version
+-- before the data it stands for and could cache the old data under it.
+
+CREATE TABLE IF NOT EXISTS cost_inputs_version (
+    id integer PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    version bigint NOT NULL DEFAULT 0,
+    updated_at timestamptz DEFAULT now()
+);
+INSERT INTO cost_inputs_version (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_cost_inputs_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE cost_inputs_version SET version = version + 1, updated_at = now() WHERE id = 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_price_quotes_cost_version ON price_quotes;
+CREATE TRIGGER trg_price_quotes_cost_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON price_quotes
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_cost_inputs_version();
+
+DROP TRIGGER IF EXISTS trg_ingredient_conversions_cost_version ON ingredient_conversions;
+CREATE TRIGGER trg_ingredient_conversions_cost_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON ingredient_conversions
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_cost_inputs_version();
+
+DROP TRIGGER IF EXISTS trg_recipes_cost_version ON recipes;
+CREATE TRIGGER trg_recipes_cost_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON recipes
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_cost_inputs_version();
+
+-- items: only new/removed items and yield changes matter; writing items.cost must not
+-- invalidate the cache it was computed from.
+DROP TRIGGER IF EXISTS trg_items_cost_version ON items;
+CREATE TRIGGER trg_items_cost_version
+    AFTER INSERT OR DELETE ON items
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_cost_inputs_version();
+
+DROP TRIGGER IF EXISTS trg_items_yield_cost_version ON items;
+CREATE TRIGGER trg_items_yield_cost_version
+    AFTER UPDATE OF yield_qty, yield_unit ON items
+    FOR EACH ROW
+    WHEN (OLD.yield_qty IS DISTINCT FROM NEW.yield_qty OR OLD.yield_unit IS DISTINCT FROM NEW.yield_unit)
+    EXECUTE FUNCTION bump_cost_inputs_version();
@@ -0,0 +1,8 @@
+-- Idempotent sales re-uploads
+-- content_hash identifies a sales line by its content and business date (not by upload), so
+-- re-uploading an export can skip or take over lines already on file with ON CONFLICT.
+ALTER TABLE sales_daily_lines ADD COLUMN IF NOT EXISTS content_hash text;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_sales_daily_lines_content_hash ON sales_daily_lines (content_hash);
+
+-- Lookup of an identical earlier file for the same business day
+CREATE INDEX IF NOT EXISTS idx_sales_uploads_file_sha256 ON sales_uploads (file_sha256, business_date);
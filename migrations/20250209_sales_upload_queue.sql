@@ -0,0 +1,16 @@
+-- Background sales upload ingestion
+-- POST /api/sales/upload stores the raw file with status 'queued'; a worker ingests it and
+-- records its stage and counters here for GET /api/sales/uploads/<id>/status.
+ALTER TABLE sales_uploads
+    ADD COLUMN IF NOT EXISTS status text NOT NULL DEFAULT 'completed',
+    ADD COLUMN IF NOT EXISTS stage text,
+    ADD COLUMN IF NOT EXISTS raw_text text,
+    ADD COLUMN IF NOT EXISTS options jsonb,
+    ADD COLUMN IF NOT EXISTS rows_parsed integer,
+    ADD COLUMN IF NOT EXISTS rows_inserted integer,
+    ADD COLUMN IF NOT EXISTS rows_skipped integer,
+    ADD COLUMN IF NOT EXISTS rows_mapped integer,
+    ADD COLUMN IF NOT EXISTS warnings jsonb,
+    ADD COLUMN IF NOT EXISTS error text,
+    ADD COLUMN IF NOT EXISTS started_at timestamptz,
+    ADD COLUMN IF NOT EXISTS completed_at timestamptz;
@@ -0,0 +1,53 @@
+-- Per-day sales rollup read by the sales, margin and report endpoints
+-- Maintained by utils/sales_rollup.refresh_sales_item_daily() whenever sales_daily_lines change.
+CREATE TABLE IF NOT EXISTS sales_item_daily (
+    business_date date NOT NULL,
+    item_id integer,
+    name_key text NOT NULL,
+    item_name text,
+    category text NOT NULL,
+    line_count integer NOT NULL DEFAULT 0,
+    qty numeric NOT NULL DEFAULT 0,
+    net_sales numeric NOT NULL DEFAULT 0,
+    gross_sales numeric NOT NULL DEFAULT 0,
+    discounts numeric NOT NULL DEFAULT 0,
+    taxes numeric NOT NULL DEFAULT 0,
+    qty_lines integer NOT NULL DEFAULT 0,
+    net_sales_lines integer NOT NULL DEFAULT 0,
+    gross_sales_lines integer NOT NULL DEFAULT 0,
+    discount_lines integer NOT NULL DEFAULT 0,
+    tax_lines integer NOT NULL DEFAULT 0,
+    refreshed_at timestamptz DEFAULT now()
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_sales_item_daily_key
+    ON sales_item_daily (business_date, COALESCE(item_id, 0), name_key, category);
+CREATE INDEX IF NOT EXISTS idx_sales_item_daily_item ON sales_item_daily (item_id, business_date);
+CREATE INDEX IF NOT EXISTS idx_sales_item_daily_name ON sales_item_daily (name_key, business_date) WHERE item_id IS NULL;
+
+-- Backfill from the lines already loaded
+INSERT INTO sales_item_daily (
+    business_date, item_id, name_key, item_name, category,
+    line_count, qty, net_sales, gross_sales, discounts, taxes,
+    qty_lines, net_sales_lines, gross_sales_lines, discount_lines, tax_lines
+)
+SELECT
+    business_date,
+    item_id,
+    COALESCE(LOWER(TRIM(item_name)), ''),
+    MIN(item_name),
+    COALESCE(sales_category, 'Uncategorized'),
+    COUNT(*),
+    SUM(COALESCE(item_qty, 0)),
+    SUM(COALESCE(net_sales, 0)),
+    SUM(COALESCE(gross_sales, 0)),
+    SUM(COALESCE(discount_amount, 0)),
+    SUM(COALESCE(tax_amount, 0)),
+    COUNT(item_qty),
+    COUNT(net_sales),
+    COUNT(gross_sales),
+    COUNT(discount_amount),
+    COUNT(tax_amount)
+FROM sales_daily_lines
+WHERE business_date IS NOT NULL
+  AND NOT EXISTS (SELECT 1 FROM sales_item_daily)
+GROUP BY business_date, item_id, COALESCE(LOWER(TRIM(item_name)), ''), COALESCE(sales_category, 'Uncategorized');
@@ -0,0 +1,48 @@
+-- Cost of each item in effect per business day, as [valid_from, valid_to) date ranges
+-- Maintained by utils/cost_intervals.record_snapshot_costs() whenever SnapshotWriter writes
+-- snapshots. The first range starts at 0001-01-01 and the current one ends at 9999-12-31.
+CREATE TABLE IF NOT EXISTS item_cost_intervals (
+    item_id integer NOT NULL,
+    valid_from date NOT NULL,
+    valid_to date NOT NULL,
+    cost_per_unit numeric,
+    PRIMARY KEY (item_id, valid_from),
+    CHECK (valid_from < valid_to)
+);
+
+CREATE INDEX IF NOT EXISTS idx_item_cost_snapshots_item_created
+    ON item_cost_snapshots (item_id, created_at) WHERE status = 'ok';
+
+-- Backfill from the snapshots already written (same query as rebuild_item_cost_intervals)
+INSERT INTO item_cost_intervals (item_id, valid_from, valid_to, cost_per_unit)
+WITH by_day AS (
+    SELECT DISTINCT ON (item_id, created_at::date)
+        item_id, created_at::date AS day, cost_per_unit
+    FROM item_cost_snapshots
+    WHERE item_id IS NOT NULL AND status = 'ok' AND created_at IS NOT NULL
+    ORDER BY item_id, created_at::date, created_at DESC, snapshot_id DESC
+),
+earliest AS (
+    SELECT DISTINCT ON (item_id) item_id, DATE '0001-01-01' AS day, cost_per_unit
+    FROM item_cost_snapshots
+    WHERE item_id IS NOT NULL AND status = 'ok'
+    ORDER BY item_id, created_at ASC, snapshot_id DESC
+),
+points AS (
+    SELECT item_id, day, cost_per_unit,
+           LAG(cost_per_unit) OVER (PARTITION BY item_id ORDER BY day) AS prev_cost,
+           ROW_NUMBER() OVER (PARTITION BY item_id ORDER BY day) AS n
+    FROM (SELECT * FROM earliest UNION ALL SELECT * FROM by_day) p
+),
+changes AS (
+    SELECT item_id, day, cost_per_unit
+    FROM points
+    WHERE n = 1 OR cost_per_unit IS DISTINCT FROM prev_cost
+)
+SELECT
+    item_id,
+    day,
+    COALESCE(LEAD(day) OVER (PARTITION BY item_id ORDER BY day), DATE '9999-12-31'),
+    cost_per_unit
+FROM changes
+WHERE NOT EXISTS (SELECT 1 FROM item_cost_intervals);
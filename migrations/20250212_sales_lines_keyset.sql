@@ -0,0 +1,3 @@
+-- Keyset pagination of /api/sales/lines on (business_date, id)
+CREATE INDEX IF NOT EXISTS idx_sales_daily_lines_date_id ON sales_daily_lines (business_date, id);
+CREATE INDEX IF NOT EXISTS idx_sales_daily_lines_upload_date_id ON sales_daily_lines (upload_id, business_date, id);
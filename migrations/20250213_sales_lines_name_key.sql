@@ -0,0 +1,6 @@
+-- Stored normalized sales name, so applying sales_item_mappings finds lines by index
+-- instead of computing lower(trim(item_name)) over the whole table
+ALTER TABLE sales_daily_lines
+    ADD COLUMN IF NOT EXISTS name_key text GENERATED ALWAYS AS (lower(trim(item_name))) STORED;
+CREATE INDEX IF NOT EXISTS idx_sales_daily_lines_name_key_item ON sales_daily_lines (name_key, item_id);
+CREATE INDEX IF NOT EXISTS idx_sales_item_mappings_normalized ON sales_item_mappings (normalized);
@@ -0,0 +1,98 @@
+-- Item -> ingredient usage explosion
+-- item_ingredient_usage holds, for every item with a usable recipe, the base-unit quantity of
+-- each ingredient in one yield unit of the item, with sub-recipes already exploded.
+-- Triggers mark the items whose explosion a recipe, item yield or conversion change can
+-- affect in item_ingredient_usage_dirty; utils/item_usage.refresh_item_usage() recomputes
+-- those items and every item that uses them in a background job, queued by the writers and by
+-- reads that find marks left (those reads report their usage as possibly stale).
+
+CREATE TABLE IF NOT EXISTS item_ingredient_usage (
+    item_id integer NOT NULL,
+    ingredient_id integer NOT NULL,
+    base_qty_per_yield_unit double precision NOT NULL,
+    base_unit text,
+    issues jsonb NOT NULL DEFAULT '[]'::jsonb,
+    PRIMARY KEY (item_id, ingredient_id)
+);
+CREATE INDEX IF NOT EXISTS idx_item_ingredient_usage_ingredient ON item_ingredient_usage (ingredient_id, item_id);
+
+CREATE TABLE IF NOT EXISTS item_ingredient_usage_dirty (
+    item_id integer PRIMARY KEY
+);
+
+CREATE OR REPLACE FUNCTION mark_item_usage_dirty() RETURNS trigger AS $$
+DECLARE
+    item_ids integer[] := '{}';
+    ingredient_ids integer[] := '{}';
+    all_items boolean := TG_OP = 'TRUNCATE';
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        IF TG_TABLE_NAME = 'ingredient_conversions' THEN
+            -- Global rows feed every ingredient and every yield conversion
+            all_items := all_items OR COALESCE(NEW.is_global, FALSE);
+            ingredient_ids := ingredient_ids || NEW.ingredient_id;
+        ELSE
+            item_ids := item_ids || NEW.item_id;
+        END IF;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        IF TG_TABLE_NAME = 'ingredient_conversions' THEN
+            all_items := all_items OR COALESCE(OLD.is_global, FALSE);
+            ingredient_ids := ingredient_ids || OLD.ingredient_id;
+        ELSE
+            item_ids := item_ids || OLD.item_id;
+        END IF;
+    END IF;
+
+    IF all_items THEN
+        INSERT INTO item_ingredient_usage_dirty (item_id)
+        SELECT item_id FROM items
+        ON CONFLICT DO NOTHING;
+    ELSIF TG_TABLE_NAME = 'ingredient_conversions' THEN
+        INSERT INTO item_ingredient_usage_dirty (item_id)
+        SELECT DISTINCT item_id FROM recipes
+        WHERE source_type = 'ingredient' AND source_id = ANY(ingredient_ids)
+        ON CONFLICT DO NOTHING;
+    ELSE
+        INSERT INTO item_ingredient_usage_dirty (item_id)
+        SELECT DISTINCT i FROM unnest(item_ids) AS i WHERE i IS NOT NULL
+        ON CONFLICT DO NOTHING;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_recipes_item_usage ON recipes;
+CREATE TRIGGER trg_recipes_item_usage
+    AFTER INSERT OR UPDATE OR DELETE ON recipes
+    FOR EACH ROW EXECUTE FUNCTION mark_item_usage_dirty();
+DROP TRIGGER IF EXISTS trg_recipes_item_usage_truncate ON recipes;
+CREATE TRIGGER trg_recipes_item_usage_truncate
+    AFTER TRUNCATE ON recipes
+    FOR EACH STATEMENT EXECUTE FUNCTION mark_item_usage_dirty();
+
+DROP TRIGGER IF EXISTS trg_ingredient_conversions_item_usage ON ingredient_conversions;
+CREATE TRIGGER trg_ingredient_conversions_item_usage
+    AFTER INSERT OR UPDATE OR DELETE ON ingredient_conversions
+    FOR EACH ROW EXECUTE FUNCTION mark_item_usage_dirty();
+DROP TRIGGER IF EXISTS trg_ingredient_conversions_item_usage_truncate ON ingredient_conversions;
+CREATE TRIGGER trg_ingredient_conversions_item_usage_truncate
+    AFTER TRUNCATE ON ingredient_conversions
+    FOR EACH STATEMENT EXECUTE FUNCTION mark_item_usage_dirty();
+
+DROP TRIGGER IF EXISTS trg_items_item_usage ON items;
+CREATE TRIGGER trg_items_item_usage
+    AFTER INSERT OR DELETE ON items
+    FOR EACH ROW EXECUTE FUNCTION mark_item_usage_dirty();
+DROP TRIGGER IF EXISTS trg_items_yield_item_usage ON items;
+CREATE TRIGGER trg_items_yield_item_usage
+    AFTER UPDATE OF yield_qty, yield_unit ON items
+    FOR EACH ROW
+    WHEN (OLD.yield_qty IS DISTINCT FROM NEW.yield_qty OR OLD.yield_unit IS DISTINCT FROM NEW.yield_unit)
+    EXECUTE FUNCTION mark_item_usage_dirty();
+
+-- Build every item on the first refresh
+INSERT INTO item_ingredient_usage_dirty (item_id)
+SELECT item_id FROM items
+WHERE NOT EXISTS (SELECT 1 FROM item_ingredient_usage)
+ON CONFLICT DO NOTHING;
@@ -0,0 +1,99 @@
+-- Stored inventory reconciliation results
+-- reconciliation_input_days holds a change counter per day, bumped by triggers whenever an
+-- inventory count, purchase, adjustment or daily sales row of that day is written or removed.
+-- utils/reconciliation_cache fingerprints a reconciliation window as the sum of its days'
+-- counters plus cost_inputs_version (recipes, items, conversions); a stored result is served
+-- only while its fingerprint is unchanged, so it goes stale exactly when an input inside its
+-- window (or a recipe input) changes. reconciliation_results keeps one row per cache key, and
+-- rows computed before today (UTC) are deleted on the next store: the lookback cutoff is part of
+-- the fingerprint and moves at midnight, so they can never be served again.
+
+CREATE TABLE IF NOT EXISTS reconciliation_input_days (
+    day date PRIMARY KEY,
+    version bigint NOT NULL DEFAULT 0,
+    updated_at timestamptz DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS reconciliation_results (
+    cache_key text PRIMARY KEY,
+    start_entry_date date,
+    end_entry_date date,
+    lookback_days integer NOT NULL,
+    ingredient_filter text,
+    fingerprint text NOT NULL,
+    payload jsonb NOT NULL,
+    window_end timestamptz,
+    computed_at timestamptz DEFAULT now()
+);
+ALTER TABLE reconciliation_results ADD COLUMN IF NOT EXISTS window_end timestamptz;
+
+-- TG_ARGV[0] is the expression giving a row's day; the changed rows are read from the
+-- statement's transition tables.
+CREATE OR REPLACE FUNCTION bump_reconciliation_input_days() RETURNS trigger AS $$
+DECLARE
+    day_expr text := TG_ARGV[0];
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        UPDATE reconciliation_input_days SET version = version + 1, updated_at = now();
+        RETURN NULL;
+    END IF;
+    EXECUTE format(
+        'INSERT INTO reconciliation_input_days (day, version)
+         SELECT DISTINCT day, 1 FROM (%s) changed WHERE day IS NOT NULL
+         ON CONFLICT (day) DO UPDATE
+         SET version = reconciliation_input_days.version + 1, updated_at = now()',
+        CASE TG_OP
+            WHEN 'INSERT' THEN format('SELECT %s AS day FROM new_rows', day_expr)
+            WHEN 'DELETE' THEN format('SELECT %s AS day FROM old_rows', day_expr)
+            ELSE format('SELECT %s AS day FROM new_rows UNION ALL SELECT %s AS day FROM old_rows', day_expr, day_expr)
+        END
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    input record;
+BEGIN
+    FOR input IN
+        SELECT * FROM (VALUES
+            ('inventory_count_entries', 'created_at::date'),
+            ('inventory_adjustments', 'created_at::date'),
+            ('received_goods', 'receive_date'),
+            ('sales_item_daily', 'business_date')
+        ) AS t(tbl, day_expr)
+    LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_recon_insert ON %I', input.tbl, input.tbl);
+        EXECUTE format(
+            'CREATE TRIGGER trg_%s_recon_insert AFTER INSERT ON %I
+             REFERENCING NEW TABLE AS new_rows
+             FOR EACH STATEMENT EXECUTE FUNCTION bump_reconciliation_input_days(%L)',
+            input.tbl, input.tbl, input.day_expr);
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_recon_update ON %I', input.tbl, input.tbl);
+        EXECUTE format(
+            'CREATE TRIGGER trg_%s_recon_update AFTER UPDATE ON %I
+             REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+             FOR EACH STATEMENT EXECUTE FUNCTION bump_reconciliation_input_days(%L)',
+            input.tbl, input.tbl, input.day_expr);
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_recon_delete ON %I', input.tbl, input.tbl);
+        EXECUTE format(
+            'CREATE TRIGGER trg_%s_recon_delete AFTER DELETE ON %I
+             REFERENCING OLD TABLE AS old_rows
+             FOR EACH STATEMENT EXECUTE FUNCTION bump_reconciliation_input_days(%L)',
+            input.tbl, input.tbl, input.day_expr);
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_recon_truncate ON %I', input.tbl, input.tbl);
+        EXECUTE format(
+            'CREATE TRIGGER trg_%s_recon_truncate AFTER TRUNCATE ON %I
+             FOR EACH STATEMENT EXECUTE FUNCTION bump_reconciliation_input_days(%L)',
+            input.tbl, input.tbl, input.day_expr);
+
+        -- Every day already holding input rows gets a counter, so a later TRUNCATE bumps it
+        EXECUTE format(
+            'INSERT INTO reconciliation_input_days (day)
+             SELECT DISTINCT %s FROM %I WHERE %s IS NOT NULL
+             ON CONFLICT (day) DO NOTHING',
+            input.day_expr, input.tbl, input.day_expr);
+    END LOOP;
+END;
+$$;
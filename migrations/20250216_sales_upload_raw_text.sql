@@ -0,0 +1,6 @@
+-- Finished sales uploads no longer keep their raw file
+-- utils/sales_ingest clears sales_uploads.raw_text when an upload reaches a terminal status;
+-- this drops the text already stored for uploads that finished before that.
+UPDATE sales_uploads
+SET raw_text = NULL
+WHERE raw_text IS NOT NULL AND status NOT IN ('queued', 'processing');
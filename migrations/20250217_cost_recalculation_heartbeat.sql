@@ -0,0 +1,6 @@
+-- Heartbeat of bulk cost recalculation runs
+-- utils/cost_jobs sets heartbeat_at when a run starts and after every chunk it writes; a
+-- queued/running run is taken as abandoned once its heartbeat (started_at for runs from
+-- before this column) is STALE_RUN_MINUTES old, however long ago it started.
+ALTER TABLE cost_recalculation_runs ADD COLUMN IF NOT EXISTS heartbeat_at timestamptz;
+ALTER TABLE cost_recalculation_runs ALTER COLUMN heartbeat_at SET DEFAULT now();
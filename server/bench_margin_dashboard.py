@@ -0,0 +1,64 @@
+"""Latency benchmark for /api/prices/margin_dashboard.
+
+Calls the view in a request context against the database configured through
+the usual DB_* environment variables (skipping the auth hook) and prints
+p50/p95/max per window length. Run it before and after a change to the
+dashboard queries on the same data to compare plans.
+
+Run from the repository root:
+
+    python -m server.bench_margin_dashboard [iterations] [end_date]
+"""
+import contextlib
+import io
+import statistics
+import sys
+import time
+
+with contextlib.redirect_stdout(io.StringIO()):
+    # main prints its route table on import
+    from server.main import app
+from server.prices_routes import margin_dashboard
+
+WINDOWS = (30, 90, 180)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def run(days, iterations, end_date=None):
+    url = f"/api/prices/margin_dashboard?days={days}"
+    if end_date:
+        url += f"&end_date={end_date}"
+    samples = []
+    for n in range(iterations + 1):
+        with app.test_request_context(url):
+            started = time.perf_counter()
+            response = margin_dashboard()
+            elapsed = time.perf_counter() - started
+        if getattr(response, 'status_code', 200) != 200:
+            raise SystemExit(f"{url} returned {response.status_code}")
+        if n:
+            # The first call warms the cost cache and the connection pool
+            samples.append(elapsed)
+    return samples
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    end_date = sys.argv[2] if len(sys.argv) > 2 else None
+    print(f"{iterations} requests per window")
+    for days in WINDOWS:
+        samples = run(days, iterations, end_date)
+        print(
+            f"  days={days:<4} p50 {statistics.median(samples) * 1000:8.2f} ms"
+            f"   p95 {percentile(samples, 95) * 1000:8.2f} ms"
+            f"   max {max(samples) * 1000:8.2f} ms"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Micro-benchmark for the numeric cell parsers used by the CSV uploads.
+
+Builds rows shaped like docs/sales_daily_lines_example.csv (quantities such as
+"22.000", amounts such as "154.00", mostly repeated values, a few currency
+formatted cells) and times the previous per-cell parsers against
+utils.numeric, cell by cell and through parse_column().
+
+Run from the repository root:
+
+    python -m server.bench_numeric [rows]
+"""
+import random
+import re
+import sys
+import timeit
+from decimal import Decimal, InvalidOperation
+
+from server.utils.numeric import normalize_id, parse_column, parse_decimal, parse_float
+
+
+def old_sales_parse_numeric(val):
+    if val is None or val == '':
+        return None
+    try:
+        cleaned = re.sub(r"[^0-9.\-]", "", str(val))
+        if cleaned == '':
+            return None
+        return Decimal(cleaned)
+    except (InvalidOperation, ValueError):
+        return None
+
+
+def old_journal_parse_numeric(val):
+    if val is None:
+        return None
+    if isinstance(val, (int, float)):
+        return float(val)
+    try:
+        txt = str(val).strip()
+        if txt == '':
+            return None
+        cleaned = re.sub(r'[^0-9.\-]', '', txt)
+        if cleaned == '':
+            return None
+        return float(cleaned)
+    except Exception:
+        return None
+
+
+def old_normalize_id(val):
+    if val is None:
+        return None
+    s = str(val).strip()
+    if s == '':
+        return None
+    s = s.strip('"')
+    try:
+        d = Decimal(s)
+        try:
+            return str(int(d))
+        except (OverflowError, ValueError):
+            pass
+    except (InvalidOperation, ValueError):
+        pass
+    if '.' in s:
+        return s.split('.')[0]
+    return s
+
+
+def build_columns(rows, seed=7):
+    rng = random.Random(seed)
+    qty, amounts, ids = [], [], []
+    for _ in range(rows):
+        q = rng.choice([0, 0, 1, 1, 1, 2, 2, 3, 4, 6, 12, 22])
+        price = rng.choice([3.5, 5, 7, 8.5, 9, 12, 14.25])
+        amount = q * price
+        qty.append(f"{q}.000")
+        roll = rng.random()
+        if roll < 0.05:
+            amounts.append(f"${amount:,.2f}")
+        elif roll < 0.07:
+            amounts.append(f"({amount:,.2f})")
+        elif roll < 0.10:
+            amounts.append('')
+        else:
+            amounts.append(f"{amount:.2f}")
+        ids.append(str(rng.randint(100, 400)) if rng.random() < 0.8 else '4.00000012345E+11')
+    return qty, amounts, ids
+
+
+def bench(label, fn, number):
+    seconds = min(timeit.repeat(fn, number=number, repeat=3)) / number
+    print(f"  {label:<42} {seconds * 1000:9.2f} ms")
+    return seconds
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    qty, amounts, ids = build_columns(rows)
+    number = 3
+    print(f"{rows} rows x 2 numeric columns + 1 id column")
+
+    print("sales (Decimal)")
+    old = bench("old parse_numeric per cell", lambda: ([old_sales_parse_numeric(v) for v in qty], [old_sales_parse_numeric(v) for v in amounts]), number)
+    new = bench("parse_decimal per cell", lambda: ([parse_decimal(v) for v in qty], [parse_decimal(v) for v in amounts]), number)
+    col = bench("parse_column(parse_decimal)", lambda: (parse_column(qty), parse_column(amounts)), number)
+    print(f"  speedup: {old / new:.1f}x per cell, {old / col:.1f}x column")
+
+    print("journal (float)")
+    old = bench("old parse_numeric per cell", lambda: ([old_journal_parse_numeric(v) for v in qty], [old_journal_parse_numeric(v) for v in amounts]), number)
+    new = bench("parse_float per cell", lambda: ([parse_float(v) for v in qty], [parse_float(v) for v in amounts]), number)
+    col = bench("parse_column(parse_float)", lambda: (parse_column(qty, parse_float), parse_column(amounts, parse_float)), number)
+    print(f"  speedup: {old / new:.1f}x per cell, {old / col:.1f}x column")
+
+    print("ids")
+    old = bench("old normalize_id", lambda: [old_normalize_id(v) for v in ids], number)
+    new = bench("normalize_id", lambda: [normalize_id(v) for v in ids], number)
+    print(f"  speedup: {old / new:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,7 @@
 from flask import Blueprint, request, jsonify
 from .utils.db import get_db_cursor
+from .utils.cost_propagation import propagate_cost_changes
+from .utils.item_usage import queue_usage_refresh
 
 conversions_bp = Blueprint('conversions', __name__, url_prefix='/api')
 
@@ -82,6 +84,11 @@ def create_conversion():
             (ingredient_id if not is_global else None, from_unit, to_unit, factor, is_global)
         )
         row = cursor.fetchone()
+        try:
+            propagate_cost_changes('conversion', conversions=[(row.get('ingredient_id') if not row.get('is_global') else None, row.get('from_unit'), row.get('to_unit'))])
+        except Exception as e:
+            print(f"Cost propagation failed for conversion {row.get('id')}: {e}")
+        queue_usage_refresh()
         return jsonify(row), 201
     finally:
         try:
@@ -98,13 +105,18 @@ def delete_conversion(conv_id):
             """
             DELETE FROM ingredient_conversions
             WHERE id = %s
-            RETURNING id
+            RETURNING id, ingredient_id, from_unit, to_unit, is_global
             """,
             (conv_id,)
         )
         deleted = cursor.fetchone()
         if not deleted:
             return jsonify({"error": "Conversion not found"}), 404
+        try:
+            propagate_cost_changes('conversion', conversions=[(deleted.get('ingredient_id') if not deleted.get('is_global') else None, deleted.get('from_unit'), deleted.get('to_unit'))])
+        except Exception as e:
+            print(f"Cost propagation failed for conversion {conv_id}: {e}")
+        queue_usage_refresh()
         return jsonify({"status": "deleted", "id": deleted['id']})
     finally:
         try:
@@ -1,8 +1,11 @@
-from collections import defaultdict
 from datetime import datetime, timedelta, timezone, date
 from flask import Blueprint, request, jsonify
 from .utils.db import get_db_cursor
 from .utils.conversion_helper import convert_to_base
+from .utils.cost_cache import cached_graph, conversion_index
+from .utils.item_usage import items_using, load_item_usage, usage_pending
+from .utils.reconciliation import ReconciliationEngine, ensure_datetime
+from .utils.reconciliation_cache import cache_key, input_fingerprint, input_window, load_reconciliation, store_reconciliation
 import traceback
 
 inventory_bp = Blueprint('inventory', __name__)
@@ -18,6 +21,7 @@ def upload_scan():
 
     cursor = get_db_cursor()
     try:
+        index = conversion_index()
         for scan in scans:
             barcode = scan.get('barcode') or None
             quantity = scan.get('quantity')
@@ -44,7 +48,7 @@ def upload_scan():
                     return jsonify({'error': f"Invalid recorded_date '{recorded_date}'. Use YYYY-MM-DD or ISO datetime."}), 400
 
             try:
-                quantity_base, base_unit = convert_to_base(source_id, source_type, unit, quantity)
+                quantity_base, base_unit = convert_to_base(source_id, source_type, unit, quantity, index=index)
             except Exception as e:
                 print(f"Conversion error: {e}")  # Debug log
                 quantity_base = quantity
@@ -343,7 +347,7 @@ def update_inventory_entry(entry_id):
         if recorded_date is not None:
             if recorded_date == '':
                 return jsonify({'error': 'recorded_date cannot be blank'}), 400
-            parsed = _ensure_datetime(recorded_date)
+            parsed = ensure_datetime(recorded_date)
             if not parsed and isinstance(recorded_date, str) and len(recorded_date.strip()) == 10:
                 try:
                     parsed = datetime.strptime(recorded_date.strip(), '%Y-%m-%d').replace(tzinfo=timezone.utc)
@@ -545,12 +549,13 @@ def expected_inventory_batch():
             rows = cursor.fetchall()
 
             totals = {}
+            index = conversion_index()
             for r in rows:
                 iid = r.get('ingredient_id')
                 units = r.get('units')
                 unit_type = r.get('unit_type')
                 try:
-                    qty_base, base_unit = convert_to_base(iid, 'ingredient', unit_type, units)
+                    qty_base, base_unit = convert_to_base(iid, 'ingredient', unit_type, units, index=index)
                 except Exception:
                     # if conversion fails, skip
                     continue
@@ -604,70 +609,6 @@ def expected_inventory_batch():
         cursor.close()
 
 
-def _ensure_datetime(val):
-    """Normalize DB values (datetime/date/str) to timezone-aware UTC datetimes."""
-    if isinstance(val, datetime):
-        return val if val.tzinfo else val.replace(tzinfo=timezone.utc)
-    if isinstance(val, date):
-        return datetime.combine(val, datetime.min.time(), tzinfo=timezone.utc)
-    if isinstance(val, str):
-        try:
-            # Handle trailing Z or offset-naive strings
-            cleaned = val.replace('Z', '+00:00') if val.endswith('Z') else val
-            return datetime.fromisoformat(cleaned)
-        except Exception:
-            return None
-    return None
-
-
-def _build_conversion_map(cursor, ingredient_ids):
-    """Return a conversion map keyed by (from_unit, to_unit) including global and per-ingredient rows."""
-    cursor.execute("""
-        SELECT ingredient_id, LOWER(from_unit) AS from_unit, LOWER(to_unit) AS to_unit, factor, is_global
-        FROM ingredient_conversions
-        WHERE is_global = TRUE OR ingredient_id = ANY(%s)
-    """, (ingredient_ids or [0],))
-    rows = cursor.fetchall()
-    conv = defaultdict(dict)
-    for r in rows:
-        try:
-            ing_id = r.get('ingredient_id') or 'global'
-            key = ((r.get('from_unit') or '').strip().lower(), (r.get('to_unit') or '').strip().lower())
-            conv[ing_id][key] = float(r.get('factor'))
-        except Exception:
-            continue
-    return conv
-
-
-def _conversion_factor(from_unit, to_unit, conv_map, ingredient_id=None):
-    """Lookup factor for ingredient-specific then global conversions."""
-    if not from_unit or not to_unit:
-        return None
-    key = (str(from_unit).strip().lower(), str(to_unit).strip().lower())
-    ing_key = ingredient_id if ingredient_id is not None else 'global'
-    return conv_map.get(ing_key, {}).get(key) or conv_map.get('global', {}).get(key)
-
-
-def _convert_quantity(qty, from_unit, to_unit, conv_map, ingredient_id=None):
-    """Convert qty between arbitrary units using stored conversion factors (direct or inverse)."""
-    if to_unit is None or from_unit is None or str(from_unit).strip().lower() == str(to_unit).strip().lower():
-        return qty, None  # no conversion needed
-    factor = _conversion_factor(from_unit, to_unit, conv_map, ingredient_id)
-    if factor is not None:
-        try:
-            return float(qty) * float(factor), None
-        except Exception as e:
-            return qty, str(e)
-    # Try inverse if available
-    inv = _conversion_factor(to_unit, from_unit, conv_map, ingredient_id)
-    if inv is not None:
-        try:
-            return float(qty) / float(inv), None
-        except Exception as e:
-            return qty, str(e)
-    return qty, 'missing_conversion'
-
-
 def _parse_iso_date(value):
     if not value:
         return None
@@ -708,8 +649,8 @@ def inventory_reconciliation_snapshots():
                 'snapshot_date': snapshot_date.isoformat() if snapshot_date else None,
                 'entry_count': row.get('entry_count') or 0,
                 'ingredient_count': row.get('ingredient_count') or 0,
-                'first_created_at': (_ensure_datetime(row.get('first_created_at')) or None).isoformat() if row.get('first_created_at') else None,
-                'last_created_at': (_ensure_datetime(row.get('last_created_at')) or None).isoformat() if row.get('last_created_at') else None
+                'first_created_at': (ensure_datetime(row.get('first_created_at')) or None).isoformat() if row.get('first_created_at') else None,
+                'last_created_at': (ensure_datetime(row.get('last_created_at')) or None).isoformat() if row.get('last_created_at') else None
             })
         return jsonify({'results': snapshots}), 200
     except Exception as e:
@@ -727,6 +668,10 @@ def inventory_reconciliation_latest():
     """
     Compute variances between two inventory snapshots, factoring purchases,
     adjustments, and sales-driven usage (via recipes).
+
+    Snapshot-date comparisons that ended before today are stored per set of
+    arguments and served again until an input inside their window changes
+    (see utils/reconciliation_cache).
     """
     lookback_days = request.args.get('lookback_days', type=int) or 45
     ingredient_filter = request.args.get('ingredient_id')
@@ -738,10 +683,30 @@ def inventory_reconciliation_latest():
         latest_counts = {}
         previous_counts = {}
         now_ts = datetime.now(timezone.utc)
-        cutoff = now_ts - timedelta(days=lookback_days)
+        # Midnight UTC, so a day's requests share one window (and stored results stay valid for it)
+        cutoff = datetime.combine((now_ts - timedelta(days=lookback_days)).date(), datetime.min.time(), tzinfo=timezone.utc)
         if start_entry_date and end_entry_date and start_entry_date > end_entry_date:
             return jsonify({'error': 'start_entry_date must be on or before end_entry_date'}), 400
 
+        # Inputs are fingerprinted before they are read, so a stored result is never newer than its fingerprint
+        stored_key = cache_key(start_entry_date, end_entry_date, lookback_days, ingredient_filter)
+        window = input_window(start_entry_date, end_entry_date, cutoff, now_ts.date())
+        fingerprint = input_fingerprint(cursor, window, cutoff)
+        stored = load_reconciliation(cursor, stored_key, fingerprint)
+        if stored is not None:
+            stored, stored_window_end = stored
+            cursor.execute(
+                "SELECT ingredient_id, name FROM ingredients WHERE ingredient_id = ANY(%s)",
+                ([r.get('ingredient_id') for r in stored['results']],)
+            )
+            ing_name = {r['ingredient_id']: r.get('name') for r in cursor.fetchall()}
+            for result in stored['results']:
+                iid = result.get('ingredient_id')
+                result['ingredient_name'] = ing_name.get(iid) or f'Ingredient {iid}'
+            stored['meta']['window_start'] = cutoff.isoformat()
+            stored['meta']['window_end'] = (ensure_datetime(stored_window_end) or now_ts).isoformat()
+            return jsonify(stored), 200
+
         if start_entry_date and end_entry_date:
             cursor.execute("""
                 WITH start_counts AS (
@@ -831,7 +796,7 @@ def inventory_reconciliation_latest():
             if not latest_counts:
                 return jsonify({'results': [], 'meta': {'message': 'No inventory counts found'}})
 
-            filtered_ids = [iid for iid, row in latest_counts.items() if (_ensure_datetime(row.get('created_at')) or cutoff) >= cutoff]
+            filtered_ids = [iid for iid, row in latest_counts.items() if (ensure_datetime(row.get('created_at')) or cutoff) >= cutoff]
 
             if ingredient_filter and str(ingredient_filter) in map(str, filtered_ids):
                 filtered_ids = [int(ingredient_filter)]
@@ -844,8 +809,13 @@ def inventory_reconciliation_latest():
         ing_rows = cursor.fetchall()
         ing_name = {r['ingredient_id']: r.get('name') for r in ing_rows}
 
-        # Build conversion map (ingredient-specific + global) for all relevant ingredients
-        conv_map = _build_conversion_map(cursor, filtered_ids)
+        # Exploded recipe usage of the items that feed into the filtered ingredients;
+        # items and conversions come from the cached recipe graph
+        relevant_item_ids = items_using(cursor, filtered_ids)
+        usage_stale = usage_pending(cursor)
+        usage = load_item_usage(cursor, item_ids=relevant_item_ids)
+        graph = cached_graph(full=True)
+        engine = ReconciliationEngine(graph.conversions, graph.items, usage)
 
         # Establish global time bounds for fetching purchases/adjustments/sales
         interval_starts = []
@@ -853,8 +823,8 @@ def inventory_reconciliation_latest():
         for iid in filtered_ids:
             latest_row = latest_counts.get(iid)
             prev_row = previous_counts.get(iid)
-            ldt = _ensure_datetime(latest_row.get('created_at')) if latest_row else None
-            pdt = _ensure_datetime(prev_row.get('created_at')) if prev_row else None
+            ldt = ensure_datetime(latest_row.get('created_at')) if latest_row else None
+            pdt = ensure_datetime(prev_row.get('created_at')) if prev_row else None
             if ldt:
                 interval_ends.append(ldt)
             if pdt:
@@ -874,27 +844,6 @@ def inventory_reconciliation_latest():
         """, (filtered_ids, purchases_start, purchases_end))
         purchase_rows = cursor.fetchall()
 
-        purchases_by_ing = defaultdict(list)
-        for r in purchase_rows:
-            iid = r.get('ingredient_id')
-            qty = r.get('units')
-            unit_type = r.get('unit_type')
-            try:
-                qty_base, base_unit = convert_to_base(iid, 'ingredient', unit_type, qty)
-                qty_base = float(qty_base)
-            except Exception:
-                qty_base = float(qty or 0)
-                base_unit = unit_type
-            ts = _ensure_datetime(r.get('receive_date')) or global_start
-            purchases_by_ing[iid].append({
-                'ts': ts,
-                'quantity': qty,
-                'unit': unit_type,
-                'quantity_base': qty_base,
-                'base_unit': base_unit or unit_type
-            })
-
-        # Fetch adjustments
         cursor.execute("""
             SELECT source_id AS ingredient_id, quantity_base, base_unit, created_at
             FROM inventory_adjustments
@@ -904,359 +853,193 @@ def inventory_reconciliation_latest():
               AND created_at <= %s
         """, (filtered_ids, global_start, global_end))
         adjustment_rows = cursor.fetchall()
-        adjustments_by_ing = defaultdict(list)
-        for r in adjustment_rows:
-            iid = r.get('ingredient_id')
-            ts = _ensure_datetime(r.get('created_at')) or global_start
-            try:
-                qty_base = float(r.get('quantity_base') or 0)
-            except Exception:
-                qty_base = 0.0
-            adjustments_by_ing[iid].append({'ts': ts, 'quantity_base': qty_base, 'base_unit': r.get('base_unit')})
-
-        # Preload items, recipes, and conversions for usage calculations
-        cursor.execute("SELECT * FROM items")
-        item_rows = cursor.fetchall()
-        items_lookup = {r.get('item_id'): r for r in item_rows}
-
-        cursor.execute("SELECT * FROM recipes WHERE archived IS NULL OR archived = FALSE")
-        recipe_rows = cursor.fetchall()
-        recipes_lookup = defaultdict(list)
-        for r in recipe_rows:
-            recipes_lookup[r.get('item_id')].append(r)
-
-        # Build a dependency map so we only pull sales for items that feed into the filtered ingredients
-        item_components = defaultdict(list)
-        for r in recipe_rows:
-            item_components[r.get('item_id')].append({'source_type': r.get('source_type'), 'source_id': r.get('source_id')})
-
-        memo_depends = {}
-
-        def depends_on_filtered(item_id, visiting=None):
-            visiting = visiting or set()
-            if item_id in memo_depends:
-                return memo_depends[item_id]
-            if item_id in visiting:
-                memo_depends[item_id] = False
-                return False
-            visiting.add(item_id)
-            comps = item_components.get(item_id, [])
-            for c in comps:
-                if c.get('source_type') == 'ingredient' and c.get('source_id') in filtered_ids:
-                    memo_depends[item_id] = True
-                    return True
-                if c.get('source_type') == 'item':
-                    child_id = c.get('source_id')
-                    if child_id and depends_on_filtered(child_id, visiting=set(visiting)):
-                        memo_depends[item_id] = True
-                        return True
-            memo_depends[item_id] = False
-            return False
-
-        relevant_item_ids = [iid for iid in item_components.keys() if depends_on_filtered(iid)]
-
-        # Fetch sales rows in the window but only for relevant items (bounded by lookback cutoff)
+
+        # Daily sales (bounded by lookback cutoff), only for items that feed into the filtered ingredients
         sales_rows = []
         if relevant_item_ids:
             cursor.execute("""
-                SELECT business_date, item_id, item_name, item_qty
-                FROM sales_daily_lines
+                SELECT business_date, item_id, MIN(item_name) AS item_name, SUM(qty) AS item_qty
+                FROM sales_item_daily
                 WHERE business_date >= %s
                   AND business_date <= %s
                   AND item_id = ANY(%s)
+                GROUP BY business_date, item_id
             """, (cutoff, global_end, relevant_item_ids))
             sales_rows = cursor.fetchall()
 
-        usage_cache = {}
-        skipped_sales = {'no_item_id': 0, 'missing_recipe': defaultdict(float), 'compute_errors': defaultdict(float)}
-
-        def resolve_usage_per_unit(item_id, output_unit, visited=None):
-            key = (item_id, (output_unit or '').strip().lower())
-            if key in usage_cache:
-                return usage_cache[key]
+        engine.load_events(purchase_rows, adjustment_rows, sales_rows, default_ts=global_start)
 
-            visited = visited or set()
-            if item_id in visited:
-                usage_cache[key] = {'status': 'error', 'issue': 'circular', 'ingredients': {}}
-                return usage_cache[key]
-            visited.add(item_id)
-
-            item = items_lookup.get(item_id)
-            comps = recipes_lookup.get(item_id, [])
-            if not item or not comps:
-                usage_cache[key] = {'status': 'error', 'issue': 'missing_recipe', 'ingredients': {}}
-                return usage_cache[key]
-
-            totals = defaultdict(lambda: {'quantity_base': 0.0, 'base_unit': None})
-            issues = []
+        results = []
+        for iid in filtered_ids:
+            result = engine.reconcile(
+                iid, latest_counts.get(iid), previous_counts.get(iid), cutoff, global_end,
+                start_entry_date=start_entry_date, end_entry_date=end_entry_date
+            )
+            result['ingredient_name'] = ing_name.get(iid) or f'Ingredient {iid}'
+            results.append(result)
 
-            for comp in comps:
-                c_qty = comp.get('quantity')
-                c_unit = comp.get('unit')
-                try:
-                    qty_val = float(c_qty)
-                except Exception:
-                    issues.append({'component': comp, 'issue': 'invalid_quantity'})
-                    continue
+        # Sort by largest variance magnitude first
+        results.sort(key=lambda r: abs(r['variance_base'] or 0), reverse=True)
 
-                if comp.get('source_type') == 'ingredient':
-                    iid = comp.get('source_id')
-                    try:
-                        qty_base, base_unit = convert_to_base(iid, 'ingredient', c_unit, qty_val)
-                        qty_base = float(qty_base)
-                    except Exception:
-                        qty_base = qty_val
-                        base_unit = c_unit
-                        issues.append({'component': comp, 'issue': 'missing_conversion'})
-                    cur = totals[iid]
-                    cur['quantity_base'] += qty_base
-                    cur['base_unit'] = cur['base_unit'] or base_unit
-                elif comp.get('source_type') == 'item':
-                    child_id = comp.get('source_id')
-                    child_usage = resolve_usage_per_unit(child_id, c_unit, visited=set(visited))
-                    if child_usage.get('status') != 'ok':
-                        issues.append({'component': comp, 'issue': child_usage.get('issue')})
-                        continue
-                    for iid, info in child_usage['ingredients'].items():
-                        cur = totals[iid]
-                        cur['quantity_base'] += info['quantity_base'] * qty_val
-                        cur['base_unit'] = cur['base_unit'] or info.get('base_unit')
-                else:
-                    issues.append({'component': comp, 'issue': 'unknown_source_type'})
+        meta = {
+            'ingredients_scanned': len(filtered_ids),
+            **engine.skipped_sales_meta(),
+            'comparison_mode': 'snapshot_dates' if start_entry_date and end_entry_date else 'lookback_latest',
+            'start_entry_date': start_entry_date.isoformat() if start_entry_date else None,
+            'end_entry_date': end_entry_date.isoformat() if end_entry_date else None,
+            'window_start': cutoff.isoformat() if isinstance(cutoff, datetime) else None,
+            'window_end': (max(interval_ends) if interval_ends else now_ts).isoformat(),
+            'usage_stale': usage_stale
+        }
 
-            # Yield scaling: divide totals by effective yield to get per-unit usage
-            yield_qty = item.get('yield_qty')
-            yield_unit = (item.get('yield_unit') or '').strip().lower() or output_unit or 'each'
+        payload = {'results': results, 'meta': meta}
+        if interval_ends and not usage_stale:
+            # Without any later count the window runs to now, past what the fingerprint covers;
+            # usage read while a refresh is pending may predate the cost version fingerprinted
+            store_reconciliation(
+                cursor, stored_key, fingerprint, payload, max(interval_ends),
+                start_entry_date, end_entry_date, lookback_days, ingredient_filter
+            )
+        return jsonify(payload), 200
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'error': 'Database error', 'details': str(e)}), 500
+    finally:
+        try:
+            cursor.close()
+        except Exception:
+            pass
 
-            try:
-                yield_qty_val = float(yield_qty) if yield_qty is not None else 1.0
-            except Exception:
-                yield_qty_val = 1.0
-
-            output_unit_norm = (output_unit or yield_unit or '').strip().lower()
-            factor = 1.0
-            if yield_unit != output_unit_norm:
-                conv = _conversion_factor(yield_unit, output_unit_norm, conv_map, None)
-                if conv:
-                    factor = float(conv)
-                else:
-                    issues.append({'issue': 'missing_yield_conversion', 'from': yield_unit, 'to': output_unit_norm})
 
-            effective_yield = yield_qty_val * factor if yield_qty_val else 1.0
-            if effective_yield == 0:
-                effective_yield = 1.0
-                issues.append({'issue': 'zero_effective_yield'})
+@inventory_bp.route('/api/inventory/discrepancies', methods=['GET'])
+def inventory_discrepancies():
+    """
+    Variance between each of an ingredient's last counts and the count before it.
 
-            per_unit = {}
-            for iid, info in totals.items():
-                per_unit[iid] = {
-                    'quantity_base': info['quantity_base'] / effective_yield if effective_yield else info['quantity_base'],
-                    'base_unit': info.get('base_unit')
-                }
+    The last limit_counts counts within lookback_days are each reconciled against
+    their predecessor (which may be older than the lookback) on one engine, so
+    purchases, adjustments and sales usage are loaded and converted once for all
+    pairs. Most recent count first.
+    """
+    ingredient_id = request.args.get('ingredient_id', type=int)
+    if not ingredient_id:
+        return jsonify({'error': 'ingredient_id is required'}), 400
+    lookback_days = request.args.get('lookback_days', type=int) or 30
+    limit_counts = max(1, min(request.args.get('limit_counts', type=int) or 5, 50))
 
-            status = 'ok' if not issues else 'warning'
-            usage_cache[key] = {'status': status, 'issue': issues, 'ingredients': per_unit, 'recipe_unit': output_unit}
-            return usage_cache[key]
+    cursor = get_db_cursor()
+    try:
+        now_ts = datetime.now(timezone.utc)
+        cutoff = now_ts - timedelta(days=lookback_days)
+        # The last counts in the window plus the one before the oldest of them
+        cursor.execute("""
+            WITH recent AS (
+                SELECT id, quantity, unit, quantity_base, base_unit, location, created_at, user_id, FALSE AS baseline
+                FROM inventory_count_entries
+                WHERE source_type = 'ingredient'
+                  AND source_id = %s
+                  AND created_at >= %s
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s
+            ),
+            baseline AS (
+                SELECT id, quantity, unit, quantity_base, base_unit, location, created_at, user_id, TRUE AS baseline
+                FROM inventory_count_entries
+                WHERE source_type = 'ingredient'
+                  AND source_id = %s
+                  AND created_at < (SELECT MIN(created_at) FROM recent)
+                ORDER BY created_at DESC, id DESC
+                LIMIT 1
+            )
+            SELECT * FROM recent
+            UNION ALL
+            SELECT * FROM baseline
+            ORDER BY created_at, id
+        """, (ingredient_id, cutoff, limit_counts, ingredient_id))
+        counts = cursor.fetchall()
+        if not counts:
+            return jsonify({'results': [], 'meta': {'ingredient_id': ingredient_id, 'message': 'No inventory counts found in the selected window'}}), 200
+
+        first_ts = ensure_datetime(counts[0].get('created_at')) or cutoff
+        last_ts = ensure_datetime(counts[-1].get('created_at')) or now_ts
+
+        relevant_item_ids = items_using(cursor, [ingredient_id])
+        usage_stale = usage_pending(cursor)
+        usage = load_item_usage(cursor, item_ids=relevant_item_ids)
+        graph = cached_graph(full=True)
+        engine = ReconciliationEngine(graph.conversions, graph.items, usage)
 
-        sales_usage_events = defaultdict(list)
+        cursor.execute("""
+            SELECT ingredient_id, units, unit_type, receive_date
+            FROM received_goods
+            WHERE ingredient_id = %s
+              AND receive_date >= %s
+              AND receive_date <= %s
+        """, (ingredient_id, first_ts.date(), last_ts.date()))
+        purchase_rows = cursor.fetchall()
 
-        for row in sales_rows:
-            item_id = row.get('item_id')
-            qty_raw = row.get('item_qty')
-            try:
-                qty_sold = float(qty_raw or 0)
-            except Exception:
-                qty_sold = 0.0
-            if not qty_sold:
-                continue
+        cursor.execute("""
+            SELECT source_id AS ingredient_id, quantity_base, base_unit, created_at
+            FROM inventory_adjustments
+            WHERE source_type = 'ingredient'
+              AND source_id = %s
+              AND created_at > %s
+              AND created_at <= %s
+        """, (ingredient_id, first_ts, last_ts))
+        adjustment_rows = cursor.fetchall()
 
-            ts = _ensure_datetime(row.get('business_date')) or global_start
-            if not item_id:
-                skipped_sales['no_item_id'] += qty_sold
-                continue
+        sales_rows = []
+        if relevant_item_ids:
+            cursor.execute("""
+                SELECT business_date, item_id, MIN(item_name) AS item_name, SUM(qty) AS item_qty
+                FROM sales_item_daily
+                WHERE business_date >= %s
+                  AND business_date <= %s
+                  AND item_id = ANY(%s)
+                GROUP BY business_date, item_id
+            """, (first_ts.date(), last_ts, relevant_item_ids))
+            sales_rows = cursor.fetchall()
 
-            usage = resolve_usage_per_unit(item_id, (items_lookup.get(item_id) or {}).get('yield_unit'))
-            if usage.get('status') == 'error':
-                skipped_sales['missing_recipe'][item_id] += qty_sold
-                continue
-            if usage.get('status') != 'ok':
-                skipped_sales['compute_errors'][item_id] += qty_sold
-
-            for iid, info in usage.get('ingredients', {}).items():
-                amount = (info.get('quantity_base') or 0) * qty_sold
-                sales_usage_events[iid].append({
-                    'ts': ts,
-                    'quantity_base': amount,
-                    'base_unit': info.get('base_unit'),
-                    'recipe_unit': usage.get('recipe_unit'),
-                    'item_id': item_id,
-                    'item_name': row.get('item_name') or (items_lookup.get(item_id) or {}).get('name'),
-                    'qty_sold': qty_sold
-                })
+        engine.load_events(purchase_rows, adjustment_rows, sales_rows, default_ts=first_ts)
 
         results = []
-        for iid in filtered_ids:
-            latest_row = latest_counts.get(iid)
-            prev_row = previous_counts.get(iid)
-
-            latest_dt = _ensure_datetime(latest_row.get('created_at')) if latest_row else None
-            prev_dt = _ensure_datetime(prev_row.get('created_at')) if prev_row else None
-            effective_start_dt = max([d for d in [prev_dt, cutoff] if d], default=cutoff)
-            start_date_cutoff = prev_dt.date() if prev_dt else (start_entry_date or (effective_start_dt.date() if effective_start_dt else None))
-            end_date_cutoff = latest_dt.date() if latest_dt else (end_entry_date or (global_end.date() if isinstance(global_end, datetime) else None))
-
-            # Pick a canonical unit: prefer latest count's base_unit, else unit, else previous, else first purchase unit
-            canonical_unit = (
-                (latest_row.get('base_unit') or latest_row.get('unit') or '').strip().lower()
-                if latest_row else ''
-            )
-            if not canonical_unit and prev_row:
-                canonical_unit = (prev_row.get('base_unit') or prev_row.get('unit') or '').strip().lower()
-            if not canonical_unit:
-                p_list = purchases_by_ing.get(iid, [])
-                if p_list:
-                    canonical_unit = (p_list[0].get('base_unit') or p_list[0].get('unit') or '').strip().lower()
-            canonical_unit = canonical_unit or None
-            conversion_issues = []
-
-            purchases = 0.0
-            purchase_details = []
-            for e in purchases_by_ing.get(iid, []):
-                ts = e.get('ts')
-                if start_date_cutoff and ts and ts.date() <= start_date_cutoff:
-                    continue
-                if end_date_cutoff and ts and ts.date() > end_date_cutoff:
-                    continue
-                purchase_details.append({
-                    'ts': ts.isoformat() if ts else None,
-                    'quantity': e.get('quantity'),
-                    'unit': e.get('unit'),
-                    'quantity_base': e.get('quantity_base'),
-                    'base_unit': e.get('base_unit')
-                })
-                qty_can, err = _convert_quantity(e.get('quantity_base'), e.get('base_unit'), canonical_unit, conv_map, iid)
-                if err:
-                    conversion_issues.append({'type': 'purchase', 'unit': e.get('base_unit'), 'target': canonical_unit, 'detail': err})
-                    qty_can = e.get('quantity_base')
-                try:
-                    purchases += float(qty_can or 0)
-                except Exception:
-                    purchases += 0.0
-            # Sort purchases descending by timestamp for display
-            purchase_details.sort(key=lambda x: x.get('ts') or '', reverse=True)
-            purchase_details = purchase_details[:10]
-            adjustments = 0.0
-            for e in adjustments_by_ing.get(iid, []):
-                if (e['ts'] and e['ts'] < effective_start_dt) or (latest_dt and e['ts'] > latest_dt):
-                    continue
-                qty_can, err = _convert_quantity(e.get('quantity_base'), e.get('base_unit'), canonical_unit, conv_map, iid)
-                if err:
-                    conversion_issues.append({'type': 'adjustment', 'unit': e.get('base_unit'), 'target': canonical_unit, 'detail': err})
-                    qty_can = e.get('quantity_base')
-                try:
-                    adjustments += float(qty_can or 0)
-                except Exception:
-                    adjustments += 0.0
-
-            usage = 0.0
-            for e in sales_usage_events.get(iid, []):
-                if (e['ts'] and e['ts'] < effective_start_dt) or (latest_dt and e['ts'] > latest_dt):
-                    continue
-                qty_can, err = _convert_quantity(e.get('quantity_base'), e.get('base_unit'), canonical_unit, conv_map, iid)
-                if err:
-                    conversion_issues.append({'type': 'sales_usage', 'unit': e.get('base_unit'), 'target': canonical_unit, 'detail': err})
-                    qty_can = e.get('quantity_base')
-                try:
-                    usage += float(qty_can or 0)
-                except Exception:
-                    usage += 0.0
-
-            expected = None
-            variance = None
-            if prev_row:
-                try:
-                    prev_qty_can, err_prev = _convert_quantity(prev_row.get('quantity_base'), prev_row.get('base_unit'), canonical_unit, conv_map, iid)
-                    if err_prev:
-                        conversion_issues.append({'type': 'previous_count', 'unit': prev_row.get('base_unit'), 'target': canonical_unit, 'detail': err_prev})
-                        prev_qty_can = prev_row.get('quantity_base')
-                    latest_qty_can, err_latest = _convert_quantity(latest_row.get('quantity_base'), latest_row.get('base_unit'), canonical_unit, conv_map, iid)
-                    if err_latest:
-                        conversion_issues.append({'type': 'latest_count', 'unit': latest_row.get('base_unit'), 'target': canonical_unit, 'detail': err_latest})
-                        latest_qty_can = latest_row.get('quantity_base')
-                    expected = float(prev_qty_can or 0) + purchases + adjustments - usage
-                    variance = float(latest_qty_can or 0) - expected
-                except Exception:
-                    expected = None
-                    variance = None
-
-            breakdown_map = defaultdict(lambda: {'item_id': None, 'item_name': None, 'qty_sold': 0.0, 'usage_base': 0.0, 'base_unit': canonical_unit, 'recipe_unit': None})
-            for e in sales_usage_events.get(iid, []):
-                if effective_start_dt and e['ts'] and e['ts'] < effective_start_dt:
-                    continue
-                if latest_dt and e['ts'] > latest_dt:
-                    continue
-                k = e.get('item_id') or e.get('item_name')
-                entry = breakdown_map[k]
-                entry['item_id'] = e.get('item_id')
-                entry['item_name'] = e.get('item_name')
-                entry['qty_sold'] += e.get('qty_sold') or 0
-                entry['recipe_unit'] = entry['recipe_unit'] or e.get('recipe_unit')
-                # Store usage in canonical if possible
-                qty_can, err = _convert_quantity(e.get('quantity_base'), e.get('base_unit'), canonical_unit, conv_map, iid)
-                if err:
-                    conversion_issues.append({'type': 'sales_breakdown', 'unit': e.get('base_unit'), 'target': canonical_unit, 'detail': err})
-                    qty_can = e.get('quantity_base')
-                entry['usage_base'] += qty_can or 0
-
-            breakdown = sorted(breakdown_map.values(), key=lambda x: abs(x['usage_base']), reverse=True)
-
+        for i in reversed(range(len(counts))):
+            latest_row = counts[i]
+            if latest_row.get('baseline'):
+                continue
+            prev_row = counts[i - 1] if i > 0 else None
+            result = engine.reconcile(ingredient_id, latest_row, prev_row, first_ts, last_ts)
+            latest = result['latest_count']
+            previous = result['previous_count']
+            current = latest.get('quantity_base') if latest.get('quantity_base') is not None else latest.get('quantity')
+            prev_qty = previous.get('quantity_base') if previous else None
             results.append({
-                'ingredient_id': iid,
-                'ingredient_name': ing_name.get(iid) or f'Ingredient {iid}',
-                'canonical_unit': canonical_unit,
-                'latest_count': {
-                    'quantity_base': latest_row.get('quantity_base'),
-                    'base_unit': latest_row.get('base_unit') or latest_row.get('unit'),
-                    'quantity': latest_row.get('quantity'),
-                    'unit': latest_row.get('unit'),
-                    'location': latest_row.get('location'),
-                    'created_at': latest_dt.isoformat() if latest_dt else None,
-                    'user_id': latest_row.get('user_id')
-                },
-                'previous_count': {
-                    'quantity_base': prev_row.get('quantity_base') if prev_row else None,
-                    'base_unit': prev_row.get('base_unit') if prev_row else None,
-                    'quantity': prev_row.get('quantity') if prev_row else None,
-                    'unit': prev_row.get('unit') if prev_row else None,
-                    'location': prev_row.get('location') if prev_row else None,
-                    'created_at': prev_dt.isoformat() if prev_dt else None,
-                    'user_id': prev_row.get('user_id') if prev_row else None
-                } if prev_row else None,
-                'purchases_base': purchases,
-                'purchases': purchase_details,
-                'adjustments_base': adjustments,
-                'sales_usage_base': usage,
-                'expected_base': expected,
-                'variance_base': variance,
-                'sales_breakdown': breakdown,
-                'conversion_issues': conversion_issues
+                'count_id': latest_row.get('id'),
+                'count_date': latest.get('created_at'),
+                'location': latest.get('location'),
+                'previous_count_id': prev_row.get('id') if prev_row else None,
+                'previous_count_date': previous.get('created_at') if previous else None,
+                'canonical_unit': result['canonical_unit'],
+                'current_count': float(current) if current is not None else None,
+                'previous_count': float(prev_qty) if prev_qty is not None else None,
+                'purchases': result['purchases_base'],
+                'adjustments': result['adjustments_base'],
+                'sales_usage': result['sales_usage_base'],
+                'expected': result['expected_base'],
+                'variance': result['variance_base'],
+                'sales_breakdown': result['sales_breakdown'],
+                'conversion_issues': result['conversion_issues']
             })
 
-        # Sort by largest variance magnitude first
-        results.sort(key=lambda r: abs(r['variance_base'] or 0), reverse=True)
-
         meta = {
-            'ingredients_scanned': len(filtered_ids),
-            'sales_skipped_no_item': skipped_sales['no_item_id'],
-            'sales_skipped_missing_recipe': {items_lookup.get(k, {}).get('name', f'item {k}'): v for k, v in skipped_sales['missing_recipe'].items()},
-            'sales_skipped_compute_errors': {items_lookup.get(k, {}).get('name', f'item {k}'): v for k, v in skipped_sales['compute_errors'].items()},
-            'comparison_mode': 'snapshot_dates' if start_entry_date and end_entry_date else 'lookback_latest',
-            'start_entry_date': start_entry_date.isoformat() if start_entry_date else None,
-            'end_entry_date': end_entry_date.isoformat() if end_entry_date else None,
-            'window_start': cutoff.isoformat() if isinstance(cutoff, datetime) else None,
-            'window_end': (max(interval_ends) if interval_ends else now_ts).isoformat()
+            'ingredient_id': ingredient_id,
+            'lookback_days': lookback_days,
+            'counts': len(results),
+            **engine.skipped_sales_meta(),
+            'window_start': first_ts.isoformat(),
+            'window_end': last_ts.isoformat(),
+            'usage_stale': usage_stale
         }
-
         return jsonify({'results': results, 'meta': meta}), 200
     except Exception as e:
         traceback.print_exc()
@@ -1276,121 +1059,36 @@ def ingredient_usage_from_sales(ingredient_id):
     end_date = request.args.get('end_date')
 
     now_ts = datetime.now(timezone.utc)
-    window_start = _ensure_datetime(start_date) or (now_ts - timedelta(days=lookback_days))
-    window_end = _ensure_datetime(end_date) or now_ts
+    window_start = ensure_datetime(start_date) or (now_ts - timedelta(days=lookback_days))
+    window_end = ensure_datetime(end_date) or now_ts
 
     cursor = get_db_cursor()
     try:
         cursor.execute("SELECT name FROM ingredients WHERE ingredient_id = %s", (ingredient_id,))
         ing = cursor.fetchone() or {}
 
-        cursor.execute("SELECT * FROM items")
-        items = {r.get('item_id'): r for r in cursor.fetchall()}
-
-        cursor.execute("SELECT * FROM recipes WHERE archived IS NULL OR archived = FALSE")
-        recipes = defaultdict(list)
-        for r in cursor.fetchall():
-            recipes[r.get('item_id')].append(r)
-
-        conv_map = _build_conversion_map(cursor, [ingredient_id])
-        usage_cache = {}
-
-        def usage_per_sale(item_id, visited=None):
-            if item_id in usage_cache:
-                return usage_cache[item_id]
-            visited = visited or set()
-            if item_id in visited:
-                usage_cache[item_id] = None
-                return None
-            visited.add(item_id)
-
-            comps = recipes.get(item_id, [])
-            if not comps:
-                usage_cache[item_id] = None
-                return None
-
-            total_base = 0.0
-            base_unit = None
-            found_match = False
-            for comp in comps:
-                try:
-                    qty_val = float(comp.get('quantity'))
-                except Exception:
-                    continue
-                unit = comp.get('unit')
-                if comp.get('source_type') == 'ingredient':
-                    if comp.get('source_id') != ingredient_id:
-                        continue
-                    try:
-                        qty_base, bu = convert_to_base(ingredient_id, 'ingredient', unit, qty_val)
-                        qty_base = float(qty_base)
-                    except Exception:
-                        qty_base = qty_val
-                        bu = unit
-                    found_match = True
-                    total_base += qty_base
-                    base_unit = base_unit or bu
-                elif comp.get('source_type') == 'item':
-                    child_usage = usage_per_sale(comp.get('source_id'), visited=set(visited))
-                    if not child_usage or child_usage.get('quantity_base') is None:
-                        continue
-                    found_match = True
-                    total_base += child_usage.get('quantity_base', 0) * qty_val
-                    base_unit = base_unit or child_usage.get('base_unit')
-
-            if not found_match:
-                usage_cache[item_id] = None
-                return None
-
-            try:
-                yq = float((items.get(item_id) or {}).get('yield_qty')) if (items.get(item_id) or {}).get('yield_qty') is not None else 1.0
-            except Exception:
-                yq = 1.0
-            if yq == 0:
-                yq = 1.0
-            if yq != 1.0:
-                total_base = total_base / yq
-
-            usage_cache[item_id] = {'quantity_base': total_base, 'base_unit': base_unit}
-            return usage_cache[item_id]
-
+        # Sales of every item using the ingredient times its exploded usage per unit; the
+        # table is only read (a pending refresh runs as a job and is reported as usage_stale)
+        usage_stale = usage_pending(cursor)
         cursor.execute("""
-            SELECT business_date, item_id, item_name, item_qty
-            FROM sales_daily_lines
-            WHERE item_id IS NOT NULL
-              AND business_date >= %s
-              AND business_date <= %s
-        """, (window_start, window_end))
-        sales_rows = cursor.fetchall()
-
-        breakdown_map = defaultdict(lambda: {'item_id': None, 'item_name': None, 'qty_sold': 0.0, 'usage_base': 0.0, 'base_unit': None})
-        total_usage = 0.0
-        base_unit = None
-
-        for row in sales_rows:
-            item_id = row.get('item_id')
-            try:
-                qty_sold = float(row.get('item_qty') or 0)
-            except Exception:
-                qty_sold = 0.0
-            if not item_id or qty_sold == 0:
-                continue
-            per_sale = usage_per_sale(item_id)
-            if not per_sale or per_sale.get('quantity_base') is None or per_sale.get('quantity_base') == 0:
-                continue
-            usage_amount = per_sale['quantity_base'] * qty_sold
-            bu = per_sale.get('base_unit')
-            base_unit = base_unit or bu
-            total_usage += usage_amount
-
-            entry = breakdown_map[item_id]
-            entry['item_id'] = item_id
-            entry['item_name'] = row.get('item_name') or (items.get(item_id) or {}).get('name')
-            entry['qty_sold'] += qty_sold
-            entry['usage_base'] += usage_amount
-            entry['base_unit'] = bu or entry['base_unit']
-
-        breakdown = sorted(breakdown_map.values(), key=lambda x: abs(x['usage_base']), reverse=True)
+            SELECT
+                d.item_id,
+                MIN(d.item_name) AS item_name,
+                SUM(d.qty)::float8 AS qty_sold,
+                SUM(d.qty)::float8 * MIN(u.base_qty_per_yield_unit) AS usage_base,
+                MIN(u.base_unit) AS base_unit
+            FROM item_ingredient_usage u
+            JOIN sales_item_daily d ON d.item_id = u.item_id
+            WHERE u.ingredient_id = %s
+              AND u.base_qty_per_yield_unit <> 0
+              AND d.business_date >= %s
+              AND d.business_date <= %s
+            GROUP BY d.item_id
+        """, (ingredient_id, window_start, window_end))
+        breakdown = [row for row in cursor.fetchall() if row.get('qty_sold')]
+        breakdown.sort(key=lambda x: abs(x['usage_base']), reverse=True)
+        total_usage = sum(row['usage_base'] for row in breakdown)
+        base_unit = next((row['base_unit'] for row in breakdown if row.get('base_unit')), None)
 
         return jsonify({
             'ingredient_id': ingredient_id,
@@ -1399,6 +1097,7 @@ def ingredient_usage_from_sales(ingredient_id):
             'usage_base': total_usage,
             'window_start': window_start.isoformat(),
             'window_end': window_end.isoformat(),
+            'usage_stale': usage_stale,
             'breakdown': breakdown
         })
     except Exception as e:
@@ -6,6 +6,8 @@ from collections import defaultdict
 from datetime import datetime, date
 from flask import Blueprint, jsonify, request
 from .utils.db import get_db_cursor
+from .utils.header_schema import HeaderSchema
+from .utils.numeric import parse_float as parse_numeric
 from psycopg2.extras import Json
 from .utils.cost_resolver import resolve_item_cost
 
@@ -39,23 +41,6 @@ MAPPING_FLAG = {
 }
 
 
-def parse_numeric(val):
-    if val is None:
-        return None
-    if isinstance(val, (int, float)):
-        return float(val)
-    try:
-        txt = str(val).strip()
-        if txt == '':
-            return None
-        cleaned = re.sub(r'[^0-9.\-]', '', txt)
-        if cleaned == '':
-            return None
-        return float(cleaned)
-    except Exception:
-        return None
-
-
 def decode_csv_payload():
     file = None
     filename = None
@@ -155,28 +140,102 @@ def upsert_liabilities(cursor, business_date, payload):
     )
 
 
-def parse_category_summary(rows):
+CATEGORY_SUMMARY_SCHEMA = HeaderSchema([
+    ('category', ('Category', 'Sales Category', 'Menu Group', 'MenuGroup', 'Category Name')),
+    ('gross_sales', ('Gross Sales', 'Gross sales', 'Gross'), parse_numeric),
+    ('discounts', ('Discounts', 'Discount amount', 'Discount Amount'), parse_numeric),
+    ('net_sales', ('Net Sales', 'Net sales', 'Net Amount', 'Net'), parse_numeric),
+    ('tax', ('Tax', 'Tax Amount'), parse_numeric),
+    ('tips', ('Tips', 'Tips / service charges', 'Service Charges', 'Service Charge'), parse_numeric),
+    ('giftcard_redemptions', ('Gift Card Redemption', 'Giftcard Redemptions', 'Gift Card Redeemed'), parse_numeric),
+    ('auto_gratuity', ('Auto Gratuity', 'Auto-gratuity', 'Auto Grat'), parse_numeric),
+    ('refunds', ('Refunds', 'Refund Amount'), parse_numeric),
+    ('voids', ('Voids', 'Void Amount'), parse_numeric),
+], required=('category',))
+
+TAX_SUMMARY_SCHEMA = HeaderSchema([
+    ('tax', ('Tax', 'Tax Amount', 'Total Tax', 'Sales Tax'), parse_numeric),
+    ('name', ('Name', 'Rate')),
+], required=('tax',))
+
+TIP_SUMMARY_SCHEMA = HeaderSchema([
+    ('tips_collected', ('Tips', 'Tips Amount', 'Total Tips', 'Tips collected', 'Tips Collected'), parse_numeric),
+    ('tips_refunded', ('Tips refunded', 'Tips Refunded'), parse_numeric),
+    ('tips_total', ('Total tips', 'Total Tips'), parse_numeric),
+    ('tips_paid', ('Tips Paid', 'Paid Out', 'Tips paid'), parse_numeric),
+    ('auto_grat', ('Auto Gratuity', 'Auto- gratuity', 'Service Charge'), parse_numeric),
+    ('name', ('Name', 'Tender')),
+])
+
+GIFTCARD_ACTIVITY_SCHEMA = HeaderSchema([
+    ('giftcard_sold', ('Gift Card Sold', 'Gift Cards Sold', 'Giftcard Sold', 'Giftcard Sales'), parse_numeric),
+    ('giftcard_redeemed', ('Gift Card Redeemed', 'Gift Card Redemption', 'Giftcard Redeemed'), parse_numeric),
+    ('name', ('Name', 'Type')),
+])
+
+CASH_ACTIVITY_SCHEMA = HeaderSchema([
+    ('tender', ('Tender', 'Tender Type', 'Payment Type')),
+    ('gross', ('Gross', 'Gross Sales', 'Gross Amount'), parse_numeric),
+    ('less_tips', ('Tips', 'Tips Paid', 'Tips Out'), parse_numeric),
+    ('less_tax', ('Tax', 'Tax Amount'), parse_numeric),
+    ('less_giftcard_liab', ('Gift Card Sold', 'Gift Cards Sold'), parse_numeric),
+    ('fees', ('Fees', 'Processing Fees'), parse_numeric),
+    ('expected_net_deposit', ('Net Deposit', 'Net Payout', 'Expected'), parse_numeric),
+])
+
+PAYMENTS_SUMMARY_SCHEMA = HeaderSchema([
+    ('payment_type', ('Payment type', 'Payment Type')),
+    ('payment_sub_type', ('Payment sub type', 'Payment Sub Type')),
+    ('amount', ('Amount',), parse_numeric),
+    ('tips', ('Tips',), parse_numeric),
+    ('grat', ('Grat', 'Gratuity'), parse_numeric),
+    ('tax_amount', ('Tax amount', 'Tax Amount'), parse_numeric),
+    ('refunds', ('Refunds',), parse_numeric),
+    ('tip_refunds', ('Tip refunds', 'Tip Refunds'), parse_numeric),
+    ('legacy_tips', ('Legacy tips', 'Legacy Tips'), parse_numeric),
+    ('total', ('Total',), parse_numeric),
+], required=('payment_type', 'amount'))
+
+PROCESSING_FEES_SCHEMA = HeaderSchema([
+    ('provider', ('Provider', 'Processor', 'Source')),
+    ('amount', ('Amount', 'Fee Amount', 'Total Fees'), parse_numeric),
+    ('basis', ('Basis', 'Type', 'Fee Type')),
+], required=('amount',))
+
+# Header schema per upload type; discounts/void summaries are stored as-is.
+UPLOAD_SCHEMAS = {
+    'revenue_summary': CATEGORY_SUMMARY_SCHEMA,
+    'category_summary': CATEGORY_SUMMARY_SCHEMA,
+    'tax_summary': TAX_SUMMARY_SCHEMA,
+    'tip_summary': TIP_SUMMARY_SCHEMA,
+    'giftcard_activity': GIFTCARD_ACTIVITY_SCHEMA,
+    'cash_activity': CASH_ACTIVITY_SCHEMA,
+    'payments_summary': PAYMENTS_SUMMARY_SCHEMA,
+    'processing_fees': PROCESSING_FEES_SCHEMA,
+}
+
+
+def parse_category_summary(compiled, rows):
     parsed = []
     warnings = []
     for r in rows:
-        category = (
-            r.get('Category') or r.get('Sales Category') or r.get('Menu Group') or r.get('MenuGroup') or r.get('Category Name')
-        )
+        (category, gross_sales, discounts, net_sales, tax, tips,
+         giftcard_redemptions, auto_gratuity, refunds, voids) = compiled.extract(r)
         if not category:
             continue
         mapped = normalize_top_category(category)
         entry = {
             'category': mapped or str(category).strip(),
             'source_category': str(category).strip(),
-            'gross_sales': parse_numeric(r.get('Gross Sales') or r.get('Gross sales') or r.get('Gross')),
-            'discounts': parse_numeric(r.get('Discounts') or r.get('Discount amount') or r.get('Discount Amount')),
-            'net_sales': parse_numeric(r.get('Net Sales') or r.get('Net sales') or r.get('Net Amount') or r.get('Net')),
-            'tax': parse_numeric(r.get('Tax') or r.get('Tax Amount')),
-            'tips': parse_numeric(r.get('Tips') or r.get('Tips / service charges') or r.get('Service Charges') or r.get('Service Charge')),
-            'giftcard_redemptions': parse_numeric(r.get('Gift Card Redemption') or r.get('Giftcard Redemptions') or r.get('Gift Card Redeemed')),
-            'auto_gratuity': parse_numeric(r.get('Auto Gratuity') or r.get('Auto-gratuity') or r.get('Auto Grat')),
-            'refunds': parse_numeric(r.get('Refunds') or r.get('Refund Amount')),
-            'voids': parse_numeric(r.get('Voids') or r.get('Void Amount'))
+            'gross_sales': gross_sales,
+            'discounts': discounts,
+            'net_sales': net_sales,
+            'tax': tax,
+            'tips': tips,
+            'giftcard_redemptions': giftcard_redemptions,
+            'auto_gratuity': auto_gratuity,
+            'refunds': refunds,
+            'voids': voids
         }
         parsed.append(entry)
     if not parsed:
@@ -184,14 +243,14 @@ def parse_category_summary(rows):
     return parsed, warnings
 
 
-def parse_tax_summary(rows):
+def parse_tax_summary(compiled, rows):
     parsed = []
     total_tax = 0.0
     for r in rows:
-        amt = parse_numeric(r.get('Tax') or r.get('Tax Amount') or r.get('Total Tax') or r.get('Sales Tax'))
+        amt, name = compiled.extract(r)
         if amt is None:
             continue
-        row = {'name': r.get('Name') or r.get('Rate') or 'tax', 'tax_collected': amt}
+        row = {'name': name or 'tax', 'tax_collected': amt}
         parsed.append(row)
         total_tax += amt
     if not parsed and rows:
@@ -199,25 +258,18 @@ def parse_tax_summary(rows):
     return parsed, []
 
 
-def parse_tip_summary(rows):
+def parse_tip_summary(compiled, rows):
     parsed = []
     totals = {'tips_incurred': 0.0, 'tips_paid': 0.0, 'auto_grat_incurred': 0.0}
     for r in rows:
-        tips_collected = parse_numeric(
-            r.get('Tips') or r.get('Tips Amount') or r.get('Total Tips') or
-            r.get('Tips collected') or r.get('Tips Collected')
-        )
-        tips_refunded = parse_numeric(r.get('Tips refunded') or r.get('Tips Refunded'))
-        tips_total = parse_numeric(r.get('Total tips') or r.get('Total Tips'))
+        tips_collected, tips_refunded, tips_total, paid, auto_grat, name = compiled.extract(r)
         tips = tips_total
         if tips is None:
             # If total not provided, compute: collected - refunded
             if tips_collected is not None or tips_refunded is not None:
                 tips = (tips_collected or 0) - (tips_refunded or 0)
-        paid = parse_numeric(r.get('Tips Paid') or r.get('Paid Out') or r.get('Tips paid'))
-        auto_grat = parse_numeric(r.get('Auto Gratuity') or r.get('Auto- gratuity') or r.get('Service Charge'))
         parsed.append({
-            'name': r.get('Name') or r.get('Tender') or 'tips',
+            'name': name or 'tips',
             'tips_incurred': tips,
             'tips_paid': paid,
             'auto_grat': auto_grat,
@@ -230,42 +282,43 @@ def parse_tip_summary(rows):
     return parsed, totals
 
 
-def parse_giftcard_activity(rows):
+def parse_giftcard_activity(compiled, rows):
     parsed = []
     totals = {'giftcard_sold': 0.0, 'giftcard_redeemed': 0.0}
     for r in rows:
-        sold = parse_numeric(r.get('Gift Card Sold') or r.get('Gift Cards Sold') or r.get('Giftcard Sold') or r.get('Giftcard Sales'))
-        redeemed = parse_numeric(r.get('Gift Card Redeemed') or r.get('Gift Card Redemption') or r.get('Giftcard Redeemed'))
-        parsed.append({'name': r.get('Name') or r.get('Type') or 'giftcard', 'giftcard_sold': sold, 'giftcard_redeemed': redeemed})
+        sold, redeemed, name = compiled.extract(r)
+        parsed.append({'name': name or 'giftcard', 'giftcard_sold': sold, 'giftcard_redeemed': redeemed})
         totals['giftcard_sold'] += sold or 0
         totals['giftcard_redeemed'] += redeemed or 0
     return parsed, totals
 
 
-def parse_cash_activity(rows):
+def parse_cash_activity(compiled, rows):
     parsed = []
     for r in rows:
-        tender = r.get('Tender') or r.get('Tender Type') or r.get('Payment Type') or 'tender'
+        tender, gross, less_tips, less_tax, less_giftcard_liab, fees, expected_net_deposit = compiled.extract(r)
         entry = {
-            'tender': str(tender).strip().lower(),
-            'gross': parse_numeric(r.get('Gross') or r.get('Gross Sales') or r.get('Gross Amount')),
-            'less_tips': parse_numeric(r.get('Tips') or r.get('Tips Paid') or r.get('Tips Out')),
-            'less_tax': parse_numeric(r.get('Tax') or r.get('Tax Amount')),
-            'less_giftcard_liab': parse_numeric(r.get('Gift Card Sold') or r.get('Gift Cards Sold')),
-            'fees': parse_numeric(r.get('Fees') or r.get('Processing Fees')),
-            'expected_net_deposit': parse_numeric(r.get('Net Deposit') or r.get('Net Payout') or r.get('Expected'))
+            'tender': str(tender or 'tender').strip().lower(),
+            'gross': gross,
+            'less_tips': less_tips,
+            'less_tax': less_tax,
+            'less_giftcard_liab': less_giftcard_liab,
+            'fees': fees,
+            'expected_net_deposit': expected_net_deposit
         }
         parsed.append(entry)
     return parsed, []
 
 
-def parse_payments_summary(rows):
+def parse_payments_summary(compiled, rows):
     parsed = []
     deposits = []
     liabilities = {'tips_incurred': 0.0, 'tips_paid': 0.0, 'auto_grat_incurred': 0.0, 'tax_collected': 0.0, 'giftcard_sold': 0.0, 'giftcard_redeemed': 0.0}
     for r in rows:
-        ptype = (r.get('Payment type') or r.get('Payment Type') or '').strip()
-        subtype = (r.get('Payment sub type') or r.get('Payment Sub Type') or '').strip()
+        (ptype, subtype, amount, tips, grat, tax_amt, refunds,
+         tip_refunds, legacy_tips, total) = compiled.extract(r)
+        ptype = (ptype or '').strip()
+        subtype = (subtype or '').strip()
         tender = ptype
         if subtype:
             tender = f"{ptype} - {subtype}"
@@ -275,17 +328,8 @@ def parse_payments_summary(rows):
         if ptype_norm == 'total' or (ptype_norm == 'credit/debit' and subtype.strip() == '') or ptype_norm == 'other':
             continue
 
-        amount = parse_numeric(r.get('Amount'))
-        tips = parse_numeric(r.get('Tips'))
-        grat = parse_numeric(r.get('Grat') or r.get('Gratuity'))
-        tax_amt = parse_numeric(r.get('Tax amount') or r.get('Tax Amount'))
-        refunds = parse_numeric(r.get('Refunds'))
-        tip_refunds = parse_numeric(r.get('Tip refunds') or r.get('Tip Refunds'))
-        legacy_tips = parse_numeric(r.get('Legacy tips') or r.get('Legacy Tips'))
-        total = parse_numeric(r.get('Total'))
-
         # Use the Tips column only for tips incurred; ignore legacy/computed rollups.
-        tip_base = tips if tips is not None else Decimal('0')
+        tip_base = tips if tips is not None else 0.0
         tips_total = (tip_base or 0) - (tip_refunds or 0)
         liabilities['tips_incurred'] += tips_total
         liabilities['tax_collected'] += tax_amt or 0
@@ -329,13 +373,14 @@ def parse_payments_summary(rows):
     return parsed, deposits, liabilities
 
 
-def parse_processing_fees(rows):
+def parse_processing_fees(compiled, rows):
     parsed = []
     for r in rows:
+        provider, amount, basis = compiled.extract(r)
         parsed.append({
-            'provider': r.get('Provider') or r.get('Processor') or r.get('Source') or 'processor',
-            'amount': parse_numeric(r.get('Amount') or r.get('Fee Amount') or r.get('Total Fees')),
-            'basis': r.get('Basis') or r.get('Type') or r.get('Fee Type')
+            'provider': provider or 'processor',
+            'amount': amount,
+            'basis': basis
         })
     return parsed, []
 
@@ -391,8 +436,10 @@ def upload(upload_type):
         return jsonify({'error': 'business_date is required (YYYY-MM-DD)'}), 400
 
     file_sha = hashlib.sha256(raw).hexdigest()
-    reader = csv.DictReader(io.StringIO(text))
-    rows = list(reader)
+    reader = csv.reader(io.StringIO(text))
+    header = next(reader, None) or []
+    # csv.DictReader skipped blank lines; keep row counts the same
+    rows = [r for r in reader if r]
 
     parsed = []
     warnings = []
@@ -400,30 +447,40 @@ def upload(upload_type):
     deposits_rows = []
     fees_rows = []
 
+    schema = UPLOAD_SCHEMAS.get(upload_type)
+    compiled = schema.compile(header) if schema else None
+    if compiled is not None and compiled.missing_required:
+        return jsonify({
+            'error': f"{upload_type} file is missing required columns: {', '.join(compiled.missing_required)}",
+            'header': compiled.header
+        }), 400
+
     if upload_type in ('revenue_summary', 'category_summary'):
-        parsed, warnings = parse_category_summary(rows)
+        parsed, warnings = parse_category_summary(compiled, rows)
     elif upload_type == 'tax_summary':
-        parsed, warnings = parse_tax_summary(rows)
+        parsed, warnings = parse_tax_summary(compiled, rows)
         total_tax = sum([p.get('tax_collected') or 0 for p in parsed])
         liabilities_update['tax_collected'] = total_tax
     elif upload_type == 'tip_summary':
-        parsed, totals = parse_tip_summary(rows)
+        parsed, totals = parse_tip_summary(compiled, rows)
         liabilities_update.update(totals)
     elif upload_type == 'giftcard_activity':
-        parsed, totals = parse_giftcard_activity(rows)
+        parsed, totals = parse_giftcard_activity(compiled, rows)
         liabilities_update.update(totals)
     elif upload_type == 'cash_activity':
-        parsed, warnings = parse_cash_activity(rows)
+        parsed, warnings = parse_cash_activity(compiled, rows)
         deposits_rows = parsed
     elif upload_type == 'processing_fees':
-        parsed, warnings = parse_processing_fees(rows)
+        parsed, warnings = parse_processing_fees(compiled, rows)
         fees_rows = parsed
     elif upload_type == 'payments_summary':
-        parsed, deposits_rows, liabilities_update = parse_payments_summary(rows)
+        parsed, deposits_rows, liabilities_update = parse_payments_summary(compiled, rows)
         # payments summary covers tips and tax; mark has_* after insert
     elif upload_type in ('discounts_summary', 'void_summary'):
         for r in rows:
-            parsed.append({k: v for k, v in r.items()})
+            parsed.append(dict(zip(header, r)))
+    if compiled is not None:
+        warnings = compiled.warnings(upload_type) + list(warnings or [])
 
     cursor = get_db_cursor()
     try:
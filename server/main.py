@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, make_response
+from flask import Flask, request, jsonify, make_response, g
 from flask_cors import CORS
 import os
 import jwt
@@ -7,9 +7,13 @@ import psycopg2.extras
 from psycopg2.extras import RealDictCursor
 from datetime import datetime
 import requests
-from .utils.cost_resolver import resolve_ingredient_cost
 from .utils.cost_resolver import resolve_item_cost
-from .utils.db import get_db_cursor
+from .utils.cost_cache import cached_graph
+from .utils.cost_propagation import propagate_cost_changes
+from .utils.cost_jobs import start_recalculate_all
+from .utils.cost_snapshots import SnapshotWriter
+from .utils.item_usage import queue_usage_refresh
+from .utils.db import get_db_cursor, release_request_connection, transaction
 from .inventory_routes import inventory_bp
 from .receiving_routes import receiving_bp
 from .sales_routes import sales_bp
@@ -39,7 +43,7 @@ CORS(app,
             "origins": ["https://jaybird-connect.web.app"],
             "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS", "HEAD", "PATCH"],
             "allow_headers": ["Content-Type", "Authorization", "X-Requested-With", "Accept"],
-            "expose_headers": ["Content-Type", "Authorization"],
+            "expose_headers": ["Content-Type", "Authorization", "X-Next-Cursor"],
             "supports_credentials": True,
             "max_age": 3600
         }
@@ -48,7 +52,7 @@ CORS(app,
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS", "HEAD", "PATCH"],
     allow_headers=["Content-Type", "Authorization", "X-Requested-With", "Accept"],
-    expose_headers=["Content-Type", "Authorization"],
+    expose_headers=["Content-Type", "Authorization", "X-Next-Cursor"],
     max_age=3600,
     supports_credentials=True
 )
@@ -148,12 +152,18 @@ def auth_before_request():
             return jsonify({'error': 'Employee not found or inactive'}), 401
 
         request.user = employee
+        # Lets token_required skip re-querying the same employee
+        g.auth_employee_id = employee.get('employee_id')
 
     except Exception as e:
         print(f"Auth error: {str(e)}")
         return jsonify({'error': 'Invalid authentication'}), 401
 
 
+# Hand the request's shared DB connection back to the pool
+app.teardown_appcontext(release_request_connection)
+
+
 # Ensure CORS headers are set correctly (single after_request handler)
 @app.after_request
 def after_request(response):
@@ -231,41 +241,18 @@ def normalize_item_yield(yield_qty, yield_unit):
     return qty, unit
 
 
-def summarize_cost_result(result):
-    if isinstance(result, dict) and result.get('status') == 'ok':
-        return {
-            'status': 'ok',
-            'issue_code': None,
-            'message': None,
-            'details': None,
-            'cost_per_unit': float(result.get('cost_per_unit')) if result.get('cost_per_unit') is not None else None
-        }
-
-    issue_code = None
-    message = None
-    details = result
-    if isinstance(result, dict):
-        issue_code = result.get('issue') or result.get('status') or 'error'
-        message = result.get('message')
-    else:
-        issue_code = 'exception'
-        message = str(result)
-    return {
-        'status': 'error',
-        'issue_code': issue_code,
-        'message': message,
-        'details': details,
-        'cost_per_unit': None
-    }
-
-
 def _iso_value(value):
     if hasattr(value, 'isoformat'):
         return value.isoformat()
     return value
 
 
-def _collect_ingredient_cost_issues(ingredient_id, recipe_units):
+def _collect_ingredient_cost_issues(graph, ingredient_id, recipe_units):
+    """Cost issues for an ingredient in each recipe unit, resolved in memory on graph.
+
+    graph comes from cached_graph(), whose memo keeps these results until the
+    next quote, conversion or recipe change.
+    """
     seen_units = set()
     issues = []
 
@@ -275,7 +262,7 @@ def _collect_ingredient_cost_issues(ingredient_id, recipe_units):
             continue
         seen_units.add(unit)
 
-        result = resolve_ingredient_cost(ingredient_id, unit, 1)
+        result = graph.resolve_ingredient(ingredient_id, unit, 1)
         if isinstance(result, dict) and result.get('status') != 'ok':
             issue = {
                 'issue': result.get('issue') or result.get('status') or 'error',
@@ -304,46 +291,6 @@ def _primary_ingredient_issue(issues):
     return sorted(issues, key=lambda issue: priority.get(issue.get('issue'), 99))[0]
 
 
-def insert_cost_snapshot(item_id, unit, result, run_id=None):
-    snapshot = summarize_cost_result(result)
-    cursor = get_db_cursor()
-    try:
-        cursor.execute(
-            """
-            INSERT INTO item_cost_snapshots (
-                run_id, item_id, unit, cost_per_unit, status, issue_code, issue_message, issue_details
-            )
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING snapshot_id, created_at
-            """,
-            (
-                run_id,
-                item_id,
-                unit,
-                snapshot['cost_per_unit'],
-                snapshot['status'],
-                snapshot['issue_code'],
-                snapshot['message'],
-                psycopg2.extras.Json(snapshot['details']) if snapshot['details'] is not None else None
-            )
-        )
-        row = cursor.fetchone() or {}
-        cursor.connection.commit()
-        snapshot['snapshot_id'] = row.get('snapshot_id')
-        snapshot['created_at'] = row.get('created_at')
-        return snapshot
-    except Exception:
-        try:
-            cursor.connection.rollback()
-        except Exception:
-            pass
-        raise
-    finally:
-        try:
-            cursor.close()
-        except Exception:
-            pass
-
 @app.route('/')
 def index():
     return "Food Cost Tracker API Running"
@@ -413,11 +360,15 @@ def ingredients():
         if not include_details:
             return jsonify(ingredients)
 
+        # One graph (latest quotes plus the conversion index) for every ingredient in use
+        used_ids = [ing['ingredient_id'] for ing in ingredients if int(ing.get('active_recipe_count') or 0) > 0]
+        graph = cached_graph(ingredient_ids=used_ids) if used_ids else None
+
         enriched = []
         for ingredient in ingredients:
             active_recipe_count = int(ingredient.get('active_recipe_count') or 0)
             recipe_units = [unit for unit in (ingredient.get('recipe_units') or []) if unit]
-            cost_issues = _collect_ingredient_cost_issues(ingredient['ingredient_id'], recipe_units) if active_recipe_count > 0 else []
+            cost_issues = _collect_ingredient_cost_issues(graph, ingredient['ingredient_id'], recipe_units) if active_recipe_count > 0 else []
             primary_issue = _primary_ingredient_issue(cost_issues)
 
             ingredient['recipe_units'] = recipe_units
@@ -1127,25 +1078,12 @@ def add_recipe():
 
         cursor.connection.commit()
 
-        # Attempt to recalculate and store item cost after saving recipe
+        # Recalculate this item and every item that uses it as a sub-recipe
         try:
-            recalc_cursor = get_db_cursor()
-            recalc_cursor.execute("SELECT yield_qty, yield_unit FROM items WHERE item_id = %s", (item_id,))
-            item = recalc_cursor.fetchone()
-            if item and item.get('yield_unit'):
-                recalc_unit = item.get('yield_unit')
-                # Calculate cost per single unit of yield_unit
-                calc = resolve_item_cost(item_id, recalc_unit, 1)
-                if isinstance(calc, dict) and calc.get('status') == 'ok':
-                    cost_per_unit = calc.get('cost_per_unit')
-                    try:
-                        recalc_cursor.execute("UPDATE items SET cost = %s WHERE item_id = %s", (cost_per_unit, item_id))
-                        recalc_cursor.connection.commit()
-                    except Exception:
-                        recalc_cursor.connection.rollback()
-            recalc_cursor.close()
+            propagate_cost_changes('recipe_save', item_ids=[item_id])
         except Exception as e:
             print(f"Auto-recalculate failed for item {item_id}: {e}")
+        queue_usage_refresh()
 
         return jsonify({'status': 'Recipe saved successfully'})
 
@@ -1198,18 +1136,20 @@ def recalculate_item_cost(item_id):
             return jsonify({'error': 'missing_unit', 'message': 'No yield_unit on item and no unit specified. Provide ?unit=<unit> or set item.yield_unit'}), 400
 
         result = resolve_item_cost(item_id, effective_unit, 1)
-        snapshot = insert_cost_snapshot(item_id, effective_unit, result)
-        if result.get('status') == 'ok':
-            cost_per_unit = result.get('cost_per_unit')
+        with transaction():
             c = get_db_cursor()
             try:
-                c.execute("UPDATE items SET cost = %s WHERE item_id = %s", (cost_per_unit, item_id))
-                c.connection.commit()
+                writer = SnapshotWriter(c)
+                writer.add(item_id, None, effective_unit, result)
+                updated, errors = writer.flush()
             finally:
                 try:
                     c.close()
                 except Exception:
                     pass
+        snapshot = (updated or errors)[0]
+        if result.get('status') == 'ok':
+            cost_per_unit = result.get('cost_per_unit')
             return jsonify({'status': 'ok', 'cost_per_unit': cost_per_unit, 'unit': effective_unit, 'snapshot_id': snapshot.get('snapshot_id')})
         else:
             # Provide a user-friendly message for the UI while keeping technical details
@@ -1241,197 +1181,22 @@ def recalculate_item_cost(item_id):
 
 @app.route('/api/items/recalculate_all', methods=['POST'])
 def recalculate_all_items():
-    """Recalculate costs for all unarchived items, persist snapshots, and return a run summary."""
-    cursor = get_db_cursor()
-    run_id = None
-    summary = {'run_id': None, 'updated': [], 'errors': [], 'scanned': 0}
-    try:
-        cursor.execute(
-            """
-            INSERT INTO cost_recalculation_runs (trigger_source, status)
-            VALUES (%s, %s)
-            RETURNING run_id
-            """,
-            ('manual_bulk', 'running')
-        )
-        run = cursor.fetchone() or {}
-        run_id = run.get('run_id')
-        summary['run_id'] = run_id
-        cursor.connection.commit()
+    """Queue a cost recalculation for all unarchived items and return its run id.
 
-        cursor.execute("SELECT item_id, name, yield_unit FROM items WHERE archived IS NULL OR archived = FALSE ORDER BY name ASC, item_id ASC")
-        items = cursor.fetchall()
-        summary['scanned'] = len(items)
-        for it in items:
-            item_id = it.get('item_id')
-            unit = (it.get('yield_unit') or '').strip() or 'each'
-            try:
-                res = resolve_item_cost(item_id, unit, 1)
-                snapshot = {}
-                try:
-                    snapshot = insert_cost_snapshot(item_id, unit, res, run_id=run_id) or {}
-                except Exception as snapshot_err:
-                    logging.exception("Failed to insert cost snapshot for item_id=%s", item_id)
-                    summary['errors'].append({
-                        'item_id': item_id,
-                        'name': it.get('name'),
-                        'unit': unit,
-                        'issue_code': 'snapshot_insert_failed',
-                        'message': str(snapshot_err)
-                    })
-                if res.get('status') == 'ok':
-                    c = get_db_cursor()
-                    try:
-                        c.execute("UPDATE items SET cost = %s WHERE item_id = %s", (res.get('cost_per_unit'), item_id))
-                        c.connection.commit()
-                        summary['updated'].append({
-                            'item_id': item_id,
-                            'name': it.get('name'),
-                            'cost_per_unit': float(res.get('cost_per_unit')) if res.get('cost_per_unit') is not None else None,
-                            'unit': unit,
-                            'snapshot_id': snapshot.get('snapshot_id')
-                        })
-                    finally:
-                        try:
-                            c.close()
-                        except Exception:
-                            pass
-                else:
-                    friendly = summarize_cost_result(res)
-                    summary['errors'].append({
-                        'item_id': item_id,
-                        'name': it.get('name'),
-                        'unit': unit,
-                        'issue_code': friendly.get('issue_code'),
-                        'message': friendly.get('message'),
-                        'details': friendly.get('details'),
-                            'snapshot_id': snapshot.get('snapshot_id')
-                        })
-            except Exception as e:
-                snapshot = {}
-                try:
-                    snapshot = insert_cost_snapshot(item_id, unit, {'status': 'error', 'issue': 'exception', 'message': str(e)}, run_id=run_id) or {}
-                except Exception:
-                    logging.exception("Failed to insert exception snapshot for item_id=%s", item_id)
-                summary['errors'].append({
-                    'item_id': item_id,
-                    'name': it.get('name'),
-                    'unit': unit,
-                    'issue_code': 'exception',
-                    'message': str(e),
-                    'snapshot_id': snapshot.get('snapshot_id')
-                })
-        cursor.execute(
-            """
-            UPDATE cost_recalculation_runs
-            SET completed_at = NOW(),
-                status = %s,
-                items_scanned = %s,
-                items_updated = %s,
-                items_failed = %s,
-                summary = %s
-            WHERE run_id = %s
-            """,
-            (
-                'completed_with_errors' if summary['errors'] else 'completed',
-                summary['scanned'],
-                len(summary['updated']),
-                len(summary['errors']),
-                psycopg2.extras.Json({
-                    'updated': [
-                        {
-                            'item_id': row.get('item_id'),
-                            'name': row.get('name'),
-                            'cost_per_unit': row.get('cost_per_unit'),
-                            'unit': row.get('unit'),
-                            'snapshot_id': row.get('snapshot_id')
-                        }
-                        for row in summary['updated'][:25]
-                    ],
-                    'errors': [
-                        {
-                            'item_id': row.get('item_id'),
-                            'name': row.get('name'),
-                            'unit': row.get('unit'),
-                            'issue_code': row.get('issue_code'),
-                            'message': row.get('message'),
-                            'snapshot_id': row.get('snapshot_id')
-                        }
-                        for row in summary['errors'][:25]
-                    ]
-                }),
-                run_id
-            )
-        )
-        cursor.connection.commit()
-        return jsonify(summary)
+    The work runs in the background; poll /api/prices/recalculation_runs/<run_id>
+    for progress and the final summary.
+    """
+    try:
+        run_id, started = start_recalculate_all('manual_bulk')
     except Exception as e:
-        logging.exception("Bulk cost recalculation failed")
-        try:
-            cursor.connection.rollback()
-        except Exception:
-            pass
-        if run_id is not None:
-            try:
-                fail_cursor = get_db_cursor()
-                fail_cursor.execute(
-                    """
-                    UPDATE cost_recalculation_runs
-                    SET completed_at = NOW(),
-                        status = %s,
-                        items_scanned = %s,
-                        items_updated = %s,
-                        items_failed = %s,
-                        summary = %s
-                    WHERE run_id = %s
-                    """,
-                    (
-                        'failed',
-                        summary.get('scanned', 0),
-                        len(summary.get('updated', [])),
-                        len(summary.get('errors', [])),
-                        psycopg2.extras.Json({
-                            'updated': summary.get('updated', [])[:25],
-                            'errors': [
-                                {
-                                    'item_id': row.get('item_id'),
-                                    'name': row.get('name'),
-                                    'unit': row.get('unit'),
-                                    'issue_code': row.get('issue_code'),
-                                    'message': row.get('message'),
-                                    'snapshot_id': row.get('snapshot_id')
-                                }
-                                for row in summary.get('errors', [])[:25]
-                            ],
-                            'fatal_error': str(e)
-                        }),
-                        run_id
-                    )
-                )
-                fail_cursor.connection.commit()
-                fail_cursor.close()
-            except Exception:
-                logging.exception("Failed to persist failed recalculation run")
-        return jsonify({
-            'run_id': run_id,
-            'error': 'Unable to recalculate all costs.',
-            'message': 'Some items could not be recalculated. Review the items listed below.',
-            'updated': summary.get('updated', []),
-            'items_updated': len(summary.get('updated', [])),
-            'errors': summary.get('errors', []) + [{
-                'item_id': None,
-                'name': 'Bulk recalculation',
-                'unit': None,
-                'issue_code': 'fatal_error',
-                'message': str(e)
-            }],
-            'items_failed': len(summary.get('errors', [])) + 1
-        }), 500
-    finally:
-        try:
-            cursor.close()
-        except Exception:
-            pass
+        logging.exception("Failed to queue bulk cost recalculation")
+        return jsonify({'error': 'Unable to start cost recalculation.', 'message': str(e)}), 500
+    return jsonify({
+        'run_id': run_id,
+        'status': 'queued' if started else 'running',
+        'already_running': not started,
+        'status_url': f'/api/prices/recalculation_runs/{run_id}'
+    }), 202
 
 
 @app.route('/api/items/margins', methods=['GET'])
@@ -1447,6 +1212,13 @@ def get_item_margins():
             cursor.execute("SELECT * FROM items WHERE archived IS NULL OR archived = FALSE")
             items = cursor.fetchall()
 
+        # Only prep items without a stored cost are resolved on the fly
+        to_resolve = [
+            it.get('item_id') for it in items
+            if it and it.get('cost') is None and it.get('is_prep') and it.get('yield_unit')
+        ]
+        graph = cached_graph(item_ids=to_resolve) if to_resolve else None
+
         results = []
         for it in items:
             if not it:
@@ -1473,8 +1245,8 @@ def get_item_margins():
 
             # attempt to compute on the fly if prep and cost is missing
             if cost is None:
-                if it.get('is_prep') and it.get('yield_unit'):
-                    res = resolve_item_cost(item_id, it.get('yield_unit'), 1)
+                if graph is not None and it.get('is_prep') and it.get('yield_unit'):
+                    res = graph.resolve_item(item_id, it.get('yield_unit'), 1)
                     if res.get('status') == 'ok':
                         try:
                             cost = float(res.get('cost_per_unit')) if res.get('cost_per_unit') is not None else None
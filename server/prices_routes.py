@@ -1,7 +1,10 @@
 from flask import Blueprint, request, jsonify
 from datetime import date, datetime, timedelta
+import logging
 from .utils.db import get_db_cursor
-from .utils.cost_resolver import resolve_item_cost
+from .utils.cost_cache import cached_menu_unit_costs
+from .utils.cost_propagation import propagate_cost_changes
+from .utils.cost_rollup import rollup_item_costs
 
 prices_bp = Blueprint('prices', __name__, url_prefix='/api')
 
@@ -30,6 +33,44 @@ def _iso(val):
     return val
 
 
+# GROUPING(trend_date, is_current, name, item_id, category) of each set in margin_dashboard
+_DASHBOARD_ITEMS = 0b10000
+_DASHBOARD_DAYS = 0b01111
+_DASHBOARD_CATEGORIES = 0b10110
+_DASHBOARD_WINDOW = 0b10111
+
+
+def _yield_unit(graph, item_id):
+    item = graph.items.get(item_id) or {}
+    return (item.get('yield_unit') or '').strip().lower() or 'each'
+
+
+def _resolve_unit_cost(graph, item_id):
+    try:
+        return graph.resolve_item(item_id, _yield_unit(graph, item_id), 1)
+    except Exception as e:
+        return {'status': 'error', 'issue': 'exception', 'message': str(e)}
+
+
+def _menu_unit_costs(graph):
+    """{item_id: cost per yield unit} for every item on the graph that can be costed.
+
+    The whole menu goes through rollup_item_costs at once; callers that need to
+    know why an item is missing resolve it with _resolve_unit_cost.
+    """
+    requests = [(item_id, _yield_unit(graph, item_id)) for item_id in graph.items]
+    try:
+        results = rollup_item_costs(graph, requests).values()
+    except Exception:
+        logging.exception("Vectorized cost rollup failed; resolving menu items one at a time")
+        results = [_resolve_unit_cost(graph, item_id) for item_id, _ in requests]
+    return {
+        r['item_id']: float(r['cost_per_unit'])
+        for r in results
+        if isinstance(r, dict) and r.get('status') == 'ok'
+    }
+
+
 def _normalize_run(row):
     if not row:
         return None
@@ -98,6 +139,10 @@ def create_price_quote():
             data.get('is_purchase', False)
         ))
         new_quote = cursor.fetchone()
+        try:
+            propagate_cost_changes('price_quote', ingredient_ids=[new_quote.get('ingredient_id')])
+        except Exception as e:
+            print(f"Cost propagation failed for ingredient {new_quote.get('ingredient_id')}: {e}")
         return jsonify(new_quote), 201
     finally:
         cursor.close()
@@ -126,6 +171,10 @@ def update_price_quote(quote_id):
         updated = cursor.fetchone()
         if not updated:
             return jsonify({"error": "Quote not found"}), 404
+        try:
+            propagate_cost_changes('price_quote', ingredient_ids=[updated.get('ingredient_id')])
+        except Exception as e:
+            print(f"Cost propagation failed for ingredient {updated.get('ingredient_id')}: {e}")
         return jsonify(updated)
     finally:
         cursor.close()
@@ -173,110 +222,96 @@ def margin_dashboard():
 
     cursor = get_db_cursor()
     try:
-        cursor.execute(
-            """
-            SELECT
-                COALESCE(i.name, s.item_name) AS name,
-                s.item_id,
-                COALESCE(s.sales_category, 'Uncategorized') AS category,
-                SUM(COALESCE(s.item_qty, 0)) AS qty,
-                SUM(COALESCE(s.net_sales, 0)) AS net_sales,
-                SUM(COALESCE(s.gross_sales, 0)) AS gross_sales,
-                SUM(COALESCE(s.discount_amount, 0)) AS discounts,
-                COUNT(*) AS rows
-            FROM sales_daily_lines s
-            LEFT JOIN items i ON s.item_id = i.item_id
-            WHERE s.business_date BETWEEN %s AND %s
-            GROUP BY COALESCE(i.name, s.item_name), s.item_id, COALESCE(s.sales_category, 'Uncategorized')
-            """,
-            (start_date, end_date)
-        )
-        current_items = cursor.fetchall() or []
-
-        cursor.execute(
-            """
-            SELECT
-                COALESCE(i.name, s.item_name) AS name,
-                s.item_id,
-                SUM(COALESCE(s.item_qty, 0)) AS qty,
-                SUM(COALESCE(s.net_sales, 0)) AS net_sales,
-                SUM(COALESCE(s.gross_sales, 0)) AS gross_sales,
-                SUM(COALESCE(s.discount_amount, 0)) AS discounts
-            FROM sales_daily_lines s
-            LEFT JOIN items i ON s.item_id = i.item_id
-            WHERE s.business_date BETWEEN %s AND %s
-            GROUP BY COALESCE(i.name, s.item_name), s.item_id
-            """,
-            (prior_start, prior_end)
-        )
-        prior_items = cursor.fetchall() or []
-        prior_by_key = {
-            f"{r.get('item_id') or 'none'}|{(r.get('name') or '').strip().lower()}": r for r in prior_items
-        }
-
-        cursor.execute(
-            """
-            SELECT
-                s.business_date,
-                COALESCE(i.name, s.item_name) AS name,
-                s.item_id,
-                SUM(COALESCE(s.item_qty, 0)) AS qty,
-                SUM(COALESCE(s.net_sales, 0)) AS net_sales,
-                SUM(COALESCE(s.discount_amount, 0)) AS discounts
-            FROM sales_daily_lines s
-            LEFT JOIN items i ON s.item_id = i.item_id
-            WHERE s.business_date BETWEEN %s AND %s
-            GROUP BY s.business_date, COALESCE(i.name, s.item_name), s.item_id
-            ORDER BY s.business_date ASC
-            """,
-            (start_date, end_date)
-        )
-        per_day_rows = cursor.fetchall() or []
-
-        cursor.execute(
-            """
-            SELECT
-                SUM(CASE WHEN item_id IS NOT NULL THEN 1 ELSE 0 END) AS mapped_rows,
-                SUM(CASE WHEN item_id IS NULL THEN 1 ELSE 0 END) AS unmapped_rows
-            FROM sales_daily_lines
-            WHERE business_date BETWEEN %s AND %s
-            """,
-            (start_date, end_date)
-        )
-        mapping_row = cursor.fetchone() or {}
+        # Costs go into the scan so it can total each day's margin itself
+        # Rolled up once per cost inputs version
+        graph, unit_costs = cached_menu_unit_costs(_menu_unit_costs)
 
+        # One pass over both windows; GROUPING() tells the sets apart (see _DASHBOARD_* above)
         cursor.execute(
             """
+            WITH costs AS (
+                SELECT * FROM unnest(%s::int[], %s::float8[]) AS c(item_id, cost_per_unit)
+            ),
+            w AS (
+                SELECT
+                    s.business_date >= %s AS is_current,
+                    CASE WHEN s.business_date >= %s THEN s.business_date END AS trend_date,
+                    COALESCE(i.name, s.item_name) AS name,
+                    s.item_id,
+                    s.category,
+                    s.qty::float8 AS qty,
+                    s.net_sales::float8 AS net_sales,
+                    s.gross_sales::float8 AS gross_sales,
+                    s.discounts::float8 AS discounts,
+                    s.line_count,
+                    -- Margin is (realized price - cost) * qty per item and day, so
+                    -- items with no quantity that day add nothing
+                    CASE WHEN SUM(s.qty) OVER (PARTITION BY s.business_date, s.item_id) <> 0
+                         THEN s.net_sales::float8 - c.cost_per_unit * s.qty::float8 END AS margin
+                FROM sales_item_daily s
+                LEFT JOIN items i ON s.item_id = i.item_id
+                LEFT JOIN costs c ON c.item_id = s.item_id
+                WHERE s.business_date BETWEEN %s AND %s
+            )
             SELECT
-                COALESCE(s.sales_category, 'Uncategorized') AS category,
-                SUM(COALESCE(s.item_qty, 0)) AS qty,
-                SUM(COALESCE(s.net_sales, 0)) AS net_sales,
-                SUM(COALESCE(s.discount_amount, 0)) AS discounts
-            FROM sales_daily_lines s
-            WHERE s.business_date BETWEEN %s AND %s
-            GROUP BY COALESCE(s.sales_category, 'Uncategorized')
-            ORDER BY net_sales DESC
+                GROUPING(trend_date, is_current, name, item_id, category) AS grouping_set,
+                is_current,
+                trend_date AS business_date,
+                name,
+                item_id,
+                category,
+                SUM(qty) AS qty,
+                SUM(net_sales) AS net_sales,
+                SUM(gross_sales) AS gross_sales,
+                SUM(discounts) AS discounts,
+                SUM(margin) AS margin,
+                SUM(line_count) FILTER (WHERE item_id IS NOT NULL) AS mapped_rows,
+                SUM(line_count) FILTER (WHERE item_id IS NULL) AS unmapped_rows
+            FROM w
+            GROUP BY GROUPING SETS (
+                (is_current, name, item_id, category),
+                (trend_date),
+                (is_current, category),
+                (is_current)
+            )
             """,
-            (start_date, end_date)
+            (list(unit_costs), list(unit_costs.values()), start_date, start_date, prior_start, end_date)
         )
-        categories_rows = cursor.fetchall() or []
-
-        item_ids = {
-            row.get('item_id')
-            for row in current_items + prior_items
-            if row.get('item_id') is not None
-        }
-        yield_units = {}
-        if item_ids:
-            cursor.execute(
-                "SELECT item_id, yield_unit FROM items WHERE item_id = ANY(%s)",
-                (list(item_ids),)
-            )
-            for r in cursor.fetchall() or []:
-                yield_units[r.get('item_id')] = (r.get('yield_unit') or '').strip().lower() or None
+        current_items, per_day_rows, categories_rows = [], [], []
+        prior_by_key = {}
+        mapping_row = {}
+        for r in cursor.fetchall() or []:
+            grouping_set = r.get('grouping_set')
+            is_current = r.get('is_current')
+            if grouping_set == _DASHBOARD_ITEMS:
+                item_id = r.get('item_id')
+                if is_current:
+                    current_items.append(r)
+                    continue
+                # Prior window is compared per item and name, across categories
+                key = (item_id, r.get('name'))
+                prior = prior_by_key.get(key)
+                if prior is None:
+                    prior_by_key[key] = prior = {'item_id': item_id, 'name': r.get('name'), 'qty': 0.0, 'net_sales': 0.0, 'gross_sales': 0.0, 'discounts': 0.0}
+                for col in ('qty', 'net_sales', 'gross_sales', 'discounts'):
+                    prior[col] += float(r.get(col) or 0)
+            elif grouping_set == _DASHBOARD_DAYS:
+                # The prior window's days all fall in one NULL trend_date row
+                if r.get('business_date') is not None:
+                    per_day_rows.append(r)
+            elif not is_current:
+                continue
+            elif grouping_set == _DASHBOARD_CATEGORIES:
+                categories_rows.append(r)
+            elif grouping_set == _DASHBOARD_WINDOW:
+                mapping_row = r
+        categories_rows.sort(key=lambda r: float(r.get('net_sales') or 0), reverse=True)
+        prior_items = list(prior_by_key.values())
+        prior_by_name = {}
+        for r in prior_items:
+            prior_key = f"{r.get('item_id') or 'none'}|{(r.get('name') or '').strip().lower()}"
+            prior_by_name[prior_key] = r
 
-        # Resolve cost per item_id once
-        cost_cache = {}
         missing_cost_items = []
         items_payload = []
         totals_margin = 0.0
@@ -287,31 +322,18 @@ def margin_dashboard():
 
         for row in current_items:
             item_id = row.get('item_id')
-            key = f"{item_id}" if item_id is not None else None
             name = row.get('name')
             qty = float(row.get('qty') or 0)
             net_val = float(row.get('net_sales') or 0)
             gross_val = float(row.get('gross_sales') or 0)
             disc_val = float(row.get('discounts') or 0)
 
-            cost_per_unit = None
+            cost_per_unit = unit_costs.get(item_id)
             cost_issue = None
-            if item_id is not None:
-                if key in cost_cache:
-                    cost_per_unit, cost_issue = cost_cache[key]
-                else:
-                    recipe_unit = yield_units.get(item_id) or 'each'
-                    try:
-                        cost_result = resolve_item_cost(item_id, recipe_unit, 1)
-                    except Exception as e:
-                        cost_result = {'status': 'error', 'issue': 'exception', 'message': str(e)}
-                    if isinstance(cost_result, dict) and cost_result.get('status') == 'ok':
-                        cost_per_unit = float(cost_result.get('cost_per_unit'))
-                    else:
-                        cost_issue = cost_result
-                    cost_cache[key] = (cost_per_unit, cost_issue)
-            else:
+            if item_id is None:
                 cost_issue = {'status': 'unmapped'}
+            elif cost_per_unit is None:
+                cost_issue = _resolve_unit_cost(graph, item_id)
 
             realized_price = net_val / qty if qty else None
             margin_unit = None
@@ -328,9 +350,9 @@ def margin_dashboard():
             totals_qty += qty
             totals_discounts += disc_val
 
-            prior_row = prior_by_key.get(f"{item_id or 'none'}|{(name or '').strip().lower()}")
-            prior_net = float(prior_row.get('net_sales') or 0) if prior_row else 0.0
-            prior_qty = float(prior_row.get('qty') or 0) if prior_row else 0.0
+            prior_row = prior_by_name.get(f"{item_id or 'none'}|{(name or '').strip().lower()}")
+            prior_net = prior_row['net_sales'] if prior_row else 0.0
+            prior_qty = prior_row['qty'] if prior_row else 0.0
 
             if cost_issue and item_id is not None:
                 missing_cost_items.append({
@@ -359,51 +381,32 @@ def margin_dashboard():
                 'prior_qty': prior_qty
             })
 
-        # Daily trend with margin (uses resolved cost cache)
-        daily_map = {}
-        for r in per_day_rows:
-            day = _iso(r.get('business_date'))
-            qty = float(r.get('qty') or 0)
-            net_val = float(r.get('net_sales') or 0)
-            disc_val = float(r.get('discounts') or 0)
-            item_id = r.get('item_id')
-            cost_per_unit = None
-            if item_id is not None:
-                cost_per_unit, _ = cost_cache.get(f"{item_id}", (None, None))
-            margin_part = (net_val / qty - cost_per_unit) * qty if cost_per_unit is not None and qty else 0.0
-            entry = daily_map.get(day) or {'business_date': day, 'qty': 0.0, 'net_sales': 0.0, 'discounts': 0.0, 'margin': 0.0}
-            entry['qty'] += qty
-            entry['net_sales'] += net_val
-            entry['discounts'] += disc_val
-            entry['margin'] += margin_part
-            daily_map[day] = entry
-        daily = sorted(daily_map.values(), key=lambda x: x['business_date'])
-
-        prior_totals_net = sum(float(r.get('net_sales') or 0) for r in prior_items)
-        prior_totals_qty = sum(float(r.get('qty') or 0) for r in prior_items)
-        prior_totals_gross = sum(float(r.get('gross_sales') or 0) for r in prior_items)
-        prior_totals_disc = sum(float(r.get('discounts') or 0) for r in prior_items)
+        daily = [
+            {
+                'business_date': _iso(r.get('business_date')),
+                'qty': float(r.get('qty') or 0),
+                'net_sales': float(r.get('net_sales') or 0),
+                'discounts': float(r.get('discounts') or 0),
+                'margin': float(r.get('margin') or 0)
+            }
+            for r in per_day_rows
+        ]
+        daily.sort(key=lambda x: x['business_date'])
+
+        prior_totals_net = sum(r['net_sales'] for r in prior_items)
+        prior_totals_qty = sum(r['qty'] for r in prior_items)
+        prior_totals_gross = sum(r['gross_sales'] for r in prior_items)
+        prior_totals_disc = sum(r['discounts'] for r in prior_items)
         prior_margin_total = 0.0
         for r in prior_items:
-            qty_val = float(r.get('qty') or 0)
-            net_val = float(r.get('net_sales') or 0)
-            item_id = r.get('item_id')
+            qty_val = r['qty']
+            item_id = r['item_id']
             if not qty_val or item_id is None:
                 continue
-            cached = cost_cache.get(f"{item_id}")
-            if cached:
-                cost_per_unit = cached[0]
-            else:
-                recipe_unit = yield_units.get(item_id) or 'each'
-                try:
-                    cost_result = resolve_item_cost(item_id, recipe_unit, 1)
-                except Exception as e:
-                    cost_result = {'status': 'error', 'issue': 'exception', 'message': str(e)}
-                cost_per_unit = float(cost_result.get('cost_per_unit')) if isinstance(cost_result, dict) and cost_result.get('status') == 'ok' else None
-                cost_cache[f"{item_id}"] = (cost_per_unit, cost_result if (not cost_per_unit) else None)
+            cost_per_unit = unit_costs.get(item_id)
             if cost_per_unit is None:
                 continue
-            realized = net_val / qty_val
+            realized = r['net_sales'] / qty_val
             prior_margin_total += (realized - cost_per_unit) * qty_val
         prior_summary = {
             'net_sales': prior_totals_net,
@@ -424,7 +427,7 @@ def margin_dashboard():
             }
             for r in current_items if r.get('item_id') is None
         ]
-        unmapped = sorted(unmapped, key=lambda x: x['net_sales'], reverse=True)[:15]
+        unmapped = sorted(unmapped, key=lambda x: (-x['net_sales'], x['name'] or ''))[:15]
 
         categories = [
             {
@@ -489,7 +492,7 @@ def margin_dashboard():
 
 @prices_bp.route('/prices/margin_history', methods=['GET'])
 def margin_history():
-    """Historical daily gross/net/discount/cogs/margin using latest cost snapshot as of each sale day."""
+    """Historical daily gross/net/discount/cogs/margin using the cost in effect on each sale day (item_cost_intervals)."""
     today = date.today()
     end_date = _parse_date_arg(request.args.get('end_date'), today)
 
@@ -511,16 +514,16 @@ def margin_history():
             """
             WITH sales_by_item_day AS (
                 SELECT
-                    s.business_date::date AS business_date,
+                    s.business_date,
                     s.item_id,
-                    SUM(COALESCE(s.item_qty, 0)) AS qty,
-                    SUM(COALESCE(s.net_sales, 0)) AS net_sales,
-                    SUM(COALESCE(s.gross_sales, 0)) AS gross_sales,
-                    SUM(COALESCE(s.discount_amount, 0)) AS discounts
-                FROM sales_daily_lines s
+                    SUM(s.qty) AS qty,
+                    SUM(s.net_sales) AS net_sales,
+                    SUM(s.gross_sales) AS gross_sales,
+                    SUM(s.discounts) AS discounts
+                FROM sales_item_daily s
                 WHERE s.business_date BETWEEN %s AND %s
                   AND s.item_id IS NOT NULL
-                GROUP BY s.business_date::date, s.item_id
+                GROUP BY s.business_date, s.item_id
             ),
             costed AS (
                 SELECT
@@ -530,29 +533,12 @@ def margin_history():
                     sid.net_sales,
                     sid.gross_sales,
                     sid.discounts,
-                    snap.cost_per_unit
+                    ci.cost_per_unit
                 FROM sales_by_item_day sid
-                LEFT JOIN LATERAL (
-                    SELECT snap_choice.cost_per_unit
-                    FROM (
-                        SELECT ics.cost_per_unit, ics.created_at, ics.snapshot_id, 0 AS priority
-                        FROM item_cost_snapshots ics
-                        WHERE ics.item_id = sid.item_id
-                          AND ics.status = 'ok'
-                          AND ics.created_at < (sid.business_date::timestamp + INTERVAL '1 day')
-                        UNION ALL
-                        SELECT ics.cost_per_unit, ics.created_at, ics.snapshot_id, 1 AS priority
-                        FROM item_cost_snapshots ics
-                        WHERE ics.item_id = sid.item_id
-                          AND ics.status = 'ok'
-                    ) snap_choice
-                    ORDER BY
-                        snap_choice.priority ASC,
-                        CASE WHEN snap_choice.priority = 0 THEN snap_choice.created_at END DESC NULLS LAST,
-                        CASE WHEN snap_choice.priority = 1 THEN snap_choice.created_at END ASC NULLS LAST,
-                        snap_choice.snapshot_id DESC
-                    LIMIT 1
-                ) snap ON TRUE
+                LEFT JOIN item_cost_intervals ci
+                    ON ci.item_id = sid.item_id
+                   AND sid.business_date >= ci.valid_from
+                   AND sid.business_date < ci.valid_to
             )
             SELECT
                 business_date,
@@ -656,3 +642,38 @@ def recalculation_runs():
             cursor.close()
         except Exception:
             pass
+
+
+@prices_bp.route('/prices/recalculation_runs/<int:run_id>', methods=['GET'])
+def recalculation_run_status(run_id):
+    """Status and progress of one recalculation run (poll while queued/running)."""
+    cursor = get_db_cursor()
+    try:
+        cursor.execute(
+            """
+            SELECT run_id, trigger_source, status, started_at, completed_at, items_scanned, items_updated, items_failed, summary
+            FROM cost_recalculation_runs
+            WHERE run_id = %s
+            """,
+            (run_id,)
+        )
+        row = cursor.fetchone()
+        if not row:
+            return jsonify({'error': 'Run not found'}), 404
+        run = _normalize_run(row)
+        summary = run.get('summary') if isinstance(run.get('summary'), dict) else {}
+        items_total = summary.get('items_total')
+        run['items_total'] = items_total
+        if run['status'] in ('completed', 'completed_with_errors'):
+            run['progress_pct'] = 100.0
+        elif items_total:
+            run['progress_pct'] = round(min(run['items_scanned'] / items_total, 1.0) * 100, 1)
+        else:
+            run['progress_pct'] = 0.0
+        run['done'] = run['status'] not in ('queued', 'running')
+        return jsonify(run)
+    finally:
+        try:
+            cursor.close()
+        except Exception:
+            pass
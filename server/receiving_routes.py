@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify
 from .utils.db import get_db_cursor
 from .utils.conversion_helper import convert_to_base
+from .utils.cost_propagation import propagate_cost_changes
 import traceback
 
 receiving_bp = Blueprint('receiving', __name__, url_prefix='/api')
@@ -42,6 +43,11 @@ def submit_receiving():
                     receive_date
                 ))
 
+        try:
+            propagate_cost_changes('receiving', ingredient_ids=[item.get('ingredientId') for item in items])
+        except Exception as e:
+            print(f"Cost propagation failed after receiving: {e}")
+
         return jsonify({"status": "success"}), 201
 
     except Exception as e:
@@ -1,6 +1,6 @@
 from flask import Blueprint, request, jsonify
 from .utils.db import get_db_cursor
-from .utils.cost_resolver import resolve_item_cost
+from .utils.cost_cache import cached_graph
 
 reports_bp = Blueprint('reports', __name__, url_prefix='/api')
 
@@ -14,15 +14,33 @@ def daily_margin():
     try:
         cursor.execute("""
             SELECT s.item_id, COALESCE(i.name, s.item_name) AS name,
-                   SUM(COALESCE(s.item_qty,0)) AS qty_sold,
-                   SUM(COALESCE(s.net_sales,0)) AS net_sales
-            FROM sales_daily_lines s
+                   SUM(s.qty) AS qty_sold,
+                   SUM(s.net_sales) AS net_sales
+            FROM sales_item_daily s
             LEFT JOIN items i ON s.item_id = i.item_id
             WHERE s.business_date = %s
             GROUP BY s.item_id, COALESCE(i.name, s.item_name)
         """, (business_date,))
         rows = cursor.fetchall()
 
+        # Stored costs for every sold item in one query; items without one are
+        # resolved from their recipes on the cached recipe graph.
+        item_ids = list({r.get('item_id') for r in rows if r.get('item_id')})
+        item_rows = {}
+        if item_ids:
+            cursor.execute("SELECT item_id, cost, yield_unit FROM items WHERE item_id = ANY(%s)", (item_ids,))
+            item_rows = {it.get('item_id'): it for it in cursor.fetchall()}
+        to_resolve = [
+            i for i, it in item_rows.items()
+            if it.get('cost') is None and it.get('yield_unit')
+        ]
+        graph = None
+        if to_resolve:
+            try:
+                graph = cached_graph(item_ids=to_resolve)
+            except Exception:
+                graph = None
+
         results = []
         totals = {'net_sales': 0.0, 'cost_of_goods': 0.0, 'margin': 0.0}
 
@@ -38,17 +56,14 @@ def daily_margin():
             if item_id:
                 # try to read stored cost on item first
                 try:
-                    c = get_db_cursor()
-                    c.execute("SELECT cost, yield_unit FROM items WHERE item_id = %s", (item_id,))
-                    it = c.fetchone()
-                    c.close()
+                    it = item_rows.get(item_id)
                     if it and it.get('cost') is not None:
                         cost_per_unit = float(it.get('cost'))
                     else:
                         # attempt to resolve using recipe & yield_unit
                         unit = it.get('yield_unit') if it else None
-                        if unit:
-                            res = resolve_item_cost(item_id, unit, 1)
+                        if unit and graph is not None:
+                            res = graph.resolve_item(item_id, unit, 1)
                             if isinstance(res, dict) and res.get('status') == 'ok':
                                 cost_per_unit = float(res.get('cost_per_unit'))
                 except Exception:
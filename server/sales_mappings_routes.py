@@ -1,5 +1,6 @@
 from flask import Blueprint, request, jsonify
-from .utils.db import get_db_cursor
+from .utils.db import get_db_cursor, transaction
+from .utils.sales_mappings import apply_sales_mappings, queue_mapping_reconcile, remap_sales_name
 import logging
 
 sales_mappings_bp = Blueprint('sales_mappings', __name__, url_prefix='/api')
@@ -29,29 +30,27 @@ def create_mapping():
     try:
         norm = sales_name.strip().lower()
         try:
-            # Check if a mapping already exists for this normalized name
-            cursor.execute("SELECT mapping_id, item_id FROM sales_item_mappings WHERE normalized = %s LIMIT 1", (norm,))
-            existing = cursor.fetchone()
-            if existing:
-                # Update existing mapping
-                cursor.execute(
-                    "UPDATE sales_item_mappings SET sales_name = %s, item_id = %s, updated_at = now() WHERE mapping_id = %s RETURNING mapping_id",
-                    (sales_name, item_id, existing.get('mapping_id'))
-                )
-                row = cursor.fetchone()
-            else:
-                cursor.execute(
-                    "INSERT INTO sales_item_mappings (sales_name, normalized, item_id) VALUES (%s, %s, %s) RETURNING mapping_id",
-                    (sales_name, norm, item_id)
-                )
-                row = cursor.fetchone()
-
-            try:
-                cursor.connection.commit()
-            except Exception:
-                pass
-            logging.info("Saved sales mapping: %s -> %s", norm, item_id)
-            return jsonify({'status': 'ok', 'mapping_id': row.get('mapping_id')})
+            with transaction():
+                # Check if a mapping already exists for this normalized name
+                cursor.execute("SELECT mapping_id, item_id FROM sales_item_mappings WHERE normalized = %s LIMIT 1 FOR UPDATE", (norm,))
+                existing = cursor.fetchone()
+                if existing:
+                    # Update existing mapping
+                    cursor.execute(
+                        "UPDATE sales_item_mappings SET sales_name = %s, item_id = %s, updated_at = now() WHERE mapping_id = %s RETURNING mapping_id",
+                        (sales_name, item_id, existing.get('mapping_id'))
+                    )
+                    row = cursor.fetchone()
+                else:
+                    cursor.execute(
+                        "INSERT INTO sales_item_mappings (sales_name, normalized, item_id) VALUES (%s, %s, %s) RETURNING mapping_id",
+                        (sales_name, norm, item_id)
+                    )
+                    row = cursor.fetchone()
+                # Re-map this name's lines (and their sales_item_daily days) with the mapping
+                remapped = remap_sales_name(cursor, norm, item_id, existing.get('item_id') if existing else None)
+            logging.info("Saved sales mapping: %s -> %s (%s lines remapped)", norm, item_id, remapped)
+            return jsonify({'status': 'ok', 'mapping_id': row.get('mapping_id'), 'remapped': remapped})
         except Exception as e:
             try:
                 cursor.connection.rollback()
@@ -85,52 +84,18 @@ def reconcile_sales_mappings():
     Optional JSON body:
       { "business_date": "YYYY-MM-DD" }
       or { "upload_id": <id> }
-    Returns number of rows updated.
+    Returns number of rows updated. Without a filter every line is reconciled
+    by a background job instead, and 202 is returned straight away.
     """
     data = request.get_json() or {}
     business_date = data.get('business_date')
     upload_id = data.get('upload_id')
+    if upload_id is None and not business_date:
+        queue_mapping_reconcile()
+        return jsonify({'status': 'queued'}), 202
     cursor = get_db_cursor()
     try:
-        if upload_id is not None:
-            cursor.execute(
-                """
-                UPDATE sales_daily_lines s
-                SET item_id = m.item_id
-                FROM sales_item_mappings m
-                WHERE s.item_id IS NULL
-                AND lower(trim(s.item_name)) = m.normalized
-                AND s.upload_id = %s
-                RETURNING s.id
-                """,
-                (upload_id,)
-            )
-        elif business_date:
-            cursor.execute(
-                """
-                UPDATE sales_daily_lines s
-                SET item_id = m.item_id
-                FROM sales_item_mappings m
-                WHERE s.item_id IS NULL
-                AND lower(trim(s.item_name)) = m.normalized
-                AND s.business_date = %s
-                RETURNING s.id
-                """,
-                (business_date,)
-            )
-        else:
-            cursor.execute(
-                """
-                UPDATE sales_daily_lines s
-                SET item_id = m.item_id
-                FROM sales_item_mappings m
-                WHERE s.item_id IS NULL
-                AND lower(trim(s.item_name)) = m.normalized
-                RETURNING s.id
-                """
-            )
-        rows = cursor.fetchall()
-        count = len(rows) if rows else 0
+        count = apply_sales_mappings(cursor, upload_id=upload_id, business_date=business_date)
         return jsonify({'status': 'ok', 'updated': count})
     finally:
         try:
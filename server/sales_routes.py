@@ -1,16 +1,30 @@
-from flask import Blueprint, request, jsonify
-from .utils.db import get_db_cursor
+from flask import Blueprint, Response, json, request, jsonify, stream_with_context
+from psycopg2.extras import Json, RealDictCursor
+from .utils.db import get_db_connection, get_db_cursor, transaction
+from .utils.numeric import parse_decimal as parse_numeric
+from .utils.sales_ingest import SALES_LINE_SCHEMA, STALE_UPLOAD_MINUTES, queue_upload, resume_if_stale
+from .utils.sales_rollup import refresh_sales_item_daily
+import base64
 import csv
 import io
+import logging
 import re
 import hashlib
-from decimal import Decimal, InvalidOperation
+import codecs
 from datetime import datetime, date, timedelta
 
 sales_bp = Blueprint('sales', __name__, url_prefix='/api')
 
 ID_FIELDS = ['Master ID', 'Item ID', 'Parent ID']
 
+# Uploaded files are read and stored in chunks of this many bytes
+UPLOAD_READ_CHUNK = 1024 * 1024
+
+# /sales/lines page sizes; NDJSON streams fetch LINES_STREAM_BATCH rows per round trip
+LINES_PAGE_SIZE = 1000
+LINES_PAGE_MAX = 5000
+LINES_STREAM_BATCH = 2000
+
 
 def parse_date_arg(value, fallback=None):
     if not value:
@@ -28,43 +42,47 @@ def daterange(start_day, end_day):
         current += timedelta(days=1)
 
 
-def normalize_id(val):
-    if val is None:
-        return None
-    s = str(val).strip()
-    if s == '':
-        return None
-    # Remove surrounding quotes
-    s = s.strip('"')
-    # Try to parse as Decimal then int to avoid scientific notation
-    try:
-        d = Decimal(s)
-        # If it's effectively integer, convert to int
-        try:
-            i = int(d)
-            return str(i)
-        except (OverflowError, ValueError):
-            # fallback to plain string without decimal part
-            pass
-    except (InvalidOperation, ValueError):
-        pass
-    # Fallback: remove decimal part if present
-    if '.' in s:
-        return s.split('.')[0]
-    return s
-
+def _scan_upload_stream(stream):
+    """Return (sha256 hex, encoding) of an uploaded file without holding it in memory.
 
-def parse_numeric(val):
-    if val is None or val == '':
-        return None
-    try:
-        # Remove currency symbols and commas
-        cleaned = re.sub(r"[^0-9.\-]", "", str(val))
-        if cleaned == '':
-            return None
-        return Decimal(cleaned)
-    except (InvalidOperation, ValueError):
-        return None
+    The encoding is utf-8 when the whole file decodes as utf-8, latin-1 otherwise.
+    The stream is rewound afterwards.
+    """
+    sha = hashlib.sha256()
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    encoding = 'utf-8'
+    while True:
+        chunk = stream.read(UPLOAD_READ_CHUNK)
+        if not chunk:
+            break
+        sha.update(chunk)
+        if encoding == 'utf-8':
+            try:
+                decoder.decode(chunk)
+            except UnicodeDecodeError:
+                encoding = 'latin-1'
+    if encoding == 'utf-8':
+        try:
+            decoder.decode(b'', final=True)
+        except UnicodeDecodeError:
+            encoding = 'latin-1'
+    stream.seek(0)
+    return sha.hexdigest(), encoding
+
+
+def _store_upload_text(cursor, upload_id, stream, encoding):
+    """Append the decoded file to sales_uploads.raw_text one chunk at a time."""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    while True:
+        chunk = stream.read(UPLOAD_READ_CHUNK)
+        text = decoder.decode(chunk, final=not chunk)
+        if text:
+            cursor.execute(
+                "UPDATE sales_uploads SET raw_text = raw_text || %s WHERE id = %s",
+                (text, upload_id)
+            )
+        if not chunk:
+            break
 
 
 @sales_bp.route('/sales/upload', methods=['POST'])
@@ -72,25 +90,30 @@ def upload_sales():
     """Accept a CSV file upload (multipart/form-data) or JSON with base64? Frontend
     should post the CSV file as 'file'. We extract business_date from filename
     if possible and store rows into sales_uploads and sales_daily_lines.
+
+    The raw file is streamed into a sales_uploads row with status 'queued' and the
+    response (202) carries its upload_id and status_url right away; the lines are
+    parsed and inserted by a background job (see utils/sales_ingest.py), whose
+    progress GET /api/sales/uploads/<id>/status reports. The stored text is only
+    kept until the job is done with it.
+
+    Re-uploads are idempotent: a file identical to an earlier upload for the same
+    business_date is not queued again and the earlier upload is returned with
+    status 'duplicate'. Lines already present for the day (same content_hash) are
+    not inserted again but move to the new upload, so reversing the earlier upload
+    leaves them in place. With replace=true the file replaces the day's sales
+    instead: other lines and uploads for that day are removed as well.
     """
     # Auth is enforced globally in main.py before_request
 
-    file = None
     notes = request.form.get('notes') if request.form else None
     business_date = request.form.get('business_date') if request.form else None
     default_sales_category = request.form.get('default_sales_category') if request.form else None
+    replace = request.form.get('replace') if request.form else None
     if 'file' in request.files:
         file = request.files.get('file')
         filename = file.filename
-        raw = file.read()
-        # Prepare CSV reader
-        try:
-            text = raw.decode('utf-8')
-        except Exception:
-            try:
-                text = raw.decode('latin-1')
-            except Exception:
-                return jsonify({'error': 'Could not decode uploaded file'}), 400
+        stream = file.stream
     else:
         # Maybe a JSON body with CSV text
         payload = request.get_json() or {}
@@ -99,13 +122,11 @@ def upload_sales():
         notes = notes or payload.get('notes')
         business_date = business_date or payload.get('business_date')
         default_sales_category = default_sales_category or payload.get('default_sales_category')
+        replace = replace or payload.get('replace')
         if not csv_text:
             return jsonify({'error': 'No file uploaded'}), 400
-        text = csv_text
-        raw = text.encode('utf-8')
-
-    # compute sha256
-    file_sha = hashlib.sha256(raw).hexdigest()
+        stream = io.BytesIO(csv_text.encode('utf-8'))
+    file_sha, encoding = _scan_upload_stream(stream)
 
     # try to extract business_date from filename if not supplied
     if not business_date:
@@ -125,166 +146,112 @@ def upload_sales():
     else:
         return jsonify({'error': 'business_date is required. Please fill the Business Date field (YYYY-MM-DD). Filename date is optional.'}), 400
 
-    # parse CSV
-    reader = csv.DictReader(io.StringIO(text))
-    rows = list(reader)
-
-    # filter rows where an item name is present (supports legacy 'Menu Item' and new 'Item' header)
-    filtered = []
-    for r in rows:
-        item_field = (
-            r.get('Item') or r.get('item') or r.get('Item Name') or
-            r.get('Menu Item') or r.get('MenuItem') or r.get('Menu_Item')
-        )
-        if item_field is None:
-            continue
-        if str(item_field).strip() == '':
-            continue
-        filtered.append(r)
+    # Only the header is read here; a file the job could never ingest is rejected up front
+    header_line = stream.readline().decode(encoding)
+    stream.seek(0)
+    compiled = SALES_LINE_SCHEMA.compile(next(csv.reader(io.StringIO(header_line, newline='')), None))
+    if compiled.missing_required:
+        return jsonify({
+            'error': 'The file has no item name column (expected one of: Item, Item Name, Menu Item).',
+            'header': compiled.header
+        }), 400
+    replace = str(replace).strip().lower() in ('1', 'true', 'yes')
 
-    row_count = 0
     cursor = get_db_cursor()
     try:
-        # Insert upload record
-        cursor.execute(
-            """
-            INSERT INTO sales_uploads (source_filename, file_sha256, business_date, row_count, notes)
-            VALUES (%s, %s, %s, %s, %s)
-            RETURNING id
-            """,
-            (filename, file_sha, business_date, 0, notes)
-        )
-        upload_row = cursor.fetchone()
-        upload_id = upload_row.get('id') if upload_row else None
-
-        # iterate and insert lines
-        rn = 0
-        for r in filtered:
-            rn += 1
-            # IDs: support legacy and new header names
-            master_id = normalize_id(
-                r.get('Master ID') or r.get('MasterID') or r.get('master_id') or r.get('masterId')
-            )
-            item_id_text = normalize_id(
-                r.get('Item ID') or r.get('ItemID') or r.get('item_id') or r.get('itemGuid') or r.get('item_guid') or r.get('Item GUID')
-            )
-            parent_id = normalize_id(
-                r.get('Parent ID') or r.get('ParentID') or r.get('parent_id') or r.get('parentId')
-            )
-
-            # Category / name fields
-            menu_name = r.get('Menu Name') or r.get('MenuName')
-            menu_group = (
-                r.get('Sales Category') or r.get('SalesCategory') or r.get('Menu Group') or r.get('MenuGroup') or None
-            )
-            subgroup = r.get('Subgroup')
-            menu_item = (
-                r.get('Item') or r.get('item') or r.get('Item Name') or
-                r.get('Menu Item') or r.get('MenuItem') or r.get('Menu_Item')
-            )
-
-            # Numeric fields (support multiple header variants). We parse them so the upload is ready
-            avg_price = parse_numeric(
-                r.get('Avg. price') or r.get('Avg Price') or r.get('AvgPrice')
-            )
-            avg_item_price = parse_numeric(
-                r.get('Avg. item price (not incl. mods)') or r.get('Avg Item Price') or r.get('AvgItemPrice')
-            )
-            item_cogs = parse_numeric(
-                r.get('Item COGS') or r.get('Item Cogs') or r.get('ItemCOGS')
-            )
-            # Qty: prefer 'Qty sold', fallback to legacy 'Item Qty' or 'Item qty incl. voids'
-            item_qty = parse_numeric(
-                r.get('Qty sold') or r.get('Qty Sold') or r.get('Item Qty') or r.get('ItemQty') or r.get('Item_Qty') or r.get('Item qty incl. voids') or r.get('Item qty incl voids')
-            )
-            gross_amount = parse_numeric(
-                r.get('Gross sales') or r.get('Gross Sales') or r.get('Gross Amount') or r.get('GrossAmount') or r.get('Gross amount incl. voids')
-            )
-            void_qty = parse_numeric(
-                r.get('Voided qty sold') or r.get('Voided Qty Sold') or r.get('Void Qty') or r.get('VoidQty') or r.get('Voided qty sold')
-            )
-            discount_amount = parse_numeric(
-                r.get('Discount amount') or r.get('Discount Amount') or r.get('DiscountAmount')
-            )
-            refund_amount = parse_numeric(
-                r.get('Refund amount') or r.get('Refund Amount') or r.get('RefundAmount')
-            )
-            void_amount = parse_numeric(
-                r.get('Void amount') or r.get('Void Amount') or r.get('VoidAmount')
-            )
-            net_amount = parse_numeric(
-                r.get('Net sales') or r.get('Net Sales') or r.get('Net Amount') or r.get('NetAmount')
-            )
-            tax_amount = parse_numeric(
-                r.get('Tax') or r.get('Tax Amount') or r.get('TaxAmount')
-            )
-
-            # Skip rows that were not actually sold (zero quantity). Ignore rows where item_qty == 0.
-            if item_qty is not None and item_qty == 0:
-                continue
-
-            # attempt to map menu_item to an internal item_id using sales_item_mappings
-            mapped_item_id = None
-            try:
-                if menu_item and str(menu_item).strip() != '':
-                    norm_name = str(menu_item).strip().lower()
-                    cursor.execute("SELECT item_id FROM sales_item_mappings WHERE normalized = %s LIMIT 1", (norm_name,))
-                    mrow = cursor.fetchone()
-                    if mrow:
-                        mapped_item_id = mrow.get('item_id')
-            except Exception:
-                # mapping lookup failure should not block ingest
-                mapped_item_id = None
-
-            # row hash for deduplication
-            hash_input = f"{upload_id}|{master_id}|{item_id_text}|{menu_item}|{business_date}|{rn}"
-            row_hash = hashlib.sha256(hash_input.encode('utf-8')).hexdigest()
-
-            resolved_sales_category = (
-                (menu_group if menu_group is not None else None)
-                or (default_sales_category if default_sales_category is not None else None)
-                or (menu_name if menu_name is not None else None)
-                or ''
+        with transaction():
+            # Uploads for one business day are queued one at a time so identical files can't both pass the check
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"sales_upload_queue:{business_date}",))
+            cursor.execute(
+                """
+                SELECT id, row_count, status,
+                       (SELECT COUNT(*) FROM sales_uploads WHERE business_date = %s) AS day_uploads
+                FROM sales_uploads
+                WHERE file_sha256 = %s AND business_date = %s AND status <> 'failed'
+                ORDER BY id
+                LIMIT 1
+                """,
+                (business_date, file_sha, business_date)
             )
-            if resolved_sales_category is not None:
-                resolved_sales_category = str(resolved_sales_category).strip()
+            existing = cursor.fetchone()
+            # replace=true still has work to do when other uploads share the day
+            if existing and not (replace and existing.get('day_uploads') > 1):
+                return jsonify({
+                    'status': 'duplicate',
+                    'upload_id': existing.get('id'),
+                    'upload_status': existing.get('status'),
+                    'rows': existing.get('row_count'),
+                    'status_url': f"/api/sales/uploads/{existing.get('id')}/status",
+                    'warnings': [{
+                        'code': 'info_duplicate_file',
+                        'severity': 'info',
+                        'message': f"This file was already uploaded for {business_date} (upload {existing.get('id')}); nothing was imported."
+                    }]
+                })
 
             cursor.execute(
                 """
-                INSERT INTO sales_daily_lines (
-                    upload_id, row_num, row_hash, business_date, sales_category,
-                    item_name, item_id, item_qty, net_sales, discount_amount, gross_sales, tax_amount
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                INSERT INTO sales_uploads (source_filename, file_sha256, business_date, row_count, notes, status, raw_text, options)
+                VALUES (%s, %s, %s, %s, %s, 'queued', '', %s)
+                RETURNING id
                 """,
                 (
-                    upload_id,
-                    rn,
-                    row_hash,
-                    business_date,
-                    resolved_sales_category,
-                    menu_item,
-                    mapped_item_id,
-                    float(item_qty) if item_qty is not None else None,
-                    float(net_amount) if net_amount is not None else None,
-                    float(discount_amount) if discount_amount is not None else None,
-                    float(gross_amount) if gross_amount is not None else None,
-                    0.0
+                    filename, file_sha, business_date, 0, notes,
+                    Json({'default_sales_category': default_sales_category, 'replace': replace})
                 )
             )
-            row_count += 1
-
-        # update upload row_count
-        cursor.execute("UPDATE sales_uploads SET row_count = %s WHERE id = %s", (row_count, upload_id))
-
-        return jsonify({'status': 'ok', 'upload_id': upload_id, 'rows': row_count})
-
+            upload_id = cursor.fetchone().get('id')
+            _store_upload_text(cursor, upload_id, stream, encoding)
     except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
         try:
-            cursor.connection.rollback()
+            cursor.close()
         except Exception:
             pass
-        return jsonify({'error': str(e)}), 500
 
+    try:
+        queue_upload(upload_id)
+    except Exception as e:
+        logging.exception("Could not queue sales upload %s", upload_id)
+        return jsonify({'error': f'Upload {upload_id} was saved but could not be queued: {e}', 'upload_id': upload_id}), 500
+
+    return jsonify({
+        'status': 'queued',
+        'upload_id': upload_id,
+        'status_url': f"/api/sales/uploads/{upload_id}/status",
+        'warnings': compiled.warnings('Sales file')
+    }), 202
+
+
+@sales_bp.route('/sales/uploads/<int:upload_id>/status', methods=['GET'])
+def upload_status(upload_id):
+    """Progress of a sales upload: stage and parsed/inserted/mapped line counts."""
+    cursor = get_db_cursor()
+    try:
+        cursor.execute(
+            """
+            SELECT id, business_date, source_filename, status, stage, row_count,
+                   rows_parsed, rows_inserted, rows_skipped, rows_mapped, warnings, error,
+                   created_at, started_at, completed_at,
+                   COALESCE(started_at, created_at) < now() - (%s * INTERVAL '1 minute') AS stale
+            FROM sales_uploads
+            WHERE id = %s
+            """,
+            (STALE_UPLOAD_MINUTES, upload_id)
+        )
+        upload = cursor.fetchone()
+        if not upload:
+            return jsonify({'error': 'Upload not found'}), 404
+        requeued = resume_if_stale(upload)
+        upload = dict(upload)
+        upload.pop('stale', None)
+        for key in ('business_date', 'created_at', 'started_at', 'completed_at'):
+            upload[key] = _iso(upload.get(key))
+        upload['upload_id'] = upload.pop('id')
+        upload['requeued'] = requeued
+        upload['done'] = upload.get('status') not in ('queued', 'processing')
+        return jsonify(upload)
     finally:
         try:
             cursor.close()
@@ -296,12 +263,18 @@ def upload_sales():
 def list_uploads():
     """List sales uploads, optionally filtered by business_date"""
     business_date = request.args.get('business_date')
+    # Everything but raw_text, which is only kept while the upload waits for its job
+    columns = """
+        id, source_filename, file_sha256, business_date, row_count, notes, created_at,
+        status, stage, rows_parsed, rows_inserted, rows_skipped, rows_mapped, warnings, error,
+        started_at, completed_at
+    """
     cursor = get_db_cursor()
     try:
         if business_date:
-            cursor.execute("SELECT * FROM sales_uploads WHERE business_date = %s ORDER BY created_at DESC", (business_date,))
+            cursor.execute(f"SELECT {columns} FROM sales_uploads WHERE business_date = %s ORDER BY created_at DESC", (business_date,))
         else:
-            cursor.execute("SELECT * FROM sales_uploads ORDER BY created_at DESC LIMIT 100")
+            cursor.execute(f"SELECT {columns} FROM sales_uploads ORDER BY created_at DESC LIMIT 100")
         rows = cursor.fetchall()
         return jsonify(rows)
     finally:
@@ -319,7 +292,10 @@ def _iso(val):
 
 @sales_bp.route('/sales/uploads/summary', methods=['GET'])
 def uploads_summary():
-    """Summarize what is currently in sales uploads and sales_daily_lines so we know data coverage."""
+    """Summarize what is currently in sales uploads and sales_daily_lines so we know data coverage.
+
+    Line totals come from the sales_item_daily rollup.
+    """
     cursor = get_db_cursor()
     try:
         cursor.execute(
@@ -338,12 +314,12 @@ def uploads_summary():
         cursor.execute(
             """
             SELECT
-                COUNT(*) AS rows,
-                SUM(COALESCE(item_qty, 0)) AS qty,
-                SUM(COALESCE(net_sales, 0)) AS net_sales,
-                SUM(COALESCE(gross_sales, 0)) AS gross_sales,
-                SUM(COALESCE(discount_amount, 0)) AS discounts
-            FROM sales_daily_lines
+                SUM(line_count) AS rows,
+                SUM(qty) AS qty,
+                SUM(net_sales) AS net_sales,
+                SUM(gross_sales) AS gross_sales,
+                SUM(discounts) AS discounts
+            FROM sales_item_daily
             """
         )
         totals_row = cursor.fetchone() or {}
@@ -357,11 +333,11 @@ def uploads_summary():
             """
             SELECT
                 business_date,
-                COUNT(*) AS rows,
-                SUM(COALESCE(item_qty, 0)) AS qty,
-                SUM(COALESCE(net_sales, 0)) AS net_sales,
-                SUM(COALESCE(discount_amount, 0)) AS discounts
-            FROM sales_daily_lines
+                SUM(line_count) AS rows,
+                SUM(qty) AS qty,
+                SUM(net_sales) AS net_sales,
+                SUM(discounts) AS discounts
+            FROM sales_item_daily
             GROUP BY business_date
             ORDER BY business_date DESC
             LIMIT 31
@@ -384,11 +360,11 @@ def uploads_summary():
         cursor.execute(
             """
             SELECT
-                SUM(CASE WHEN item_id IS NOT NULL THEN 1 ELSE 0 END) AS mapped_rows,
-                SUM(CASE WHEN item_id IS NULL THEN 1 ELSE 0 END) AS unmapped_rows,
+                SUM(CASE WHEN item_id IS NOT NULL THEN line_count ELSE 0 END) AS mapped_rows,
+                SUM(CASE WHEN item_id IS NULL THEN line_count ELSE 0 END) AS unmapped_rows,
                 COUNT(DISTINCT item_id) FILTER (WHERE item_id IS NOT NULL) AS mapped_items,
-                COUNT(DISTINCT LOWER(TRIM(item_name))) AS distinct_sales_names
-            FROM sales_daily_lines
+                COUNT(DISTINCT name_key) AS distinct_sales_names
+            FROM sales_item_daily
             """
         )
         mapping_row = cursor.fetchone() or {}
@@ -398,9 +374,9 @@ def uploads_summary():
             """
             SELECT
                 COALESCE(i.name, s.item_name) AS name,
-                SUM(COALESCE(s.net_sales, 0)) AS net_sales,
-                SUM(COALESCE(s.item_qty, 0)) AS qty_sold
-            FROM sales_daily_lines s
+                SUM(s.net_sales) AS net_sales,
+                SUM(s.qty) AS qty_sold
+            FROM sales_item_daily s
             LEFT JOIN items i ON s.item_id = i.item_id
             GROUP BY COALESCE(i.name, s.item_name)
             ORDER BY net_sales DESC
@@ -422,12 +398,12 @@ def uploads_summary():
         cursor.execute(
             """
             SELECT
-                COALESCE(s.sales_category, 'Uncategorized') AS category,
-                COUNT(*) AS rows,
-                SUM(COALESCE(s.net_sales, 0)) AS net_sales,
-                SUM(COALESCE(s.item_qty, 0)) AS qty_sold
-            FROM sales_daily_lines s
-            GROUP BY COALESCE(s.sales_category, 'Uncategorized')
+                s.category,
+                SUM(s.line_count) AS rows,
+                SUM(s.net_sales) AS net_sales,
+                SUM(s.qty) AS qty_sold
+            FROM sales_item_daily s
+            GROUP BY s.category
             ORDER BY net_sales DESC
             LIMIT 15
             """
@@ -446,11 +422,11 @@ def uploads_summary():
         cursor.execute(
             """
             SELECT
-                SUM(CASE WHEN net_sales IS NOT NULL THEN 1 ELSE 0 END) AS net_sales_rows,
-                SUM(CASE WHEN gross_sales IS NOT NULL THEN 1 ELSE 0 END) AS gross_sales_rows,
-                SUM(CASE WHEN discount_amount IS NOT NULL THEN 1 ELSE 0 END) AS discount_rows,
-                SUM(CASE WHEN item_qty IS NOT NULL THEN 1 ELSE 0 END) AS qty_rows
-            FROM sales_daily_lines
+                SUM(net_sales_lines) AS net_sales_rows,
+                SUM(gross_sales_lines) AS gross_sales_rows,
+                SUM(discount_lines) AS discount_rows,
+                SUM(qty_lines) AS qty_rows
+            FROM sales_item_daily
             """
         )
         field_cov = cursor.fetchone() or {}
@@ -506,41 +482,46 @@ def reverse_upload(upload_id):
     """Delete all sales data associated with a given upload."""
     cursor = get_db_cursor()
     try:
-        cursor.execute("SELECT * FROM sales_uploads WHERE id = %s", (upload_id,))
+        cursor.execute("SELECT id, business_date, status FROM sales_uploads WHERE id = %s", (upload_id,))
         upload = cursor.fetchone()
         if not upload:
             return jsonify({'error': 'Upload not found'}), 404
+        if upload.get('status') in ('queued', 'processing'):
+            return jsonify({'error': 'Upload is still being processed; reverse it once it has finished'}), 409
 
         business_date = upload.get('business_date')
-        cursor.execute("SELECT COUNT(*) AS cnt FROM sales_daily_lines WHERE upload_id = %s", (upload_id,))
-        line_count_row = cursor.fetchone() or {}
-        expected_lines = int(line_count_row.get('cnt') or 0)
+        with transaction():
+            cursor.execute("SELECT COUNT(*) AS cnt FROM sales_daily_lines WHERE upload_id = %s", (upload_id,))
+            line_count_row = cursor.fetchone() or {}
+            expected_lines = int(line_count_row.get('cnt') or 0)
 
-        cursor.execute("DELETE FROM sales_daily_lines WHERE upload_id = %s", (upload_id,))
-        deleted_lines = cursor.rowcount
+            cursor.execute("DELETE FROM sales_daily_lines WHERE upload_id = %s", (upload_id,))
+            deleted_lines = cursor.rowcount
 
-        cursor.execute("DELETE FROM sales_uploads WHERE id = %s", (upload_id,))
-        deleted_uploads = cursor.rowcount
+            cursor.execute("DELETE FROM sales_uploads WHERE id = %s", (upload_id,))
+            deleted_uploads = cursor.rowcount
 
-        remaining_uploads_for_day = None
-        remaining_lines_for_day = None
-        additional_lines_removed = 0
+            remaining_uploads_for_day = None
+            remaining_lines_for_day = None
+            additional_lines_removed = 0
 
-        if business_date:
-            # If this was the only upload for that business date, defensively clear any lingering rows
-            cursor.execute("SELECT COUNT(*) AS cnt FROM sales_uploads WHERE business_date = %s", (business_date,))
-            remaining_uploads_for_day = int((cursor.fetchone() or {}).get('cnt') or 0)
-
-            if remaining_uploads_for_day == 0:
-                cursor.execute("DELETE FROM sales_daily_lines WHERE business_date = %s", (business_date,))
-                additional_lines_removed = max(cursor.rowcount, 0)
-                cursor.execute(
-                    "UPDATE business_days SET has_sales = FALSE, updated_at = now() WHERE business_date = %s",
-                    (business_date,)
-                )
+            if business_date:
+                # If this was the only upload for that business date, defensively clear any lingering rows
+                cursor.execute("SELECT COUNT(*) AS cnt FROM sales_uploads WHERE business_date = %s", (business_date,))
+                remaining_uploads_for_day = int((cursor.fetchone() or {}).get('cnt') or 0)
+
+                if remaining_uploads_for_day == 0:
+                    cursor.execute("DELETE FROM sales_daily_lines WHERE business_date = %s", (business_date,))
+                    additional_lines_removed = max(cursor.rowcount, 0)
+                    cursor.execute(
+                        "UPDATE business_days SET has_sales = FALSE, updated_at = now() WHERE business_date = %s",
+                        (business_date,)
+                    )
 
-            cursor.execute("SELECT COUNT(*) AS cnt FROM sales_daily_lines WHERE business_date = %s", (business_date,))
-            remaining_lines_for_day = int((cursor.fetchone() or {}).get('cnt') or 0)
+                cursor.execute("SELECT COUNT(*) AS cnt FROM sales_daily_lines WHERE business_date = %s", (business_date,))
+                remaining_lines_for_day = int((cursor.fetchone() or {}).get('cnt') or 0)
+
+            refresh_sales_item_daily(cursor, [business_date])
 
         return jsonify({
             'status': 'ok',
@@ -566,23 +547,100 @@ def reverse_upload(upload_id):
             pass
 
 
+def _lines_cursor_token(row):
+    key = f"{row['business_date'].isoformat()}|{row['id']}"
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip('=')
+
+
+def _parse_lines_cursor(token):
+    """(business_date, id) from a token made by _lines_cursor_token; ValueError if malformed."""
+    key = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+    day, line_id = key.split('|')
+    return datetime.strptime(day, '%Y-%m-%d').date(), int(line_id)
+
+
+def _stream_lines(sql, params):
+    """Stream the query's rows as NDJSON through a server-side cursor."""
+    conn = get_db_connection()
+
+    def generate():
+        with transaction(readonly=True):
+            # psycopg2 only allows WITH HOLD named cursors on autocommit connections; the
+            # cursor is closed before the transaction commits, so nothing is materialized
+            cursor = conn.cursor(name='sales_lines_stream', cursor_factory=RealDictCursor, withhold=True)
+            cursor.itersize = LINES_STREAM_BATCH
+            try:
+                cursor.execute(sql, params)
+                for row in cursor:
+                    yield json.dumps(row) + '\n'
+            finally:
+                cursor.close()
+
+    # The request's connection (and the transaction) stay open until the last row is sent
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
 @sales_bp.route('/sales/lines', methods=['GET'])
 def get_lines():
-    """Return sales lines for a given business_date or upload_id"""
+    """Return sales lines for a business_date, upload_id and/or start_date..end_date.
+
+    Lines are ordered by (business_date, id), newest first when no filter is
+    given. A page holds up to `limit` lines; when more follow, the X-Next-Cursor
+    header carries the token to pass back as ?cursor= for the next page.
+    ?format=ndjson streams every matching line (from ?cursor= if given) as one
+    JSON object per line instead.
+    """
     business_date = request.args.get('business_date')
-    upload_id = request.args.get('upload_id')
-    limit = int(request.args.get('limit', 1000))
-    offset = int(request.args.get('offset', 0))
+    upload_id = request.args.get('upload_id', type=int)
+    start_date = parse_date_arg(request.args.get('start_date'))
+    end_date = parse_date_arg(request.args.get('end_date'))
+    stream = request.args.get('format') == 'ndjson'
+    limit = request.args.get('limit', type=int) or (None if stream else LINES_PAGE_SIZE)
+    if limit is not None:
+        limit = max(1, limit if stream else min(limit, LINES_PAGE_MAX))
+
+    filters, params = [], []
+    if upload_id:
+        filters.append("upload_id = %s")
+        params.append(upload_id)
+    if business_date:
+        filters.append("business_date = %s")
+        params.append(business_date)
+    if start_date:
+        filters.append("business_date >= %s")
+        params.append(start_date)
+    if end_date:
+        filters.append("business_date <= %s")
+        params.append(end_date)
+    descending = not filters
+    if request.args.get('cursor'):
+        try:
+            after = _parse_lines_cursor(request.args.get('cursor'))
+        except ValueError:
+            return jsonify({'error': 'invalid cursor'}), 400
+        filters.append("(business_date, id) < (%s, %s)" if descending else "(business_date, id) > (%s, %s)")
+        params.extend(after)
+
+    direction = 'DESC' if descending else 'ASC'
+    sql = (
+        "SELECT * FROM sales_daily_lines"
+        f" WHERE business_date IS NOT NULL{''.join(' AND ' + f for f in filters)}"
+        f" ORDER BY business_date {direction}, id {direction}"
+    )
+    if limit is not None:
+        sql += " LIMIT %s"
+        params.append(limit)
+    if stream:
+        return _stream_lines(sql, params)
+
     cursor = get_db_cursor()
     try:
-        if upload_id:
-            cursor.execute("SELECT * FROM sales_daily_lines WHERE upload_id = %s ORDER BY id LIMIT %s OFFSET %s", (upload_id, limit, offset))
-        elif business_date:
-            cursor.execute("SELECT * FROM sales_daily_lines WHERE business_date = %s ORDER BY id LIMIT %s OFFSET %s", (business_date, limit, offset))
-        else:
-            cursor.execute("SELECT * FROM sales_daily_lines ORDER BY id DESC LIMIT %s OFFSET %s", (limit, offset))
+        cursor.execute(sql, params)
         rows = cursor.fetchall()
-        return jsonify(rows)
+        response = jsonify(rows)
+        if len(rows) == limit:
+            response.headers['X-Next-Cursor'] = _lines_cursor_token(rows[-1])
+        return response
     finally:
         try:
             cursor.close()
@@ -633,11 +691,14 @@ def update_sales_line(line_id):
     params = list(updates.values())
     cursor = get_db_cursor()
     try:
-        cursor.execute(
-            f"UPDATE sales_daily_lines SET {set_clause} WHERE id = %s RETURNING *",
-            params + [line_id]
-        )
-        row = cursor.fetchone()
+        with transaction():
+            cursor.execute(
+                f"UPDATE sales_daily_lines SET {set_clause} WHERE id = %s RETURNING *",
+                params + [line_id]
+            )
+            row = cursor.fetchone()
+            if row:
+                refresh_sales_item_daily(cursor, [row.get('business_date')])
         if not row:
             return jsonify({'error': 'not found'}), 404
         return jsonify({'status': 'ok', 'line': row})
@@ -661,12 +722,12 @@ def daily_agg():
             SELECT
                 COALESCE(i.name, s.item_name) AS item_name,
                 s.item_id,
-                SUM(s.item_qty) AS qty_sold,
-                SUM(s.net_sales) AS net_sales,
-                SUM(s.discount_amount) AS discounts,
-                SUM(s.gross_sales) AS gross_sales,
-                SUM(s.tax_amount) AS taxes
-            FROM sales_daily_lines s
+                CASE WHEN SUM(s.qty_lines) > 0 THEN SUM(s.qty) END AS qty_sold,
+                CASE WHEN SUM(s.net_sales_lines) > 0 THEN SUM(s.net_sales) END AS net_sales,
+                CASE WHEN SUM(s.discount_lines) > 0 THEN SUM(s.discounts) END AS discounts,
+                CASE WHEN SUM(s.gross_sales_lines) > 0 THEN SUM(s.gross_sales) END AS gross_sales,
+                CASE WHEN SUM(s.tax_lines) > 0 THEN SUM(s.taxes) END AS taxes
+            FROM sales_item_daily s
             LEFT JOIN items i ON s.item_id = i.item_id
             WHERE s.business_date = %s
             GROUP BY COALESCE(i.name, s.item_name), s.item_id
@@ -714,12 +775,12 @@ def sales_daily_summary():
             """
             SELECT
                 business_date,
-                SUM(COALESCE(item_qty, 0)) AS qty_sold,
-                SUM(COALESCE(net_sales, 0)) AS net_sales,
-                SUM(COALESCE(gross_sales, 0)) AS gross_sales,
-                SUM(COALESCE(discount_amount, 0)) AS discounts,
-                SUM(COALESCE(tax_amount, 0)) AS taxes
-            FROM sales_daily_lines
+                SUM(qty) AS qty_sold,
+                SUM(net_sales) AS net_sales,
+                SUM(gross_sales) AS gross_sales,
+                SUM(discounts) AS discounts,
+                SUM(taxes) AS taxes
+            FROM sales_item_daily
             WHERE business_date BETWEEN %s AND %s
             GROUP BY business_date
             ORDER BY business_date ASC
@@ -827,7 +888,7 @@ def item_daily_sales(item_id):
         where_clause = "item_id = %s"
         params = [item_id]
         if item_name:
-            where_clause = f"({where_clause} OR (item_id IS NULL AND LOWER(TRIM(item_name)) = LOWER(TRIM(%s))))"
+            where_clause = f"({where_clause} OR (item_id IS NULL AND name_key = LOWER(TRIM(%s))))"
             params.append(item_name)
         params.extend([start_date, end_date])
 
@@ -835,16 +896,16 @@ def item_daily_sales(item_id):
             f"""
             WITH sales_by_day AS (
                 SELECT
-                    business_date::date AS business_date,
-                    SUM(COALESCE(item_qty, 0)) AS qty_sold,
-                    SUM(COALESCE(net_sales, 0)) AS net_sales,
-                    SUM(COALESCE(gross_sales, 0)) AS gross_sales,
-                    SUM(COALESCE(discount_amount, 0)) AS discounts,
-                    SUM(COALESCE(tax_amount, 0)) AS taxes
-                FROM sales_daily_lines
+                    business_date,
+                    SUM(qty) AS qty_sold,
+                    SUM(net_sales) AS net_sales,
+                    SUM(gross_sales) AS gross_sales,
+                    SUM(discounts) AS discounts,
+                    SUM(taxes) AS taxes
+                FROM sales_item_daily
                 WHERE {where_clause}
                   AND business_date BETWEEN %s AND %s
-                GROUP BY business_date::date
+                GROUP BY business_date
             )
             SELECT
                 sbd.business_date,
@@ -853,32 +914,15 @@ def item_daily_sales(item_id):
                 sbd.gross_sales,
                 sbd.discounts,
                 sbd.taxes,
-                snap.cost_per_unit AS historical_cost_per_unit
+                ci.cost_per_unit AS historical_cost_per_unit
             FROM sales_by_day sbd
-            LEFT JOIN LATERAL (
-                SELECT snap_choice.cost_per_unit
-                FROM (
-                    SELECT ics.cost_per_unit, ics.created_at, ics.snapshot_id, 0 AS priority
-                    FROM item_cost_snapshots ics
-                    WHERE ics.item_id = %s
-                      AND ics.status = 'ok'
-                      AND ics.created_at < (sbd.business_date::timestamp + INTERVAL '1 day')
-                    UNION ALL
-                    SELECT ics.cost_per_unit, ics.created_at, ics.snapshot_id, 1 AS priority
-                    FROM item_cost_snapshots ics
-                    WHERE ics.item_id = %s
-                      AND ics.status = 'ok'
-                ) snap_choice
-                ORDER BY
-                    snap_choice.priority ASC,
-                    CASE WHEN snap_choice.priority = 0 THEN snap_choice.created_at END DESC NULLS LAST,
-                    CASE WHEN snap_choice.priority = 1 THEN snap_choice.created_at END ASC NULLS LAST,
-                    snap_choice.snapshot_id DESC
-                LIMIT 1
-            ) snap ON TRUE
+            LEFT JOIN item_cost_intervals ci
+                ON ci.item_id = %s
+               AND sbd.business_date >= ci.valid_from
+               AND sbd.business_date < ci.valid_to
             ORDER BY sbd.business_date ASC
             """,
-            tuple(params + [item_id, item_id])
+            tuple(params + [item_id])
         )
         rows = cursor.fetchall() or []
         rows_by_day = {row['business_date']: row for row in rows}
@@ -0,0 +1,54 @@
+"""Shared fixtures.
+
+Tests marked with the db fixture run against the database named by DB_NAME /
+DB_HOST / DB_USER / DB_PASSWORD (with the migrations applied) and are skipped
+when it is not reachable.
+"""
+import os
+
+import psycopg2
+import pytest
+from flask import Flask
+
+from server.utils.db import get_db_cursor, release_request_connection, shared_connection
+
+
+@pytest.fixture(scope='session')
+def database():
+    if not os.environ.get('DB_NAME'):
+        pytest.skip('DB_NAME is not set')
+    try:
+        psycopg2.connect(
+            dbname=os.environ.get('DB_NAME'),
+            user=os.environ.get('DB_USER'),
+            password=os.environ.get('DB_PASSWORD'),
+            host=os.environ.get('DB_HOST')
+        ).close()
+    except psycopg2.OperationalError as e:
+        pytest.skip(f'database unavailable: {e}')
+
+
+@pytest.fixture
+def db(database):
+    """A cursor on a shared connection, like a request or background job gets."""
+    with shared_connection():
+        cursor = get_db_cursor()
+        try:
+            yield cursor
+        finally:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+
+@pytest.fixture
+def client_for(database):
+    """Build a test client for the given blueprints (no auth layer)."""
+    def build(*blueprints):
+        app = Flask(__name__)
+        app.teardown_appcontext(release_request_connection)
+        for bp in blueprints:
+            app.register_blueprint(bp)
+        return app.test_client()
+    return build
@@ -0,0 +1,38 @@
+from server.utils.conversion_helper import convert_to_base, reverse_convert_from_base
+from server.utils.conversion_index import ConversionIndex
+
+
+def _row(ingredient_id, from_unit, to_unit, factor, is_global=False):
+    return {'ingredient_id': ingredient_id, 'from_unit': from_unit, 'to_unit': to_unit, 'factor': factor, 'is_global': is_global}
+
+
+def test_ingredient_inverse_row_beats_global_direct_row():
+    # The ingredient stores lb->oz as 20 (a non-standard "pound"); the global oz->lb row disagrees
+    index = ConversionIndex([
+        _row(None, 'oz', 'lb', 1 / 16.0, is_global=True),
+        _row(7, 'lb', 'oz', 20.0),
+    ])
+    assert index.factor(7, 'oz', 'lb') == 1 / 20.0
+    assert index.factor(7, 'lb', 'oz') == 20.0
+    # Other ingredients still use the global row
+    assert index.factor(8, 'oz', 'lb') == 1 / 16.0
+
+
+def test_fewest_hops_wins_over_scope():
+    index = ConversionIndex([
+        _row(None, 'case', 'oz', 160.0, is_global=True),
+        _row(7, 'case', 'lb', 12.0),
+        _row(7, 'lb', 'oz', 16.0),
+    ])
+    assert index.factor(7, 'case', 'oz') == 160.0
+
+
+def test_base_conversion_is_the_stored_single_hop():
+    index = ConversionIndex([
+        _row(7, 'case', 'lb', 12.0),
+        _row(7, 'lb', 'oz', 16.0),
+    ])
+    # The base unit of a case is lb (its stored row), not oz at the end of the chain
+    assert convert_to_base(7, 'ingredient', 'Case', 2, index=index) == (24.0, 'lb')
+    assert convert_to_base(7, 'ingredient', 'each', 2, index=index) == (2, 'each')
+    assert reverse_convert_from_base(7, 'ingredient', 'lb', 24.0, index=index) == (2.0, 'case')
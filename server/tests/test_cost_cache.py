@@ -0,0 +1,51 @@
+import threading
+
+import pytest
+
+from server.utils import cost_cache
+from server.utils.db import shared_connection
+from server.utils.recipe_graph import RecipeGraph
+
+
+@pytest.fixture
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(cost_cache, '_version', None)
+    monkeypatch.setattr(cost_cache, '_graph', None)
+
+
+def _in_thread(fn, *args):
+    result = {}
+
+    def run():
+        with shared_connection():
+            result['value'] = fn(*args)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread, result
+
+
+def test_cached_lookups_do_not_wait_for_another_threads_load(db, empty_cache, monkeypatch):
+    db.execute("SELECT item_id FROM items ORDER BY item_id LIMIT 2")
+    first, second = [row['item_id'] for row in db.fetchall()]
+    warm = cost_cache.cached_graph(item_ids=[first])
+
+    loading, release = threading.Event(), threading.Event()
+    load = RecipeGraph.load
+
+    def slow_load(*args, **kwargs):
+        loading.set()
+        release.wait(5)
+        return load(*args, **kwargs)
+    monkeypatch.setattr(RecipeGraph, 'load', staticmethod(slow_load))
+
+    slow, slow_result = _in_thread(cost_cache.cached_graph, [second])
+    assert loading.wait(5)
+    fast, fast_result = _in_thread(cost_cache.cached_graph, [first])
+    fast.join(2)
+    assert fast_result.get('value') is warm
+
+    release.set()
+    slow.join(5)
+    graph = slow_result['value']
+    assert graph.covers([first, second])
+    assert cost_cache.cached_graph(item_ids=[first, second]) is graph
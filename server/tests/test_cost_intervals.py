@@ -0,0 +1,65 @@
+import pytest
+
+from server.utils.cost_intervals import rebuild_item_cost_intervals, record_snapshot_costs
+
+ITEM_ID = -4242
+
+
+def _cleanup(cursor):
+    cursor.execute("DELETE FROM item_cost_snapshots WHERE item_id = %s", (ITEM_ID,))
+    cursor.execute("DELETE FROM item_cost_intervals WHERE item_id = %s", (ITEM_ID,))
+
+
+@pytest.fixture
+def item(db):
+    _cleanup(db)
+    yield db
+    _cleanup(db)
+
+
+def _snapshot(cursor, created_at, cost):
+    cursor.execute(
+        """
+        INSERT INTO item_cost_snapshots (item_id, unit, cost_per_unit, status, created_at)
+        VALUES (%s, 'each', %s, 'ok', %s)
+        RETURNING item_id, created_at, created_at::date AS day, cost_per_unit
+        """,
+        (ITEM_ID, cost, created_at)
+    )
+    row = cursor.fetchone()
+    return row['item_id'], row['created_at'], row['day'], row['cost_per_unit']
+
+
+def _ranges(cursor):
+    cursor.execute(
+        "SELECT valid_from, valid_to, cost_per_unit FROM item_cost_intervals WHERE item_id = %s ORDER BY valid_from",
+        (ITEM_ID,)
+    )
+    return [tuple(row.values()) for row in cursor.fetchall()]
+
+
+@pytest.mark.parametrize('snapshots', [
+    [
+        ('2001-03-01 09:00+00', 5),
+        ('2001-03-01 12:00+00', 6),   # same day, new cost
+        ('2001-03-01 18:00+00', 5),   # same day, back to the previous range's cost
+        ('2001-03-03 09:00+00', 7),
+        ('2001-03-03 10:00+00', 7),   # unchanged
+        ('2001-03-05 09:00+00', 8),
+        ('2001-03-05 11:00+00', 7),   # restores the previous range's cost
+        ('2001-03-09 09:00+00', 9),
+    ],
+    [
+        ('2001-03-01 09:00+00', 5),
+        ('2001-03-04 09:00+00', 6),
+        ('2001-03-02 09:00+00', 7),   # a later snapshot is already there: rebuilt
+        ('2001-03-06 09:00+00', 6),
+    ],
+])
+def test_incremental_fold_matches_rebuild(item, snapshots):
+    cursor = item
+    for created_at, cost in snapshots:
+        record_snapshot_costs(cursor, [_snapshot(cursor, created_at, cost)])
+        folded = _ranges(cursor)
+        rebuild_item_cost_intervals(cursor, [ITEM_ID])
+        assert folded == _ranges(cursor)
@@ -0,0 +1,42 @@
+import pytest
+
+from server.utils import cost_jobs
+
+TRIGGER = 'test_heartbeat'
+
+
+def _cleanup(cursor):
+    cursor.execute("DELETE FROM cost_recalculation_runs WHERE trigger_source = %s", (TRIGGER,))
+
+
+@pytest.fixture
+def runs(db, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(cost_jobs.jobs, 'submit', lambda name, fn, run_id: submitted.append(run_id))
+    _cleanup(db)
+    yield db, submitted
+    _cleanup(db)
+
+
+def test_long_run_with_a_recent_heartbeat_keeps_its_claim(runs):
+    cursor, submitted = runs
+    cursor.execute(
+        """
+        INSERT INTO cost_recalculation_runs (trigger_source, status, started_at, heartbeat_at)
+        VALUES (%s, 'running', NOW() - INTERVAL '3 hours', NOW() - INTERVAL '1 minute')
+        RETURNING run_id
+        """,
+        (TRIGGER,)
+    )
+    running = cursor.fetchone()['run_id']
+    assert cost_jobs.start_recalculate_all(TRIGGER) == (running, False)
+
+    # Its worker stops writing chunks: the run goes stale and a new one starts
+    cursor.execute(
+        "UPDATE cost_recalculation_runs SET heartbeat_at = NOW() - (%s * INTERVAL '1 minute') WHERE run_id = %s",
+        (cost_jobs.STALE_RUN_MINUTES + 1, running)
+    )
+    run_id, started = cost_jobs.start_recalculate_all(TRIGGER)
+    cost_jobs._clear_active(run_id)
+    assert started and run_id != running
+    assert submitted == [run_id]
@@ -0,0 +1,44 @@
+from concurrent.futures import Future
+
+import pytest
+
+from server.inventory_routes import inventory_bp
+from server.utils import item_usage
+
+
+@pytest.fixture
+def queued(db, monkeypatch):
+    """Refresh jobs handed to the item-usage pool (not started)."""
+    submitted = []
+
+    def submit(name, fn):
+        submitted.append(Future())
+        return submitted[-1]
+    monkeypatch.setattr(item_usage.jobs, 'submit', submit)
+    monkeypatch.setattr(item_usage, '_refresh_future', None)
+    db.execute("SELECT item_id, ingredient_id FROM item_ingredient_usage ORDER BY item_id, ingredient_id LIMIT 1")
+    row = db.fetchone()
+    if row is None:
+        pytest.skip('item_ingredient_usage is empty')
+    db.execute("INSERT INTO item_ingredient_usage_dirty (item_id) VALUES (%s) ON CONFLICT DO NOTHING", (row['item_id'],))
+    yield db, row, submitted
+    item_usage.refresh_item_usage(db)
+
+
+def test_usage_endpoint_reads_and_queues_the_refresh(queued, client_for):
+    cursor, row, submitted = queued
+    client = client_for(inventory_bp)
+
+    for _ in range(2):
+        response = client.get(f"/api/ingredients/{row['ingredient_id']}/usage")
+        assert response.status_code == 200
+        assert response.get_json()['usage_stale'] is True
+    # The marks are left for the job, and one waiting job covers both reads
+    cursor.execute("SELECT COUNT(*) AS cnt FROM item_ingredient_usage_dirty WHERE item_id = %s", (row['item_id'],))
+    assert cursor.fetchone()['cnt'] == 1
+    assert len(submitted) == 1
+
+    assert item_usage.refresh_item_usage(cursor) >= 1
+    response = client.get(f"/api/ingredients/{row['ingredient_id']}/usage")
+    assert response.get_json()['usage_stale'] is False
+    assert len(submitted) == 1
@@ -0,0 +1,38 @@
+from datetime import date, datetime, timezone
+
+import pytest
+
+from server.utils.reconciliation_cache import store_reconciliation
+
+
+def _cleanup(cursor):
+    cursor.execute("DELETE FROM reconciliation_results WHERE cache_key LIKE 'test|%'")
+
+
+@pytest.fixture
+def results(db):
+    _cleanup(db)
+    yield db
+    _cleanup(db)
+
+
+def _store(cursor, key, fingerprint):
+    store_reconciliation(
+        cursor, key, fingerprint, {'results': [], 'meta': {}}, datetime.now(timezone.utc),
+        date(2001, 1, 1), date(2001, 1, 2), 30, None
+    )
+
+
+def test_store_keeps_one_row_per_key_and_drops_earlier_days(results):
+    cursor = results
+    cursor.execute(
+        """
+        INSERT INTO reconciliation_results (cache_key, lookback_days, fingerprint, payload, computed_at)
+        VALUES ('test|yesterday', 30, 'f', '{}', NOW() - INTERVAL '1 day'),
+               ('test|today', 30, 'f', '{}', NOW())
+        """
+    )
+    _store(cursor, 'test|new', 'f1')
+    _store(cursor, 'test|new', 'f2')
+    cursor.execute("SELECT cache_key, fingerprint FROM reconciliation_results WHERE cache_key LIKE 'test|%' ORDER BY cache_key")
+    assert [tuple(row.values()) for row in cursor.fetchall()] == [('test|new', 'f2'), ('test|today', 'f')]
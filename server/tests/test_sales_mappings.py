@@ -0,0 +1,53 @@
+from datetime import date
+
+import pytest
+
+from server.utils.sales_mappings import apply_sales_mappings
+from server.utils.sales_rollup import refresh_sales_item_daily
+
+BUSINESS_DATE = date(1999, 1, 5)
+NAME = 'test duplicate mapping'
+
+
+def _cleanup(cursor):
+    cursor.execute("DELETE FROM sales_daily_lines WHERE business_date = %s", (BUSINESS_DATE,))
+    cursor.execute("DELETE FROM sales_item_mappings WHERE normalized = %s", (NAME,))
+    refresh_sales_item_daily(cursor, [BUSINESS_DATE])
+
+
+@pytest.fixture
+def duplicate_mappings(db):
+    _cleanup(db)
+    # Two mappings for one name: the older points at item 2, the newer at item 1
+    for item_id in (2, 1):
+        db.execute(
+            "INSERT INTO sales_item_mappings (sales_name, normalized, item_id) VALUES (%s, %s, %s)",
+            (NAME.title(), NAME, item_id)
+        )
+    # Editing the older one moves its row behind the newer one on disk
+    db.execute("UPDATE sales_item_mappings SET updated_at = now() WHERE normalized = %s AND item_id = 2", (NAME,))
+    yield db
+    _cleanup(db)
+
+
+def _add_line(cursor, row_num):
+    cursor.execute(
+        """
+        INSERT INTO sales_daily_lines (row_num, business_date, sales_category, item_name, item_qty, net_sales)
+        VALUES (%s, %s, 'Food', %s, 1, 5.00)
+        """,
+        (row_num, BUSINESS_DATE, f" {NAME.title()} ")
+    )
+
+
+def _mapped_items(cursor):
+    cursor.execute("SELECT item_id FROM sales_daily_lines WHERE business_date = %s ORDER BY row_num", (BUSINESS_DATE,))
+    return [row['item_id'] for row in cursor.fetchall()]
+
+
+def test_oldest_mapping_wins_for_a_shared_name(duplicate_mappings):
+    cursor = duplicate_mappings
+    _add_line(cursor, 1)
+    _add_line(cursor, 2)
+    assert apply_sales_mappings(cursor, business_date=BUSINESS_DATE) == 2
+    assert _mapped_items(cursor) == [2, 2]
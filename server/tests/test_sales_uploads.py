@@ -0,0 +1,149 @@
+import hashlib
+import io
+import os
+from datetime import date
+
+import psycopg2
+import pytest
+from psycopg2.extras import Json
+
+from server import sales_routes
+from server.sales_routes import sales_bp
+from server.utils.db import shared_connection
+from server.utils.sales_ingest import process_upload
+from server.utils.sales_rollup import refresh_sales_item_daily
+
+BUSINESS_DATE = date(1999, 1, 4)
+CSV = (
+    "Item,Sales Category,Qty sold,Net sales,Gross sales,Discount amount\n"
+    "Test Burger,Food,3,30.00,30.00,0\n"
+    "Test Fries,Food,2,8.00,8.00,0\n"
+    "Test Fries,Food,2,8.00,8.00,0\n"
+    "Test Soda,Drinks,5,10.00,10.00,0\n"
+    "Test Water,Drinks,0,0,0,0\n"
+)
+
+
+def _cleanup(cursor):
+    cursor.execute("DELETE FROM sales_daily_lines WHERE business_date = %s", (BUSINESS_DATE,))
+    cursor.execute("DELETE FROM sales_uploads WHERE business_date = %s", (BUSINESS_DATE,))
+    refresh_sales_item_daily(cursor, [BUSINESS_DATE])
+
+
+@pytest.fixture
+def sales_day(db):
+    _cleanup(db)
+    yield db
+    _cleanup(db)
+
+
+def _upload(cursor, raw_text, sha):
+    cursor.execute(
+        """
+        INSERT INTO sales_uploads (source_filename, file_sha256, business_date, row_count, status, raw_text, options)
+        VALUES ('test.csv', %s, %s, 0, 'queued', %s, %s)
+        RETURNING id
+        """,
+        (sha, BUSINESS_DATE, raw_text, Json({}))
+    )
+    upload_id = cursor.fetchone()['id']
+    with shared_connection():
+        process_upload(upload_id)
+    return upload_id
+
+
+def _day_totals(cursor):
+    cursor.execute(
+        "SELECT COUNT(*) AS lines, COALESCE(SUM(item_qty), 0) AS qty FROM sales_daily_lines WHERE business_date = %s",
+        (BUSINESS_DATE,)
+    )
+    lines = cursor.fetchone()
+    cursor.execute(
+        "SELECT COALESCE(SUM(qty), 0) AS qty, COALESCE(SUM(line_count), 0) AS lines FROM sales_item_daily WHERE business_date = %s",
+        (BUSINESS_DATE,)
+    )
+    rollup = cursor.fetchone()
+    return int(lines['lines']), float(lines['qty']), int(rollup['lines']), float(rollup['qty'])
+
+
+def test_reupload_takes_over_lines_and_survives_reversing_the_original(sales_day, client_for):
+    cursor = sales_day
+    first = _upload(cursor, CSV, 'sha-a')
+    cursor.execute("SELECT rows_inserted, rows_skipped FROM sales_uploads WHERE id = %s", (first,))
+    assert cursor.fetchone() == {'rows_inserted': 4, 'rows_skipped': 1}
+    before = _day_totals(cursor)
+    assert before == (4, 12.0, 4, 12.0)
+
+    second = _upload(cursor, CSV, 'sha-b')
+    cursor.execute("SELECT status, row_count, rows_parsed, rows_inserted, rows_skipped FROM sales_uploads WHERE id = %s", (second,))
+    assert cursor.fetchone() == {'status': 'completed', 'row_count': 4, 'rows_parsed': 5, 'rows_inserted': 0, 'rows_skipped': 1}
+    cursor.execute("SELECT COUNT(*) AS cnt FROM sales_daily_lines WHERE upload_id = %s", (second,))
+    assert cursor.fetchone()['cnt'] == 4
+    assert _day_totals(cursor) == before
+
+    response = client_for(sales_bp).post(f'/api/sales/uploads/{first}/reverse')
+    assert response.status_code == 200
+    assert response.get_json()['deleted_lines'] == 0
+
+    cursor.execute("SELECT COUNT(*) AS cnt FROM sales_daily_lines WHERE upload_id = %s", (second,))
+    assert cursor.fetchone()['cnt'] == 4
+    assert _day_totals(cursor) == before
+
+
+def test_upload_held_by_a_live_worker_is_not_claimed_again(sales_day):
+    cursor = sales_day
+    cursor.execute(
+        """
+        INSERT INTO sales_uploads (source_filename, file_sha256, business_date, row_count, status, stage, raw_text, options, started_at)
+        VALUES ('test.csv', 'sha-slow', %s, 0, 'processing', 'ingest', %s, %s, now() - INTERVAL '1 day')
+        RETURNING id
+        """,
+        (BUSINESS_DATE, CSV, Json({}))
+    )
+    upload_id = cursor.fetchone()['id']
+
+    # A slow ingest elsewhere: its connection holds the upload's lock
+    worker = psycopg2.connect(
+        dbname=os.environ.get('DB_NAME'), user=os.environ.get('DB_USER'),
+        password=os.environ.get('DB_PASSWORD'), host=os.environ.get('DB_HOST')
+    )
+    try:
+        with worker.cursor() as worker_cursor:
+            worker_cursor.execute("SELECT pg_advisory_lock(hashtext('sales_upload_job'), %s)", (upload_id,))
+        process_upload(upload_id)
+        with worker.cursor() as worker_cursor:
+            worker_cursor.execute("SELECT pg_advisory_unlock(hashtext('sales_upload_job'), %s)", (upload_id,))
+    finally:
+        worker.close()
+    cursor.execute("SELECT status, rows_inserted FROM sales_uploads WHERE id = %s", (upload_id,))
+    assert cursor.fetchone() == {'status': 'processing', 'rows_inserted': None}
+
+    # Once that worker is gone the stale upload is picked up
+    process_upload(upload_id)
+    cursor.execute("SELECT status, rows_inserted FROM sales_uploads WHERE id = %s", (upload_id,))
+    assert cursor.fetchone() == {'status': 'completed', 'rows_inserted': 4}
+
+
+def test_upload_is_stored_in_chunks_and_dropped_once_processed(sales_day, client_for, monkeypatch):
+    cursor = sales_day
+    queued = []
+    monkeypatch.setattr(sales_routes, 'queue_upload', queued.append)
+    # Small chunks split the multi-byte characters across reads
+    monkeypatch.setattr(sales_routes, 'UPLOAD_READ_CHUNK', 7)
+    raw = CSV.replace('Test Soda', 'Test Café Crème').encode('utf-8')
+
+    response = client_for(sales_bp).post('/api/sales/upload', data={
+        'business_date': BUSINESS_DATE.isoformat(),
+        'file': (io.BytesIO(raw), 'sales.csv')
+    }, content_type='multipart/form-data')
+    assert response.status_code == 202
+    upload_id = response.get_json()['upload_id']
+    assert queued == [upload_id]
+    cursor.execute("SELECT file_sha256, raw_text FROM sales_uploads WHERE id = %s", (upload_id,))
+    assert cursor.fetchone() == {'file_sha256': hashlib.sha256(raw).hexdigest(), 'raw_text': raw.decode('utf-8')}
+
+    process_upload(upload_id)
+    cursor.execute("SELECT status, rows_inserted, raw_text FROM sales_uploads WHERE id = %s", (upload_id,))
+    assert cursor.fetchone() == {'status': 'completed', 'rows_inserted': 4, 'raw_text': None}
+    cursor.execute("SELECT COUNT(*) AS cnt FROM sales_daily_lines WHERE upload_id = %s AND item_name = 'Test Café Crème'", (upload_id,))
+    assert cursor.fetchone()['cnt'] == 1
@@ -1,4 +1,4 @@
-from flask import request, jsonify
+from flask import request, jsonify, g
 from functools import wraps
 import jwt
 import os
@@ -32,6 +32,10 @@ def token_required(f):
                 leeway=10  # 10 seconds of leeway for clock skew
             )
             
+            # auth_before_request already loaded this employee for the request
+            if g.get('auth_employee_id') == data['employee_id'] and getattr(request, 'user', None):
+                return _call_route(f, *args, **kwargs)
+
             cursor = get_db_cursor()
             try:
                 cursor.execute("""
@@ -58,15 +62,19 @@ def token_required(f):
             return jsonify({'error': 'Invalid authentication'}), 401
 
         # Call the actual route function outside the auth try-catch block
-        try:
-            return f(*args, **kwargs)
-        except Exception as e:
-            print(f"Route error: {str(e)}")
-            return jsonify({'error': str(e)}), 500
+        return _call_route(f, *args, **kwargs)
 
     return decorated
 
 
+def _call_route(f, *args, **kwargs):
+    try:
+        return f(*args, **kwargs)
+    except Exception as e:
+        print(f"Route error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
 def roles_required(*allowed_roles):
     """
     Decorator to require the authenticated user to have one of the allowed roles.
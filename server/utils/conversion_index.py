@@ -0,0 +1,158 @@
+"""Transitive unit conversion lookups.
+
+ConversionIndex answers "how many to_unit in one from_unit" for any ingredient
+from the whole ingredient_conversions table, following inverses (oz->lb from a
+lb->oz row) and chains (case->lb->oz) as well as direct rows.
+
+Precedence is the same everywhere: the path with the fewest hops wins, and at
+equal length per-ingredient rows beat global rows and stored directions beat
+inverses. Each (scope, from_unit) closure is computed once on first use, so
+repeated lookups are dictionary hits. cost_cache.conversion_index() keeps one
+index per cost inputs version.
+"""
+from collections import deque
+
+from .db import get_db_cursor
+
+
+def _norm(unit):
+    return (unit or "").strip().lower()
+
+
+class ConversionIndex:
+    def __init__(self, rows):
+        # scope (None for global, else ingredient_id) -> unit -> [(to_unit, factor)] in
+        # precedence order; _edges() takes the ingredient's own edges (direct, then
+        # inverse) before global ones.
+        direct = {}
+        inverse = {}
+        # scope -> normalized from_unit -> first stored (to_unit as written, factor)
+        self._direct_out = {}
+        self._direct_in = {}
+        self._ingredient_ids = set()
+        self._linked = {}
+        for row in rows:
+            try:
+                factor = float(row.get("factor"))
+            except (TypeError, ValueError):
+                continue
+            from_unit, to_unit = _norm(row.get("from_unit")), _norm(row.get("to_unit"))
+            if not factor or not from_unit or not to_unit or from_unit == to_unit:
+                continue
+            # A row applies to its own ingredient and, when global, to every ingredient
+            scopes = []
+            if row.get("ingredient_id") is not None:
+                scopes.append(row.get("ingredient_id"))
+                self._ingredient_ids.add(row.get("ingredient_id"))
+            if row.get("is_global") is True:
+                scopes.append(None)
+            if not scopes:
+                continue
+            for scope in scopes:
+                direct.setdefault(scope, {}).setdefault(from_unit, []).append((to_unit, factor))
+                inverse.setdefault(scope, {}).setdefault(to_unit, []).append((from_unit, 1.0 / factor))
+                self._direct_out.setdefault(scope, {}).setdefault(from_unit, (row.get("to_unit"), factor))
+                self._direct_in.setdefault(scope, {}).setdefault(to_unit, (row.get("from_unit"), factor))
+            self._linked.setdefault(from_unit, set()).add(to_unit)
+            self._linked.setdefault(to_unit, set()).add(from_unit)
+        self._direct = direct
+        self._inverse = inverse
+        self._closures = {}
+
+    @classmethod
+    def load(cls):
+        cursor = get_db_cursor()
+        try:
+            cursor.execute("""
+                SELECT ingredient_id, from_unit, to_unit, factor, is_global
+                FROM ingredient_conversions
+                ORDER BY id
+            """)
+            return cls(cursor.fetchall())
+        finally:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+    def _edges(self, scope, unit):
+        edges = []
+        scopes = (None,) if scope is None else (scope, None)
+        for s in scopes:
+            for table in (self._direct, self._inverse):
+                edges.extend(table.get(s, {}).get(unit, ()))
+        return edges
+
+    def _closure(self, scope, from_unit):
+        key = (scope, from_unit)
+        closure = self._closures.get(key)
+        if closure is None:
+            closure = {from_unit: 1.0}
+            queue = deque([from_unit])
+            while queue:
+                unit = queue.popleft()
+                for to_unit, factor in self._edges(scope, unit):
+                    if to_unit not in closure:
+                        closure[to_unit] = closure[unit] * factor
+                        queue.append(to_unit)
+            self._closures[key] = closure
+        return closure
+
+    def factor(self, ingredient_id, from_unit, to_unit):
+        """Multiplier taking a quantity in from_unit to to_unit, or None if unreachable.
+
+        ingredient_id None uses global conversions only.
+        """
+        from_unit, to_unit = _norm(from_unit), _norm(to_unit)
+        if not from_unit or not to_unit:
+            return None
+        scope = ingredient_id if ingredient_id in self._ingredient_ids else None
+        return self._closure(scope, from_unit).get(to_unit)
+
+    def convert(self, ingredient_id, quantity, from_unit, to_unit):
+        """quantity expressed in to_unit, or None if there is no conversion path."""
+        factor = self.factor(ingredient_id, from_unit, to_unit)
+        if factor is None:
+            return None
+        return float(quantity) * factor
+
+    def base_conversion(self, ingredient_id, from_unit):
+        """(to_unit, factor) of the stored row converting out of from_unit, if any."""
+        return self._stored(self._direct_out, ingredient_id, from_unit)
+
+    def to_base(self, ingredient_id, quantity, from_unit):
+        """(quantity, unit) converted by the stored row out of from_unit.
+
+        Returned unchanged when there is no such row or quantity isn't numeric.
+        """
+        conversion = self.base_conversion(ingredient_id, from_unit)
+        if not conversion:
+            return quantity, from_unit
+        to_unit, factor = conversion
+        try:
+            return float(quantity) * factor, to_unit
+        except (TypeError, ValueError):
+            return quantity, from_unit
+
+    def reverse_base_conversion(self, ingredient_id, to_unit):
+        """(from_unit, factor) of the stored row converting into to_unit, if any."""
+        return self._stored(self._direct_in, ingredient_id, to_unit)
+
+    def _stored(self, table, ingredient_id, unit):
+        unit = _norm(unit)
+        if ingredient_id is not None and ingredient_id in self._ingredient_ids:
+            found = table.get(ingredient_id, {}).get(unit)
+            if found:
+                return found
+        return table.get(None, {}).get(unit)
+
+    def linked_units(self, *units):
+        """Every unit connected to any of units by some conversion row (any scope)."""
+        found = {_norm(u) for u in units if _norm(u)}
+        frontier = list(found)
+        while frontier:
+            for other in self._linked.get(frontier.pop(), ()):
+                if other not in found:
+                    found.add(other)
+                    frontier.append(other)
+        return found
@@ -0,0 +1,133 @@
+"""Process-wide cost cache shared by the cost resolver and margin endpoints.
+
+Resolved costs are memoized per (id, normalized unit) inside a RecipeGraph that
+grows as items are requested. Every lookup first reads the cost_inputs_version
+counter, which database triggers bump whenever price_quotes,
+ingredient_conversions, recipes or item yields change (see
+migrations/20250207_cost_inputs_version.sql). A change made through any App
+Engine instance, or by hand in SQL, therefore invalidates every instance's
+cache on its next lookup. Without the version table nothing is cached.
+
+The unit ConversionIndex is cached the same way for callers that only convert
+quantities (inventory, receiving), and the whole-menu unit costs of the margin
+dashboard are kept with the full graph they were rolled up from.
+"""
+import logging
+import threading
+
+from .conversion_index import ConversionIndex
+from .db import get_db_cursor
+from .recipe_graph import RecipeGraph
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_version = None
+_graph = None
+_index_version = None
+_index = None
+_menu_costs_graph = None
+_menu_costs = None
+
+
+def cost_inputs_version():
+    """Current cost inputs version, or None if the version table is unavailable."""
+    cursor = get_db_cursor()
+    try:
+        cursor.execute("SELECT version FROM cost_inputs_version WHERE id = 1")
+        row = cursor.fetchone()
+        return row.get("version") if row else None
+    except Exception as e:
+        logger.debug("cost_inputs_version unavailable: %s", e)
+        return None
+    finally:
+        try:
+            cursor.close()
+        except Exception:
+            pass
+
+
+def _covers(graph, item_ids, ingredient_ids, full):
+    if full:
+        return graph.loaded_item_ids is None
+    return graph.covers(item_ids, ingredient_ids)
+
+
+def cached_graph(item_ids=(), ingredient_ids=(), full=False):
+    """Return a RecipeGraph that covers item_ids and ingredient_ids.
+
+    The graph (and everything already resolved on it) is reused until the cost
+    inputs version changes; missing items are loaded and merged in. The version
+    is read before any data so a concurrent change can only make the cache
+    newer than its version, never older.
+
+    Loading runs outside the lock, so lookups the cache already covers never
+    wait on another thread's queries; the result is swapped in afterwards.
+    """
+    global _version, _graph
+    item_ids = {i for i in item_ids if i is not None}
+    ingredient_ids = {i for i in ingredient_ids if i is not None}
+    version = cost_inputs_version()
+    if version is None:
+        return RecipeGraph.load(None if full else item_ids, ingredient_ids)
+
+    with _lock:
+        cached = _graph if _version == version else None
+    if cached is not None and _covers(cached, item_ids, ingredient_ids, full):
+        return cached
+
+    if cached is None:
+        graph = RecipeGraph.load(None if full else item_ids, ingredient_ids)
+    elif full:
+        graph = cached.merged(RecipeGraph.load(None))
+    else:
+        missing_items = item_ids - (cached.loaded_item_ids or set())
+        missing_ingredients = ingredient_ids - (cached.loaded_ingredient_ids or set())
+        graph = cached.merged(RecipeGraph.load(missing_items, missing_ingredients))
+
+    with _lock:
+        if _version == version and _graph is not cached:
+            # Another thread cached this version meanwhile; keep what both loaded
+            graph = _graph.merged(graph)
+        if _version is None or version >= _version:
+            _version, _graph = version, graph
+    return graph
+
+
+def conversion_index():
+    """Return the ConversionIndex for the current cost inputs version."""
+    global _index_version, _index
+    version = cost_inputs_version()
+    if version is None:
+        return ConversionIndex.load()
+
+    with _lock:
+        if _version == version and _graph is not None:
+            index = _graph.conversions
+        elif _index_version == version:
+            index = _index
+        else:
+            index = None
+    if index is None:
+        index = ConversionIndex.load()
+    with _lock:
+        if _index_version is None or version >= _index_version:
+            _index_version, _index = version, index
+    return index
+
+
+def cached_menu_unit_costs(compute):
+    """Return (graph, compute(graph)) for the full cached graph.
+
+    The result is reused for as long as cached_graph() returns the same graph,
+    i.e. until the cost inputs version changes. Callers must not modify it.
+    """
+    global _menu_costs_graph, _menu_costs
+    graph = cached_graph(full=True)
+    with _lock:
+        if _menu_costs_graph is graph:
+            return graph, _menu_costs
+    costs = compute(graph)
+    with _lock:
+        _menu_costs_graph, _menu_costs = graph, costs
+    return graph, costs
@@ -0,0 +1,169 @@
+"""item_cost_intervals: which cost applies to an item on a given business day.
+
+Historical COGS uses, for each sale day, the cost of the item's last ok
+snapshot created on or before that day; days before the first snapshot use
+the earliest one. item_cost_intervals stores that answer as
+[valid_from, valid_to) date ranges per item, with consecutive days of equal
+cost merged. The range before the first snapshot starts at date.min and the
+current range ends at date.max. Readers range-join sales days to it
+instead of searching item_cost_snapshots for every (item, day).
+
+SnapshotWriter.flush() calls record_snapshot_costs() for the ok snapshots it
+has just inserted, in the same transaction. A new snapshot is normally the
+newest for its item, so only the open range and the one before it can change.
+When another transaction has already committed a later snapshot of the item
+(created_at is the transaction start), that item's ranges are rebuilt instead.
+Each item's ranges are guarded by a transaction advisory lock on that item.
+"""
+from datetime import date
+
+import psycopg2.extras
+
+OPEN_START = date.min
+OPEN_END = date.max
+
+
+def rebuild_item_cost_intervals(cursor, item_ids):
+    """Recompute the ranges of item_ids from item_cost_snapshots."""
+    item_ids = sorted({i for i in item_ids if i is not None})
+    if not item_ids:
+        return
+    cursor.execute("DELETE FROM item_cost_intervals WHERE item_id = ANY(%s)", (item_ids,))
+    cursor.execute(
+        """
+        INSERT INTO item_cost_intervals (item_id, valid_from, valid_to, cost_per_unit)
+        WITH by_day AS (
+            -- The last snapshot of a day sets that day's cost
+            SELECT DISTINCT ON (item_id, created_at::date)
+                item_id, created_at::date AS day, cost_per_unit
+            FROM item_cost_snapshots
+            WHERE item_id = ANY(%s) AND status = 'ok' AND created_at IS NOT NULL
+            ORDER BY item_id, created_at::date, created_at DESC, snapshot_id DESC
+        ),
+        earliest AS (
+            SELECT DISTINCT ON (item_id) item_id, %s::date AS day, cost_per_unit
+            FROM item_cost_snapshots
+            WHERE item_id = ANY(%s) AND status = 'ok'
+            ORDER BY item_id, created_at ASC, snapshot_id DESC
+        ),
+        points AS (
+            SELECT item_id, day, cost_per_unit,
+                   LAG(cost_per_unit) OVER (PARTITION BY item_id ORDER BY day) AS prev_cost,
+                   ROW_NUMBER() OVER (PARTITION BY item_id ORDER BY day) AS n
+            FROM (SELECT * FROM earliest UNION ALL SELECT * FROM by_day) p
+        ),
+        changes AS (
+            SELECT item_id, day, cost_per_unit
+            FROM points
+            WHERE n = 1 OR cost_per_unit IS DISTINCT FROM prev_cost
+        )
+        SELECT
+            item_id,
+            day,
+            COALESCE(LEAD(day) OVER (PARTITION BY item_id ORDER BY day), %s::date),
+            cost_per_unit
+        FROM changes
+        """,
+        (item_ids, OPEN_START, item_ids, OPEN_END)
+    )
+
+
+def record_snapshot_costs(cursor, snapshots):
+    """Fold newly written ok snapshots into item_cost_intervals.
+
+    snapshots are (item_id, created_at, day, cost_per_unit) in write order, day
+    being created_at's date.
+    """
+    latest = {}
+    for item_id, created_at, day, cost in snapshots:
+        if item_id is not None and created_at is not None:
+            latest[item_id] = (created_at, day, cost)
+    if not latest:
+        return
+    # Writers of the same item would both read the same open range; locks are
+    # per item and taken in item_id order, so writers of other items never wait
+    cursor.execute(
+        """
+        SELECT pg_advisory_xact_lock(hashtext('item_cost_intervals'), ids.item_id)
+        FROM (SELECT item_id FROM unnest(%s::int[]) AS item_id ORDER BY item_id) ids
+        """,
+        (sorted(latest),)
+    )
+    cursor.execute(
+        """
+        SELECT v.item_id
+        FROM unnest(%s::int[], %s::timestamptz[]) AS v(item_id, created_at)
+        WHERE EXISTS (
+            SELECT 1 FROM item_cost_snapshots s
+            WHERE s.item_id = v.item_id AND s.status = 'ok' AND s.created_at > v.created_at
+        )
+        """,
+        (list(latest), [created_at for created_at, _, _ in latest.values()])
+    )
+    rebuild = [row['item_id'] for row in cursor.fetchall() or []]
+    for item_id in rebuild:
+        del latest[item_id]
+    cursor.execute(
+        """
+        SELECT t.item_id, t.valid_from, t.valid_to, t.cost_per_unit
+        FROM item_cost_intervals t
+        WHERE t.item_id = ANY(%s)
+          AND (
+              t.valid_to = %s
+              OR t.valid_to = (
+                  SELECT o.valid_from FROM item_cost_intervals o
+                  WHERE o.item_id = t.item_id AND o.valid_to = %s
+              )
+          )
+        """,
+        (list(latest), OPEN_END, OPEN_END)
+    )
+    tails = {}
+    for row in cursor.fetchall() or []:
+        tails.setdefault(row['item_id'], []).append(row)
+
+    replaced, ranges = [], []
+    for item_id, (_, day, cost) in latest.items():
+        tail = sorted(tails.get(item_id, []), key=lambda r: r['valid_to'] != OPEN_END)
+        current = tail[0] if tail and tail[0]['valid_to'] == OPEN_END else None
+        previous = tail[1] if len(tail) > 1 else None
+        if current is None:
+            ranges.append((item_id, OPEN_START, OPEN_END, cost))
+            continue
+        if current['cost_per_unit'] == cost:
+            continue
+        opened = current['valid_from']
+        replaced.append((item_id, opened))
+        if opened == day:
+            # A later snapshot the same day; it may restore the previous range's cost
+            if previous is not None and previous['cost_per_unit'] == cost:
+                replaced.append((item_id, previous['valid_from']))
+                ranges.append((item_id, previous['valid_from'], OPEN_END, cost))
+            else:
+                ranges.append((item_id, day, OPEN_END, cost))
+        else:
+            ranges.append((item_id, opened, day, current['cost_per_unit']))
+            ranges.append((item_id, day, OPEN_END, cost))
+
+    if replaced:
+        psycopg2.extras.execute_values(
+            cursor,
+            """
+            DELETE FROM item_cost_intervals AS t
+            USING (VALUES %s) AS v(item_id, valid_from)
+            WHERE t.item_id = v.item_id AND t.valid_from = v.valid_from
+            """,
+            replaced,
+            template="(%s::int, %s::date)",
+            page_size=len(replaced)
+        )
+    if ranges:
+        psycopg2.extras.execute_values(
+            cursor,
+            "INSERT INTO item_cost_intervals (item_id, valid_from, valid_to, cost_per_unit) VALUES %s",
+            ranges,
+            template="(%s::int, %s::date, %s::date, %s::numeric)",
+            page_size=len(ranges)
+        )
+    if rebuild:
+        rebuild_item_cost_intervals(cursor, rebuild)
@@ -0,0 +1,222 @@
+"""Background bulk cost recalculation.
+
+start_recalculate_all() records a cost_recalculation_runs row and returns its
+run_id at once; the recalculation itself runs on a job pool. All items are
+costed up front from the cached recipe graph (one vectorized rollup), then
+written in chunks by COST_JOB_WORKERS writer threads. Every chunk commits its
+snapshots, item costs and the run's items_scanned/updated/failed counters
+together, so GET /api/prices/recalculation_runs/<id> always shows consistent
+progress. Each chunk also refreshes the run's heartbeat_at; a run whose
+heartbeat is STALE_RUN_MINUTES old no longer blocks a new one.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .cost_cache import cached_graph
+from .cost_rollup import rollup_item_costs
+from .cost_snapshots import SnapshotWriter, jsonb
+from .db import get_db_cursor, shared_connection, transaction
+from . import jobs
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 100
+try:
+    WRITER_THREADS = max(1, int(os.environ.get('COST_JOB_WORKERS', 2)))
+except (TypeError, ValueError):
+    WRITER_THREADS = 2
+
+# Runs queued/running without a heartbeat for this long are assumed to belong to a dead worker.
+STALE_RUN_MINUTES = 30
+
+_active_lock = threading.Lock()
+_active_run_id = None
+
+
+def start_recalculate_all(trigger_source='manual_bulk'):
+    """Queue a recalculation of every unarchived item.
+
+    Returns (run_id, started). If a recalculation is already queued or running,
+    its run_id is returned with started=False instead of queueing another.
+    """
+    global _active_run_id
+    with _active_lock:
+        if _active_run_id is not None:
+            return _active_run_id, False
+        with transaction():
+            cursor = get_db_cursor()
+            try:
+                # The check and the insert are one step across workers and instances
+                cursor.execute(
+                    "SELECT pg_advisory_xact_lock(hashtext(%s))",
+                    (f"cost_recalculation_runs:{trigger_source}",)
+                )
+                cursor.execute(
+                    """
+                    SELECT run_id FROM cost_recalculation_runs
+                    WHERE trigger_source = %s
+                      AND status IN ('queued', 'running')
+                      AND COALESCE(heartbeat_at, started_at) > NOW() - (%s * INTERVAL '1 minute')
+                    ORDER BY run_id DESC
+                    LIMIT 1
+                    """,
+                    (trigger_source, STALE_RUN_MINUTES)
+                )
+                row = cursor.fetchone()
+                if row:
+                    return row['run_id'], False
+                cursor.execute(
+                    """
+                    INSERT INTO cost_recalculation_runs (trigger_source, status)
+                    VALUES (%s, %s)
+                    RETURNING run_id
+                    """,
+                    (trigger_source, 'queued')
+                )
+                run_id = cursor.fetchone()['run_id']
+            finally:
+                try:
+                    cursor.close()
+                except Exception:
+                    pass
+        _active_run_id = run_id
+    try:
+        jobs.submit('cost-jobs', _recalculate_all, run_id)
+    except Exception:
+        _clear_active(run_id)
+        _finish_run(run_id, 'failed', {'fatal_error': 'could not queue recalculation'})
+        raise
+    return run_id, True
+
+
+def _clear_active(run_id):
+    global _active_run_id
+    with _active_lock:
+        if _active_run_id == run_id:
+            _active_run_id = None
+
+
+def _execute(sql, params):
+    cursor = get_db_cursor()
+    try:
+        cursor.execute(sql, params)
+    finally:
+        try:
+            cursor.close()
+        except Exception:
+            pass
+
+
+def _finish_run(run_id, status, summary):
+    _execute(
+        """
+        UPDATE cost_recalculation_runs
+        SET completed_at = NOW(), status = %s, summary = %s
+        WHERE run_id = %s
+        """,
+        (status, jsonb(summary), run_id)
+    )
+
+
+def _recalculate_all(run_id):
+    updated, errors = [], []
+    items_total = 0
+    try:
+        cursor = get_db_cursor()
+        try:
+            cursor.execute("SELECT item_id, name, yield_unit FROM items WHERE archived IS NULL OR archived = FALSE ORDER BY name ASC, item_id ASC")
+            items = cursor.fetchall()
+        finally:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        items_total = len(items)
+        _execute(
+            """
+            UPDATE cost_recalculation_runs
+            SET status = 'running', items_scanned = 0, items_updated = 0, items_failed = 0, summary = %s,
+                heartbeat_at = NOW()
+            WHERE run_id = %s
+            """,
+            (jsonb({'items_total': items_total}), run_id)
+        )
+
+        results = _resolve_items(items)
+        chunks = [results[i:i + CHUNK_SIZE] for i in range(0, len(results), CHUNK_SIZE)]
+        with ThreadPoolExecutor(max_workers=WRITER_THREADS, thread_name_prefix='cost-writer') as writers:
+            for chunk_updated, chunk_errors in writers.map(lambda chunk: _write_chunk(run_id, chunk), chunks):
+                updated.extend(chunk_updated)
+                errors.extend(chunk_errors)
+
+        _finish_run(run_id, 'completed_with_errors' if errors else 'completed', {
+            'items_total': items_total,
+            'updated': updated[:25],
+            'errors': errors[:25]
+        })
+        logger.info("Bulk cost recalculation run %s: %s updated, %s failed", run_id, len(updated), len(errors))
+    except Exception as e:
+        logger.exception("Bulk cost recalculation run %s failed", run_id)
+        try:
+            _finish_run(run_id, 'failed', {
+                'items_total': items_total,
+                'updated': updated[:25],
+                'errors': errors[:25],
+                'fatal_error': str(e)
+            })
+        except Exception:
+            logger.exception("Could not mark cost recalculation run %s as failed", run_id)
+    finally:
+        _clear_active(run_id)
+
+
+def _resolve_items(items):
+    """Cost every item; returns (item_id, name, unit, result) in items order."""
+    graph = cached_graph(full=True)
+    try:
+        rolled = rollup_item_costs(
+            graph,
+            [(it.get('item_id'), (it.get('yield_unit') or '').strip() or 'each') for it in items]
+        )
+    except Exception:
+        logger.exception("Vectorized cost rollup failed; resolving items one at a time")
+        rolled = {}
+    results = []
+    for it in items:
+        item_id = it.get('item_id')
+        unit = (it.get('yield_unit') or '').strip() or 'each'
+        try:
+            res = rolled.get(item_id) or graph.resolve_item(item_id, unit, 1)
+        except Exception as e:
+            res = {'status': 'error', 'issue': 'exception', 'message': str(e)}
+        results.append((item_id, it.get('name'), unit, res))
+    return results
+
+
+def _write_chunk(run_id, chunk):
+    with shared_connection():
+        with transaction():
+            cursor = get_db_cursor()
+            try:
+                writer = SnapshotWriter(cursor, run_id)
+                writer.extend(chunk)
+                updated, errors = writer.flush()
+                cursor.execute(
+                    """
+                    UPDATE cost_recalculation_runs
+                    SET items_scanned = items_scanned + %s,
+                        items_updated = items_updated + %s,
+                        items_failed = items_failed + %s,
+                        heartbeat_at = NOW()
+                    WHERE run_id = %s
+                    """,
+                    (len(chunk), len(updated), len(errors), run_id)
+                )
+            finally:
+                try:
+                    cursor.close()
+                except Exception:
+                    pass
+    return updated, errors
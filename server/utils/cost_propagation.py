@@ -0,0 +1,183 @@
+"""Incremental item cost propagation.
+
+When a price quote, conversion or recipe changes, only the items that
+(transitively) use it can change cost. DependencyIndex maps every ingredient
+and item to the items whose recipes use it; propagate_cost_changes() walks it
+to find exactly those ancestors, re-resolves them from the cached RecipeGraph and
+writes their costs and snapshots through one SnapshotWriter batch.
+"""
+import logging
+
+from .cost_cache import cached_graph, conversion_index
+from .cost_snapshots import SnapshotWriter, jsonb
+from .db import get_db_cursor, transaction
+
+logger = logging.getLogger(__name__)
+
+
+def _norm(unit):
+    return (unit or "").strip().lower()
+
+
+class DependencyIndex:
+    """Reverse recipe index: ingredient/item -> items whose recipes use it."""
+
+    def __init__(self, rows):
+        self.ingredient_parents = {}
+        self.item_parents = {}
+        # normalized recipe unit -> [(parent_item_id, source_type, source_id)]
+        self.unit_lines = {}
+        for row in rows:
+            parent = row.get("item_id")
+            source_type = row.get("source_type")
+            source_id = row.get("source_id")
+            if source_type == "ingredient":
+                self.ingredient_parents.setdefault(source_id, set()).add(parent)
+            elif source_type == "item":
+                self.item_parents.setdefault(source_id, set()).add(parent)
+            self.unit_lines.setdefault(_norm(row.get("unit")), []).append((parent, source_type, source_id))
+
+    @classmethod
+    def load(cls):
+        cursor = get_db_cursor()
+        try:
+            cursor.execute("SELECT item_id, source_type, source_id, unit FROM recipes")
+            return cls(cursor.fetchall())
+        finally:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+    def items_using_conversion(self, from_unit, to_unit, ingredient_id=None, conversions=None):
+        """Items with a recipe line a conversion between from_unit and to_unit can affect.
+
+        Conversions chain, so a per-ingredient row can change any line of that
+        ingredient, and a global row any line (ingredient or sub-recipe yield) in
+        a unit linked to from_unit/to_unit through some conversion.
+        """
+        if ingredient_id is not None:
+            return set(self.ingredient_parents.get(ingredient_id, ()))
+        units = conversions.linked_units(from_unit, to_unit) if conversions is not None else {_norm(from_unit), _norm(to_unit)}
+        parents = set()
+        for unit in units:
+            for parent, source_type, source_id in self.unit_lines.get(unit, ()):
+                parents.add(parent)
+        return parents
+
+    def ancestors(self, ingredient_ids=(), item_ids=()):
+        """item_ids plus every item that transitively uses them or ingredient_ids."""
+        found = set(item_ids)
+        frontier = list(found)
+        for ingredient_id in ingredient_ids:
+            for parent in self.ingredient_parents.get(ingredient_id, ()):
+                if parent not in found:
+                    found.add(parent)
+                    frontier.append(parent)
+        while frontier:
+            item_id = frontier.pop()
+            for parent in self.item_parents.get(item_id, ()):
+                if parent not in found:
+                    found.add(parent)
+                    frontier.append(parent)
+        return found
+
+
+def propagate_cost_changes(trigger_source, ingredient_ids=(), item_ids=(), conversions=()):
+    """Recompute and store items.cost for every item affected by a change.
+
+    conversions is an iterable of (ingredient_id or None for global, from_unit, to_unit).
+    Returns the run summary from write_cost_results, or None when nothing depends
+    on the change.
+    """
+    ingredient_ids = {int(i) for i in ingredient_ids if i is not None}
+    item_ids = {int(i) for i in item_ids if i is not None}
+
+    index = DependencyIndex.load()
+    conversions = list(conversions)
+    if conversions:
+        # The index reflects the change already; linked units before a delete are
+        # the union of what each side is still linked to.
+        linked = conversion_index()
+        for ingredient_id, from_unit, to_unit in conversions:
+            item_ids |= index.items_using_conversion(from_unit, to_unit, ingredient_id, linked)
+    affected = index.ancestors(ingredient_ids=ingredient_ids, item_ids=item_ids)
+    if not affected:
+        return None
+
+    graph = cached_graph(item_ids=affected)
+    results = []
+    for item_id in sorted(affected):
+        item = graph.items.get(item_id)
+        if not item or item.get("archived"):
+            continue
+        unit = (item.get("yield_unit") or "").strip() or "each"
+        try:
+            res = graph.resolve_item(item_id, unit, 1)
+        except Exception as e:
+            res = {"status": "error", "issue": "exception", "message": str(e)}
+        results.append((item_id, item.get("name"), unit, res))
+
+    return write_cost_results(trigger_source, results, trigger={
+        "ingredient_ids": sorted(ingredient_ids),
+        "item_ids": sorted(item_ids)
+    })
+
+
+def write_cost_results(trigger_source, results, trigger=None):
+    """Record a recalculation run, its snapshots and the new item costs in one transaction.
+
+    results is a list of (item_id, name, unit, resolve result).
+    """
+    if not results:
+        return None
+
+    with transaction():
+        cursor = get_db_cursor()
+        try:
+            cursor.execute(
+                """
+                INSERT INTO cost_recalculation_runs (trigger_source, status)
+                VALUES (%s, %s)
+                RETURNING run_id
+                """,
+                (trigger_source, 'running')
+            )
+            run_id = cursor.fetchone()["run_id"]
+            writer = SnapshotWriter(cursor, run_id)
+            writer.extend(results)
+            writer.flush()
+            updated, errors = writer.updated, writer.errors
+            cursor.execute(
+                """
+                UPDATE cost_recalculation_runs
+                SET completed_at = NOW(),
+                    status = %s,
+                    items_scanned = %s,
+                    items_updated = %s,
+                    items_failed = %s,
+                    summary = %s
+                WHERE run_id = %s
+                """,
+                (
+                    'completed_with_errors' if errors else 'completed',
+                    len(results),
+                    len(updated),
+                    len(errors),
+                    jsonb({"updated": updated[:25], "errors": errors[:25], "trigger": trigger}),
+                    run_id
+                )
+            )
+        finally:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+    logger.info("Cost propagation (%s) run %s: %s updated, %s failed", trigger_source, run_id, len(updated), len(errors))
+    return {
+        "run_id": run_id,
+        "items_scanned": len(results),
+        "items_updated": len(updated),
+        "items_failed": len(errors)
+    }
@@ -1,263 +1,65 @@
-from datetime import date
-from .db import get_db_cursor
+"""Item and ingredient cost resolution.
 
-def resolve_ingredient_cost(ingredient_id, recipe_unit, quantity=1):
-    cursor = get_db_cursor()
-    try:
-        # Step 1: Get most recent price quote
-        cursor.execute("""
-            SELECT * FROM price_quotes
-            WHERE ingredient_id = %s
-            ORDER BY date_found DESC
-            LIMIT 1
-        """, (ingredient_id,))
-        quote = cursor.fetchone()
-        if not quote:
-            return {
-                "status": "error",
-                "issue": "missing_price",
-                "message": "No price quote found for this ingredient",
-                "ingredient_id": ingredient_id
-            }
-
-        quote_unit = (quote.get("size_unit") or "").strip().lower()
-        quote_qty = quote.get("size_qty")
-        quote_price = quote.get("price")
-
-        # Validate quote fields before doing any arithmetic
-        try:
-            quote_qty_val = float(quote_qty)
-            quote_price_val = float(quote_price)
-        except Exception:
-            return {
-                "status": "error",
-                "issue": "invalid_quote_format",
-                "message": "Missing or invalid size_qty or price fields",
-                "ingredient_id": ingredient_id
-            }
+Costs are resolved on the shared, version-checked RecipeGraph from cost_cache,
+so repeated lookups of the same item or ingredient in a unit are cache hits
+until a quote, conversion, recipe or yield changes.
+"""
+from .cost_cache import cached_graph
 
-        if quote_qty_val == 0:
-            return {
-                "status": "error",
-                "issue": "invalid_quote_quantity",
-                "message": "Quote size_qty is zero",
-                "ingredient_id": ingredient_id
-            }
 
-        price_per_unit = quote_price_val / quote_qty_val
+def resolve_ingredient_cost(ingredient_id, recipe_unit, quantity=1):
+    """Cost `quantity` of an ingredient in recipe_unit from its latest price quote.
 
-        if not quote_unit:
-            return {
-                "status": "error",
-                "issue": "invalid_quote_format",
-                "message": "Missing or invalid size_unit field",
-                "ingredient_id": ingredient_id
-            }
+    Returns {"status": "ok", "cost_per_unit", "total_cost", ...} or an error dict
+    with an issue code (missing_price, invalid_quote_format, invalid_quote_quantity,
+    missing_conversion, invalid_conversion_factor).
+    """
+    graph = cached_graph(ingredient_ids=[ingredient_id])
+    return graph.resolve_ingredient(ingredient_id, recipe_unit, quantity)
 
-        # Step 2: Handle conversions
-        recipe_unit_norm = (recipe_unit or "").strip().lower()
-        if quote_unit != recipe_unit_norm:
-            cursor.execute("""
-                SELECT factor FROM ingredient_conversions
-                WHERE (ingredient_id = %s OR is_global = TRUE)
-                AND from_unit = %s AND to_unit = %s
-                ORDER BY ingredient_id NULLS LAST, from_unit, to_unit
-                LIMIT 1
-            """, (ingredient_id, quote_unit, recipe_unit_norm))
-            conversion = cursor.fetchone()
-            if not conversion:
-                return {
-                    "status": "error",
-                    "issue": "missing_conversion",
-                    "message": f"Missing conversion from {quote_unit} to {recipe_unit_norm}",
-                    "missing": {
-                        "ingredient_id": ingredient_id,
-                        "from_unit": quote_unit,
-                        "to_unit": recipe_unit_norm
-                    }
-                }
-            try:
-                conversion_factor = float(conversion.get("factor"))
-            except Exception:
-                return {
-                    "status": "error",
-                    "issue": "invalid_conversion_factor",
-                    "message": "Conversion factor is invalid",
-                    "conversion": conversion
-                }
-            # Apply conversion factor for price rates:
-            # factor is (to_unit per 1 from_unit). Since price_per_unit is per from_unit,
-            # price per to_unit = price per from_unit / factor.
-            price_per_unit /= conversion_factor
 
-        total_cost = price_per_unit * float(quantity)
+def resolve_item_cost(item_id, recipe_unit, quantity=1, visited=None):
+    """Cost `quantity` of an item in recipe_unit by rolling up its recipe.
+
+    Error results carry an issue code (item_not_found, no_recipe,
+    child_resolution_error with per-component details, circular_dependency,
+    missing_or_invalid_yield, missing_conversion, invalid_conversion_factor,
+    zero_effective_yield). `visited` is kept for callers that track their own
+    recursion; an item already in it is reported as a circular dependency.
+    """
+    if visited and item_id in visited:
         return {
-            "status": "ok",
-            "ingredient_id": ingredient_id,
-            "recipe_unit": recipe_unit,
-            "quantity": quantity,
-            "cost_per_unit": round(price_per_unit, 4),
-            "total_cost": round(total_cost, 4),
-            "quote_date": quote.get("date_found"),
-            "source": quote.get("source")
+            "status": "error",
+            "issue": "circular_dependency",
+            "item_id": item_id
         }
-    finally:
-        try:
-            cursor.close()
-        except Exception:
-            pass
-
-
-def resolve_item_cost(item_id, recipe_unit, quantity=1, visited=None):
-    cursor = get_db_cursor()
-    try:
-        visited = set(visited or [])
-        if item_id in visited:
-            return {
-                "status": "error",
-                "issue": "circular_dependency",
-                "item_id": item_id
-            }
-
-        # Add current item to visited for this branch only
-        visited.add(item_id)
-
-        # Fetch the item details
-        cursor.execute("SELECT * FROM items WHERE item_id = %s", (item_id,))
-        item = cursor.fetchone()
-        if not item:
-            return {
-                "status": "error",
-                "issue": "item_not_found",
-                "item_id": item_id
-            }
-
-        # Validate yield (but allow missing yield for non-prep items by falling back)
-        recipe_unit_norm = (recipe_unit or "").strip().lower()
-        try:
-            raw_yield_qty = item.get("yield_qty")
-            yield_qty = float(raw_yield_qty) if raw_yield_qty is not None else None
-        except Exception:
-            yield_qty = None
-        yield_unit = (item.get("yield_unit") or "").strip().lower() or None
-
-        # Fetch recipe components
-        cursor.execute("SELECT * FROM recipes WHERE item_id = %s", (item_id,))
-        components = cursor.fetchall()
+    graph = cached_graph(item_ids=[item_id])
+    return graph.resolve_item(item_id, recipe_unit, quantity)
 
-        if not components:
-            # No recipe rows to compute cost from
-            return {
-                "status": "error",
-                "issue": "no_recipe",
-                "message": "No recipe components available to resolve item cost",
-                "item_id": item_id
-            }
-
-        total_cost = 0.0
-        issues = []
-
-        for idx, c in enumerate(components):
-            # Provide context for each recipe row so callers can trace failures
-            comp_info = {
-                "recipe_row": c.get("recipe_id") or idx,
-                "source_type": c.get("source_type"),
-                "source_id": c.get("source_id"),
-                "unit": c.get("unit"),
-                "quantity": c.get("quantity")
-            }
-
-            if c.get("source_type") == "ingredient":
-                cost = resolve_ingredient_cost(c.get("source_id"), c.get("unit"), c.get("quantity"))
-            elif c.get("source_type") == "item":
-                # Pass a copy of visited to child to avoid cross-branch pollution
-                cost = resolve_item_cost(c.get("source_id"), c.get("unit"), c.get("quantity"), visited=set(visited))
-            else:
-                issues.append({"component": comp_info, "error": "unknown_source_type"})
-                continue
-
-            # Normalize unexpected returns and attach component context to errors
-            if not isinstance(cost, dict) or cost.get("status") != "ok":
-                issues.append({"component": comp_info, "result": cost})
-                continue
-
-            # Expect child total_cost to be numeric
-            try:
-                child_cost = float(cost.get("total_cost", 0))
-                total_cost += child_cost
-            except Exception:
-                issues.append({"component": comp_info, "error": "invalid_child_cost", "child": cost})
-
-        if issues:
-            return {
-                "status": "error",
-                "issue": "child_resolution_error",
-                "item_id": item_id,
-                "details": issues
-            }
-
-        # If yield info missing, fall back to treating recipe_unit as the yield unit with qty=1
-        if yield_qty is None or not yield_unit:
-            if recipe_unit_norm:
-                yield_qty = 1.0
-                yield_unit = recipe_unit_norm
-            else:
-                return {
-                    "status": "error",
-                    "issue": "missing_or_invalid_yield",
-                    "message": "Item yield_unit/qty missing and no recipe unit supplied",
-                    "item_id": item_id
-                }
-
-        # Unit conversion if needed (look up global conversions)
-        if yield_unit != recipe_unit_norm:
-            cursor.execute("""
-                SELECT factor FROM ingredient_conversions
-                WHERE is_global = TRUE AND from_unit = %s AND to_unit = %s
-                LIMIT 1
-            """, (yield_unit, recipe_unit_norm))
-            conversion = cursor.fetchone()
-            if not conversion:
-                return {
-                    "status": "error",
-                    "issue": "missing_conversion",
-                    "from": yield_unit,
-                    "to": recipe_unit_norm
-                }
-            try:
-                conversion_factor = float(conversion.get("factor"))
-            except Exception:
-                return {
-                    "status": "error",
-                    "issue": "invalid_conversion_factor",
-                    "message": "Conversion factor is invalid",
-                    "conversion": conversion
-                }
-        else:
-            conversion_factor = 1.0
-
-        effective_yield = yield_qty * conversion_factor
-        if effective_yield == 0:
-            return {
-                "status": "error",
-                "issue": "zero_effective_yield",
-                "message": "Effective yield is zero after conversion",
-                "item_id": item_id
-            }
-
-        cost_per_unit = total_cost / effective_yield
-        final_cost = cost_per_unit * float(quantity)
 
+def summarize_cost_result(result):
+    if isinstance(result, dict) and result.get('status') == 'ok':
         return {
-            "status": "ok",
-            "item_id": item_id,
-            "recipe_unit": recipe_unit,
-            "quantity": quantity,
-            "cost_per_unit": round(cost_per_unit, 4),
-            "total_cost": round(final_cost, 4)
+            'status': 'ok',
+            'issue_code': None,
+            'message': None,
+            'details': None,
+            'cost_per_unit': float(result.get('cost_per_unit')) if result.get('cost_per_unit') is not None else None
         }
-    finally:
-        try:
-            cursor.close()
-        except Exception:
-            pass
+
+    issue_code = None
+    message = None
+    details = result
+    if isinstance(result, dict):
+        issue_code = result.get('issue') or result.get('status') or 'error'
+        message = result.get('message')
+    else:
+        issue_code = 'exception'
+        message = str(result)
+    return {
+        'status': 'error',
+        'issue_code': issue_code,
+        'message': message,
+        'details': details,
+        'cost_per_unit': None
+    }
@@ -0,0 +1,139 @@
+"""Vectorized whole-menu cost rollup over a RecipeGraph.
+
+The recipe DAG is flattened into edge arrays (parent item, child item, and a
+coefficient with the child's yield and unit conversion folded in). Ingredient
+lines become constant per-edge costs. Item batch costs are then propagated
+bottom-up one topological level at a time with NumPy, so the work per level is
+a handful of array operations regardless of catalog size.
+
+Arithmetic follows resolve_item_cost step for step (per-line rounding to four
+places, lines summed in recipe order) so costs agree with the recursive
+resolver. Items that can't be costed - missing prices or conversions, bad
+yields, cycles - are masked out; callers resolve those through
+RecipeGraph.resolve_item to get the usual issue code and details.
+"""
+import numpy as np
+
+
+def rollup_item_costs(graph, requests):
+    """Cost every (item_id, recipe_unit) in requests at once.
+
+    Returns {item_id: result} with the same "ok" result resolve_item_cost
+    builds for quantity 1. Items that could not be costed are left out.
+    """
+    item_ids = list(graph.items)
+    index = {item_id: n for n, item_id in enumerate(item_ids)}
+    n_items = len(item_ids)
+
+    parents, children, coef_yield, coef_qty, const, static_ok = [], [], [], [], [], []
+    has_recipe = np.zeros(n_items, dtype=bool)
+    for item_id, rows in graph.recipes.items():
+        p = index.get(item_id)
+        if p is None:
+            continue
+        has_recipe[p] = bool(rows)
+        for c in rows:
+            source_type = c.get("source_type")
+            source_id = c.get("source_id")
+            child, eff, cost, ok = -1, 1.0, 0.0, False
+            try:
+                qty = float(c.get("quantity"))
+            except Exception:
+                qty = None
+            if qty is not None and source_type == "ingredient":
+                try:
+                    price_per_unit = graph.ingredient_unit_cost(source_id, c.get("unit"))
+                except Exception:
+                    price_per_unit = None
+                if price_per_unit is not None:
+                    cost = round(price_per_unit * qty, 4)
+                    ok = True
+            elif qty is not None and source_type == "item" and source_id in index:
+                child = index[source_id]
+                child_eff = graph.effective_yield(source_id, c.get("unit"))
+                if child_eff is not None:
+                    eff = child_eff
+                    ok = True
+            parents.append(p)
+            children.append(child)
+            coef_yield.append(eff)
+            coef_qty.append(qty if qty is not None else 0.0)
+            const.append(cost)
+            static_ok.append(ok)
+
+    parents = np.asarray(parents, dtype=np.int64)
+    children = np.asarray(children, dtype=np.int64)
+    coef_yield = np.asarray(coef_yield, dtype=np.float64)
+    coef_qty = np.asarray(coef_qty, dtype=np.float64)
+    const = np.asarray(const, dtype=np.float64)
+    static_ok = np.asarray(static_ok, dtype=bool)
+
+    level = _topological_levels(n_items, parents, children)
+
+    total = np.zeros(n_items, dtype=np.float64)
+    valid = np.zeros(n_items, dtype=bool)
+    edge_level = level[parents] if len(parents) else np.zeros(0, dtype=np.int64)
+    # Stable sort keeps each item's lines in recipe order so sums match the resolver
+    order = np.argsort(edge_level, kind="stable")
+    bounds = np.searchsorted(edge_level[order], np.arange(level.max() + 2 if n_items else 1))
+    for lvl in range(len(bounds) - 1):
+        nodes = np.flatnonzero(level == lvl)
+        e = order[bounds[lvl]:bounds[lvl + 1]]
+        p, ch = parents[e], children[e]
+        is_item = ch >= 0
+        ok = static_ok[e].copy()
+        ok[is_item] &= valid[ch[is_item]]
+        contrib = const[e].copy()
+        raw = total[ch[is_item]] / coef_yield[e][is_item] * coef_qty[e][is_item]
+        # np.round scales by 10**4 and is off on half-way values; Python's round
+        # is correctly rounded, which is what resolve_item_cost uses.
+        contrib[is_item] = [round(v, 4) for v in raw.tolist()]
+        np.add.at(total, p, np.where(ok, contrib, 0.0))
+        bad = np.bincount(p[~ok], minlength=n_items)
+        valid[nodes] = has_recipe[nodes] & (bad[nodes] == 0)
+
+    results = {}
+    for item_id, recipe_unit in requests:
+        i = index.get(item_id)
+        if i is None or not valid[i]:
+            continue
+        eff = graph.effective_yield(item_id, recipe_unit)
+        if eff is None:
+            continue
+        cost_per_unit = float(total[i]) / eff
+        results[item_id] = {
+            "status": "ok",
+            "item_id": item_id,
+            "recipe_unit": recipe_unit,
+            "quantity": 1,
+            "cost_per_unit": round(cost_per_unit, 4),
+            "total_cost": round(cost_per_unit * 1.0, 4)
+        }
+    return results
+
+
+def _topological_levels(n_items, parents, children):
+    """Level 0 items use only ingredients; others sit one above their deepest sub-recipe.
+
+    Items on or above a cycle never become ready and get level -1.
+    """
+    level = np.full(n_items, -1, dtype=np.int64)
+    is_item = children >= 0
+    item_parents, item_children = parents[is_item], children[is_item]
+    pending = np.bincount(item_parents, minlength=n_items)
+    order = np.argsort(item_children, kind="stable")
+    sorted_children = item_children[order]
+    sorted_parents = item_parents[order]
+
+    ready = np.flatnonzero(pending == 0)
+    depth = 0
+    while len(ready):
+        level[ready] = depth
+        lo = np.searchsorted(sorted_children, ready, side="left")
+        hi = np.searchsorted(sorted_children, ready, side="right")
+        users = np.concatenate([sorted_parents[a:b] for a, b in zip(lo, hi)])
+        np.subtract.at(pending, users, 1)
+        touched = np.unique(users)
+        ready = touched[(pending[touched] == 0) & (level[touched] == -1)]
+        depth += 1
+    return level
@@ -0,0 +1,145 @@
+"""Batched writes of item cost snapshots and item costs.
+
+SnapshotWriter buffers resolve results during a recalculation and flushes them
+with one multi-row INSERT into item_cost_snapshots plus one
+UPDATE items ... FROM (VALUES ...) for the costs that resolved, and folds the
+new costs into item_cost_intervals. It writes on the
+cursor it is given, so the caller's transaction() decides what commits
+together. Bulk runs, incremental propagation and single-item recalculation all
+go through it.
+"""
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+import psycopg2.extras
+
+from .cost_intervals import record_snapshot_costs
+from .cost_resolver import summarize_cost_result
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def jsonb(value):
+    """Json adapter that also serializes Decimal and date values."""
+    return psycopg2.extras.Json(value, dumps=lambda v: json.dumps(v, default=_json_default))
+
+
+class SnapshotWriter:
+    """Buffer (item, unit, result) snapshots and write them in a few statements.
+
+    add() queues a result and flushes automatically every flush_size rows.
+    Summaries of everything written so far are kept in .updated and .errors;
+    each entry carries its snapshot_id.
+    """
+
+    def __init__(self, cursor, run_id=None, flush_size=500):
+        self.cursor = cursor
+        self.run_id = run_id
+        self.flush_size = flush_size
+        self.updated = []
+        self.errors = []
+        self._pending = []
+
+    def add(self, item_id, name, unit, result):
+        self._pending.append((item_id, name, unit, summarize_cost_result(result)))
+        if len(self._pending) >= self.flush_size:
+            self.flush()
+
+    def extend(self, results):
+        """Queue (item_id, name, unit, result) tuples."""
+        for item_id, name, unit, result in results:
+            self.add(item_id, name, unit, result)
+
+    def flush(self):
+        """Write the buffered snapshots; returns the (updated, errors) rows just written."""
+        pending, self._pending = self._pending, []
+        if not pending:
+            return [], []
+
+        # RETURNING order is unspecified, so each row gets its snapshot_id up front and
+        # the returned rows are matched back by it
+        self.cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence('item_cost_snapshots', 'snapshot_id')) AS snapshot_id "
+            "FROM generate_series(1, %s)",
+            (len(pending),)
+        )
+        snapshot_ids = [row["snapshot_id"] for row in self.cursor.fetchall()]
+
+        returned = psycopg2.extras.execute_values(
+            self.cursor,
+            """
+            INSERT INTO item_cost_snapshots (
+                snapshot_id, run_id, item_id, unit, cost_per_unit, status, issue_code, issue_message, issue_details
+            )
+            VALUES %s
+            RETURNING snapshot_id, created_at, created_at::date AS cost_date, cost_per_unit
+            """,
+            [
+                (
+                    snapshot_id,
+                    self.run_id,
+                    item_id,
+                    unit,
+                    snapshot["cost_per_unit"],
+                    snapshot["status"],
+                    snapshot["issue_code"],
+                    snapshot["message"],
+                    jsonb(snapshot["details"]) if snapshot["details"] is not None else None
+                )
+                for snapshot_id, (item_id, name, unit, snapshot) in zip(snapshot_ids, pending)
+            ],
+            page_size=len(pending),
+            fetch=True
+        )
+
+        written = {row["snapshot_id"]: row for row in returned}
+
+        updated = []
+        errors = []
+        costs = []
+        for snapshot_id, (item_id, name, unit, snapshot) in zip(snapshot_ids, pending):
+            row = written[snapshot_id]
+            if snapshot["status"] == "ok":
+                costs.append((item_id, row["created_at"], row["cost_date"], row["cost_per_unit"]))
+                updated.append({
+                    "item_id": item_id,
+                    "name": name,
+                    "cost_per_unit": snapshot["cost_per_unit"],
+                    "unit": unit,
+                    "snapshot_id": row["snapshot_id"]
+                })
+            else:
+                errors.append({
+                    "item_id": item_id,
+                    "name": name,
+                    "unit": unit,
+                    "issue_code": snapshot["issue_code"],
+                    "message": snapshot["message"],
+                    "snapshot_id": row["snapshot_id"]
+                })
+
+        if updated:
+            record_snapshot_costs(self.cursor, costs)
+            psycopg2.extras.execute_values(
+                self.cursor,
+                """
+                UPDATE items AS i
+                SET cost = v.cost
+                FROM (VALUES %s) AS v(item_id, cost)
+                WHERE i.item_id = v.item_id
+                """,
+                [(row["item_id"], row["cost_per_unit"]) for row in updated],
+                template="(%s::int, %s::numeric)",
+                page_size=len(updated)
+            )
+
+        self.updated.extend(updated)
+        self.errors.extend(errors)
+        return updated, errors
@@ -1,21 +1,519 @@
+import itertools
+import logging
 import os
+import threading
+import time
+import traceback
+import weakref
+from contextlib import contextmanager
+
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
+import psycopg2.pool
+from flask import g, has_app_context
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+# Pool tuning. Each gunicorn worker process gets its own pool; POOL_SIZE connections
+# are kept open between requests and up to POOL_MAX_OVERFLOW more may be opened
+# during bursts (they are closed again when handed back).
+POOL_SIZE = _env_int('DB_POOL_SIZE', 4)
+POOL_MAX_OVERFLOW = _env_int('DB_POOL_MAX_OVERFLOW', 8)
+# Seconds a checkout waits for a free connection before raising PoolTimeoutError.
+POOL_MAX_WAIT = _env_float('DB_POOL_MAX_WAIT', 10.0)
+# Idle connections older than this are pinged with SELECT 1 before being reused.
+POOL_HEALTHCHECK_AFTER = _env_float('DB_POOL_HEALTHCHECK_AFTER', 30.0)
+# Checkouts held longer than this are logged as probable leaks.
+POOL_LEAK_WARN_AFTER = _env_float('DB_POOL_LEAK_WARN_AFTER', 60.0)
+# Record the checkout stack on every lease so leak warnings say who took the connection.
+POOL_TRACK_STACKS = os.environ.get('DB_POOL_TRACK_STACKS', 'false').lower() in ('1', 'true', 'yes')
+
+
+class PoolTimeoutError(psycopg2.pool.PoolError):
+    """Raised when no connection becomes available within the pool's max wait."""
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """psycopg2 connection that returns itself to its pool on close().
+
+    Route handlers call ``cursor.connection.close()`` when they are finished, so
+    close() is the natural point to hand the connection back. Use disconnect()
+    to really close the socket.
+    """
+
+    def close(self):
+        pool = getattr(self, '_pool', None)
+        if pool is None:
+            return self.disconnect()
+        pool._release_from_close(self)
+
+    def disconnect(self):
+        return psycopg2.extensions.connection.close(self)
+
+
+class PooledCursor(psycopg2.extras.RealDictCursor):
+    """RealDictCursor that hands its connection back to the pool when closed."""
+
+    _lease = None
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            lease = self._lease
+            if lease is not None:
+                self._lease = None
+                lease.release()
+
+
+class _Lease:
+    """A single checkout of a pooled connection."""
+
+    __slots__ = ('pool', 'conn', 'token', 'thread_id', 'checked_out_at', 'stack', 'warned',
+                 'pinned', 'tx_depth', '_finalizer')
+
+    def __init__(self, pool, conn, token):
+        self.pool = pool
+        self.conn = conn
+        self.token = token
+        self.thread_id = threading.get_ident()
+        self.checked_out_at = time.monotonic()
+        self.stack = ''.join(traceback.format_stack(limit=12)[:-3]) if pool.track_stacks else None
+        self.warned = False
+        # A pinned lease is shared by a whole request/job and only released by its owner.
+        self.pinned = False
+        self.tx_depth = 0
+        self._finalizer = None
+
+    def bind(self, cursor):
+        """Tie this lease to a cursor so it is reclaimed if the cursor is dropped unclosed."""
+        cursor._lease = self
+        self._finalizer = weakref.finalize(cursor, self.pool._reclaim, self)
+
+    def release(self):
+        self.pool._release(self)
+
+
+class ConnectionPool:
+    """Thread-safe pool of autocommit psycopg2 connections for one worker process.
+
+    Checkouts are leases: a lease is released exactly once, whether by closing
+    its cursor, closing its connection, leaving a context manager, or (as a last
+    resort) garbage collection of an unclosed cursor.
+    """
+
+    def __init__(self, connect_kwargs, size=POOL_SIZE, max_overflow=POOL_MAX_OVERFLOW,
+                 max_wait=POOL_MAX_WAIT, healthcheck_after=POOL_HEALTHCHECK_AFTER,
+                 leak_warn_after=POOL_LEAK_WARN_AFTER, track_stacks=POOL_TRACK_STACKS):
+        self.pid = os.getpid()
+        self.size = max(0, size)
+        self.max_connections = max(1, self.size + max(0, max_overflow))
+        self.max_wait = max_wait
+        self.healthcheck_after = healthcheck_after
+        self.leak_warn_after = leak_warn_after
+        self.track_stacks = track_stacks
+        self._connect_kwargs = dict(connect_kwargs)
+        self._cond = threading.Condition()
+        self._idle = []  # [(conn, idle_since)], most recently used last
+        self._leases = {}  # id(conn) -> _Lease
+        self._opened = 0
+        self._tokens = itertools.count(1)
+        self._stats = {'checkouts': 0, 'connects': 0, 'discarded': 0, 'timeouts': 0, 'leaks_reclaimed': 0}
+
+    # -- checkout -----------------------------------------------------------
+
+    def checkout(self, timeout=None):
+        """Return a _Lease on a healthy connection, waiting up to `timeout` seconds."""
+        wait = self.max_wait if timeout is None else timeout
+        deadline = time.monotonic() + wait
+        while True:
+            conn, idle_since = self._reserve(deadline, wait)
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._opened -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._is_healthy(conn, idle_since):
+                self._discard(conn)
+                continue
+            return self._lease(conn)
+
+    def _reserve(self, deadline, wait):
+        """Pop an idle connection or claim a slot for a new one (conn=None)."""
+        with self._cond:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self._opened < self.max_connections:
+                    self._opened += 1
+                    return None, None
+                self._warn_stale_leases()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeoutError(
+                        f"No database connection available after {wait:.1f}s "
+                        f"({len(self._leases)} checked out, max {self.max_connections})"
+                    )
+                self._cond.wait(remaining)
+
+    def _connect(self):
+        conn = psycopg2.connect(connection_factory=PooledConnection, **self._connect_kwargs)
+        conn.autocommit = True
+        conn._pool = self
+        with self._cond:
+            self._stats['connects'] += 1
+        return conn
+
+    def _is_healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if idle_since is not None and time.monotonic() - idle_since < self.healthcheck_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+                cur.fetchone()
+            return True
+        except Exception as e:
+            logger.info("Discarding pooled DB connection that failed health check: %s", e)
+            return False
+
+    def _lease(self, conn):
+        with self._cond:
+            lease = _Lease(self, conn, next(self._tokens))
+            self._leases[id(conn)] = lease
+            self._stats['checkouts'] += 1
+        return lease
+
+    # -- return -------------------------------------------------------------
+
+    def _release(self, lease):
+        with self._cond:
+            if self._leases.get(id(lease.conn)) is not lease:
+                return  # already released (e.g. cursor.close() followed by connection.close())
+            del self._leases[id(lease.conn)]
+        if lease._finalizer is not None:
+            lease._finalizer.detach()
+        conn = lease.conn
+        if not self._reset(conn):
+            self._discard(conn)
+            return
+        with self._cond:
+            if len(self._idle) < self.size:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+                return
+        self._discard(conn)
+
+    def _release_from_close(self, conn):
+        # Only the thread holding the lease may hand it back via connection.close();
+        # a stale close() from another thread must not release someone else's lease.
+        with self._cond:
+            lease = self._leases.get(id(conn))
+        if lease is not None and not lease.pinned and lease.thread_id == threading.get_ident():
+            lease.release()
+
+    def _reclaim(self, lease):
+        with self._cond:
+            if self._leases.get(id(lease.conn)) is not lease:
+                return
+            self._stats['leaks_reclaimed'] += 1
+        logger.debug("Reclaimed DB connection from a cursor that was never closed%s",
+                     f"; checked out at:\n{lease.stack}" if lease.stack else '')
+        lease.release()
+
+    def _reset(self, conn):
+        """Return the connection to a clean autocommit state; False if it is unusable."""
+        if conn.closed:
+            return False
+        try:
+            if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                if conn.autocommit:
+                    # rollback() is a no-op in autocommit mode, but a caller may
+                    # have issued an explicit BEGIN.
+                    with conn.cursor() as cur:
+                        cur.execute("ROLLBACK")
+                else:
+                    conn.rollback()
+            if not conn.autocommit:
+                conn.autocommit = True
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.disconnect()
+        except Exception:
+            pass
+        with self._cond:
+            self._opened -= 1
+            self._stats['discarded'] += 1
+            self._cond.notify()
+
+    def _warn_stale_leases(self):
+        now = time.monotonic()
+        for lease in list(self._leases.values()):
+            if lease.warned or now - lease.checked_out_at < self.leak_warn_after:
+                continue
+            lease.warned = True
+            logger.warning(
+                "DB connection checked out for %.0fs without being returned (possible leak)%s",
+                now - lease.checked_out_at,
+                f"; checked out at:\n{lease.stack}" if lease.stack else '; set DB_POOL_TRACK_STACKS=true to see where'
+            )
+
+    # -- helpers ------------------------------------------------------------
+
+    @contextmanager
+    def connection(self, timeout=None):
+        lease = self.checkout(timeout)
+        try:
+            yield lease.conn
+        finally:
+            lease.release()
+
+    @contextmanager
+    def cursor(self, cursor_factory=psycopg2.extras.RealDictCursor, timeout=None):
+        with self.connection(timeout) as conn:
+            cur = conn.cursor(cursor_factory=cursor_factory)
+            try:
+                yield cur
+            finally:
+                cur.close()
+
+    def stats(self):
+        with self._cond:
+            self._warn_stale_leases()
+            return dict(
+                self._stats,
+                open=self._opened,
+                idle=len(self._idle),
+                checked_out=len(self._leases),
+                max_connections=self.max_connections
+            )
+
+    def closeall(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+# Pools inherited from a parent process across fork(). Their sockets belong to the
+# parent, so they are kept referenced and never closed from the child.
+_inherited_pools = []
+
+
+def get_pool():
+    """Return this process's connection pool, creating it on first use (or after fork)."""
+    global _pool
+    pool = _pool
+    if pool is not None and pool.pid == os.getpid():
+        return pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            if _pool is not None:
+                _inherited_pools.append(_pool)
+            _pool = ConnectionPool({
+                'dbname': os.environ.get("DB_NAME"),
+                'user': os.environ.get("DB_USER"),
+                'password': os.environ.get("DB_PASSWORD"),
+                'host': os.environ.get("DB_HOST")
+            })
+        return _pool
+
+
+class TransactionAbortedError(psycopg2.DatabaseError):
+    """Raised when a statement inside transaction() failed but the error was swallowed."""
+
+
+_local = threading.local()
+
+
+def _scoped_lease(create=True):
+    """Return the lease shared by the current request or job, or None outside one.
+
+    Inside a Flask app context the lease lives on ``g`` and is checked out lazily
+    on first use; release_request_connection() hands it back at teardown.
+    """
+    lease = getattr(_local, 'lease', None)
+    if lease is not None:
+        return lease
+    if not has_app_context():
+        return None
+    lease = g.get('_db_lease')
+    if lease is not None and lease.conn.closed:
+        # Server dropped the connection mid-request; let the pool discard it.
+        g.pop('_db_lease', None)
+        lease.pinned = False
+        lease.release()
+        lease = None
+    if lease is None and create:
+        lease = get_pool().checkout()
+        lease.pinned = True
+        g._db_lease = lease
+    return lease
+
+
+def release_request_connection(exc=None):
+    """Teardown hook: return the request's shared connection to the pool."""
+    lease = g.pop('_db_lease', None)
+    if lease is not None:
+        lease.pinned = False
+        lease.tx_depth = 0
+        lease.release()
+
+
+@contextmanager
+def shared_connection(timeout=None):
+    """Share one pooled connection with every get_db_cursor() call inside the block.
+
+    Requests get this automatically; background work outside a request uses it
+    to keep a whole computation on one connection.
+    """
+    if getattr(_local, 'lease', None) is not None or has_app_context():
+        yield _scoped_lease().conn
+        return
+    lease = get_pool().checkout(timeout)
+    lease.pinned = True
+    _local.lease = lease
+    try:
+        yield lease.conn
+    finally:
+        _local.lease = None
+        lease.pinned = False
+        lease.tx_depth = 0
+        lease.release()
+
+
+def _run(conn, sql):
+    with conn.cursor() as cur:
+        cur.execute(sql)
+
+
+@contextmanager
+def transaction(readonly=False, isolation_level=None):
+    """Run the block as one transaction on the shared connection.
+
+    Every helper that calls get_db_cursor() inside the block joins the same
+    transaction, so a multi-query computation sees one consistent snapshot
+    (use isolation_level='REPEATABLE READ'). Nested transaction() blocks join
+    the outermost one. Shared connections stay in autocommit mode, so legacy
+    ``cursor.connection.commit()`` calls inside the block are no-ops and the
+    block commits once on exit, or rolls back if it raises.
+    """
+    lease = _scoped_lease()
+    if lease is None:
+        with shared_connection():
+            with transaction(readonly=readonly, isolation_level=isolation_level) as conn:
+                yield conn
+        return
+
+    conn = lease.conn
+    if lease.tx_depth:
+        lease.tx_depth += 1
+        try:
+            yield conn
+        finally:
+            lease.tx_depth -= 1
+        return
+
+    begin = "BEGIN"
+    if isolation_level:
+        begin += f" ISOLATION LEVEL {isolation_level}"
+    if readonly:
+        begin += " READ ONLY"
+    _run(conn, begin)
+    lease.tx_depth = 1
+    try:
+        yield conn
+    except BaseException:
+        lease.tx_depth = 0
+        try:
+            _run(conn, "ROLLBACK")
+        except Exception:
+            pass
+        raise
+    lease.tx_depth = 0
+    if conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+        _run(conn, "ROLLBACK")
+        raise TransactionAbortedError("A statement failed inside the transaction; all changes were rolled back")
+    _run(conn, "COMMIT")
+
 
 def get_db_connection():
-    conn = psycopg2.connect(
-        dbname=os.environ.get("DB_NAME"),
-        user=os.environ.get("DB_USER"),
-        password=os.environ.get("DB_PASSWORD"),
-        host=os.environ.get("DB_HOST")
-    )
-    conn.autocommit = True
-    return conn
+    """Return the shared connection when inside a request/job, else a pooled one.
+
+    close() hands a pooled connection back; it is a no-op on the shared one.
+    """
+    lease = _scoped_lease()
+    if lease is not None:
+        return lease.conn
+    return get_pool().checkout().conn
+
 
 def get_db_cursor():
+    """Return a RealDictCursor, on the request's shared connection when there is one.
+
+    Outside a request the cursor gets its own pooled connection, which closing
+    the cursor (or its connection) returns to the pool.
+    """
     try:
-        conn = get_db_connection()
-        return conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        lease = _scoped_lease()
+        if lease is not None:
+            return lease.conn.cursor(cursor_factory=PooledCursor)
+        lease = get_pool().checkout()
+        try:
+            cursor = lease.conn.cursor(cursor_factory=PooledCursor)
+        except Exception:
+            lease.release()
+            raise
+        lease.bind(cursor)
+        return cursor
     except Exception as e:
         print(f"Database connection error: {str(e)}")
         raise
+
+
+@contextmanager
+def db_connection(timeout=None):
+    """Context manager yielding the shared connection, or a pooled one outside a request."""
+    if _scoped_lease(create=False) is not None or has_app_context():
+        yield _scoped_lease().conn
+        return
+    with get_pool().connection(timeout) as conn:
+        yield conn
+
+
+@contextmanager
+def db_cursor(cursor_factory=psycopg2.extras.RealDictCursor, timeout=None):
+    """Context manager yielding a cursor; the connection is shared inside a request."""
+    with db_connection(timeout) as conn:
+        cur = conn.cursor(cursor_factory=cursor_factory)
+        try:
+            yield cur
+        finally:
+            cur.close()
@@ -0,0 +1,102 @@
+"""Compiled CSV header mappings for POS exports.
+
+POS exports name the same column differently across report versions ('Qty sold'
+vs 'Item Qty', 'Net sales' vs 'Net Amount', ...). A HeaderSchema lists, per
+logical field, the accepted header names in order of preference and an optional
+parser. compile() looks at a file's header once and resolves every field to the
+column positions present in that file, so extracting a row is a few index
+lookups instead of a chain of dict.get() calls per field:
+
+    schema = HeaderSchema([
+        ('item_name', ('Item', 'Menu Item')),
+        ('qty', ('Qty sold', 'Item Qty'), parse_numeric),
+    ], required=('item_name',))
+    compiled = schema.compile(header)
+    for row in reader:
+        item_name, qty = compiled.extract(row)
+
+Like the `r.get('A') or r.get('B')` chains it replaces, a field takes the first
+of its columns with a non-empty value in that row (else the last one's value);
+when a header repeats, its last column is used, as csv.DictReader does.
+"""
+
+
+class HeaderSchema:
+    def __init__(self, fields, required=()):
+        """fields: sequence of (name, header aliases) or (name, header aliases, parser)."""
+        self.fields = []
+        for spec in fields:
+            name, aliases = spec[0], tuple(spec[1])
+            parser = spec[2] if len(spec) > 2 else None
+            self.fields.append((name, aliases, parser))
+        self.names = tuple(name for name, _, _ in self.fields)
+        self.required = tuple(required)
+
+    def compile(self, header):
+        return CompiledHeader(self, header)
+
+
+class CompiledHeader:
+    """A HeaderSchema bound to one file's header row."""
+
+    def __init__(self, schema, header):
+        self.schema = schema
+        self.header = list(header or [])
+        positions = {}
+        for index, name in enumerate(self.header):
+            positions[name] = index
+        used = set()
+        self._plan = []
+        self.columns = {}
+        missing = []
+        for name, aliases, parser in schema.fields:
+            found = []
+            for alias in aliases:
+                index = positions.get(alias)
+                if index is not None and index not in found:
+                    found.append(index)
+            used.update(found)
+            self.columns[name] = [self.header[i] for i in found]
+            if not found:
+                missing.append(name)
+            self._plan.append((tuple(found), parser))
+        self.missing = missing
+        self.missing_required = [name for name in schema.required if name in missing]
+        self.unknown = [name for index, name in enumerate(self.header) if index not in used and name]
+
+    def extract(self, row):
+        """Return the schema's fields for one csv.reader row, parsed, as a tuple."""
+        values = []
+        width = len(row)
+        for indices, parser in self._plan:
+            value = None
+            for index in indices:
+                value = row[index] if index < width else None
+                if value:
+                    break
+            if parser is not None:
+                value = parser(value)
+            values.append(value)
+        return tuple(values)
+
+    def extract_dict(self, row):
+        return dict(zip(self.schema.names, self.extract(row)))
+
+    def warnings(self, label='file'):
+        """Journal-style warning entries for missing and unrecognized columns."""
+        found = []
+        if self.missing:
+            found.append({
+                'code': 'warn_missing_columns',
+                'severity': 'warn',
+                'message': f"{label} has no column for: {', '.join(self.missing)}",
+                'fields': self.missing
+            })
+        if self.unknown:
+            found.append({
+                'code': 'info_unknown_columns',
+                'severity': 'info',
+                'message': f"{label} columns not used: {', '.join(self.unknown)}",
+                'columns': self.unknown
+            })
+        return found
@@ -0,0 +1,276 @@
+"""item_ingredient_usage: how much of each ingredient one unit of an item uses.
+
+Every item with a usable recipe has one row per ingredient it uses, directly
+or through sub-recipes: base_qty_per_yield_unit is the quantity in the
+ingredient's base unit (the target of its stored conversion) in one yield_unit
+of the item. Rows carry the item's explosion issues (missing yield conversions,
+sub-recipes that could not be exploded, ...); items whose recipe is missing or
+circular have no rows. Usage for any set of sales is then a join of
+sales_item_daily to this table instead of a walk of the recipe tree.
+
+Triggers on recipes, items and ingredient_conversions mark affected items in
+item_ingredient_usage_dirty (see migrations/20250214_item_ingredient_usage.sql).
+refresh_item_usage() recomputes the marked items and every item that uses them
+from the cached RecipeGraph in one transaction. It runs as a job on the
+item-usage pool (queue_usage_refresh()), queued by the handlers that save
+recipes and conversions and by any read that finds marks left; readers only
+read, and usage_pending() tells them the rows may be stale meanwhile.
+"""
+import threading
+from collections import defaultdict
+
+import psycopg2.extras
+from psycopg2.extras import Json
+
+from .cost_cache import cached_graph
+from .db import get_db_cursor, transaction
+from . import jobs
+
+_refresh_lock = threading.Lock()
+_refresh_future = None
+
+
+class UsageExplosion:
+    """Explodes recipes into per-unit base ingredient quantities, memoized per (item, unit)."""
+
+    def __init__(self, conversions, items, recipes):
+        """conversions is a ConversionIndex; items maps item_id -> items row and
+        recipes item_id -> recipe rows (archived rows are ignored)."""
+        self.conversions = conversions
+        self.items = items
+        self.recipes = {}
+        for item_id, rows in recipes.items():
+            active = [r for r in rows if not r.get('archived')]
+            if active:
+                self.recipes[item_id] = active
+        self._memo = {}
+
+    def usage_per_unit(self, item_id, output_unit, visited=None):
+        """Base-unit quantity of each ingredient in one output_unit of item_id."""
+        key = (item_id, (output_unit or '').strip().lower())
+        if key in self._memo:
+            return self._memo[key]
+
+        visited = visited or set()
+        if item_id in visited:
+            self._memo[key] = {'status': 'error', 'issue': 'circular', 'ingredients': {}}
+            return self._memo[key]
+        visited.add(item_id)
+
+        item = self.items.get(item_id)
+        comps = self.recipes.get(item_id, [])
+        if not item or not comps:
+            self._memo[key] = {'status': 'error', 'issue': 'missing_recipe', 'ingredients': {}}
+            return self._memo[key]
+
+        totals = defaultdict(lambda: {'quantity_base': 0.0, 'base_unit': None})
+        issues = []
+
+        for comp in comps:
+            c_unit = comp.get('unit')
+            try:
+                qty_val = float(comp.get('quantity'))
+            except Exception:
+                issues.append({'component': comp, 'issue': 'invalid_quantity'})
+                continue
+
+            if comp.get('source_type') == 'ingredient':
+                iid = comp.get('source_id')
+                qty_base, base_unit = self.conversions.to_base(iid, qty_val, c_unit)
+                cur = totals[iid]
+                cur['quantity_base'] += float(qty_base)
+                cur['base_unit'] = cur['base_unit'] or base_unit
+            elif comp.get('source_type') == 'item':
+                child_usage = self.usage_per_unit(comp.get('source_id'), c_unit, visited=set(visited))
+                if child_usage.get('status') != 'ok':
+                    issues.append({'component': comp, 'issue': child_usage.get('issue')})
+                    continue
+                for iid, info in child_usage['ingredients'].items():
+                    cur = totals[iid]
+                    cur['quantity_base'] += info['quantity_base'] * qty_val
+                    cur['base_unit'] = cur['base_unit'] or info.get('base_unit')
+            else:
+                issues.append({'component': comp, 'issue': 'unknown_source_type'})
+
+        # Yield scaling: divide totals by effective yield to get per-unit usage
+        yield_qty = item.get('yield_qty')
+        yield_unit = (item.get('yield_unit') or '').strip().lower() or output_unit or 'each'
+
+        try:
+            yield_qty_val = float(yield_qty) if yield_qty is not None else 1.0
+        except Exception:
+            yield_qty_val = 1.0
+
+        output_unit_norm = (output_unit or yield_unit or '').strip().lower()
+        factor = 1.0
+        if yield_unit != output_unit_norm:
+            conv = self.conversions.factor(None, yield_unit, output_unit_norm) if yield_unit and output_unit_norm else None
+            if conv:
+                factor = float(conv)
+            else:
+                issues.append({'issue': 'missing_yield_conversion', 'from': yield_unit, 'to': output_unit_norm})
+
+        effective_yield = yield_qty_val * factor if yield_qty_val else 1.0
+        if effective_yield == 0:
+            effective_yield = 1.0
+            issues.append({'issue': 'zero_effective_yield'})
+
+        per_unit = {}
+        for iid, info in totals.items():
+            per_unit[iid] = {
+                'quantity_base': info['quantity_base'] / effective_yield if effective_yield else info['quantity_base'],
+                'base_unit': info.get('base_unit')
+            }
+
+        status = 'ok' if not issues else 'warning'
+        self._memo[key] = {'status': status, 'issue': issues, 'ingredients': per_unit, 'recipe_unit': output_unit}
+        return self._memo[key]
+
+
+def _issue_json(issue):
+    """An explosion issue without the recipe row it refers to (which may hold Decimals)."""
+    out = {k: v for k, v in issue.items() if k != 'component'}
+    comp = issue.get('component')
+    if comp:
+        out.update(recipe_id=comp.get('recipe_id'), source_type=comp.get('source_type'), source_id=comp.get('source_id'))
+    if not isinstance(out.get('issue'), str):
+        # A sub-recipe that only exploded with warnings is left out as a whole
+        out['issue'] = 'sub_recipe_warning'
+    return out
+
+
+def refresh_item_usage(cursor):
+    """Recompute the rows of dirty items and of every item using them; returns how many items."""
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM item_ingredient_usage_dirty) AS dirty")
+    if not (cursor.fetchone() or {}).get('dirty'):
+        return 0
+    with transaction():
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('item_ingredient_usage'))")
+        cursor.execute(
+            """
+            WITH RECURSIVE dirty AS (
+                DELETE FROM item_ingredient_usage_dirty RETURNING item_id
+            ),
+            affected(item_id) AS (
+                SELECT item_id FROM dirty
+                UNION
+                SELECT r.item_id
+                FROM recipes r
+                JOIN affected a ON r.source_type = 'item' AND r.source_id = a.item_id
+            )
+            SELECT item_id FROM affected
+            """
+        )
+        item_ids = [row['item_id'] for row in cursor.fetchall()]
+        if not item_ids:
+            return 0
+        # Read after taking the marks: every change they record is already in the graph
+        graph = cached_graph(full=True)
+        explosion = UsageExplosion(graph.conversions, graph.items, graph.recipes)
+        rows = []
+        for item_id in item_ids:
+            item = graph.items.get(item_id)
+            if item is None:
+                continue
+            usage = explosion.usage_per_unit(item_id, item.get('yield_unit'))
+            if usage.get('status') == 'error':
+                continue
+            issues = Json([_issue_json(i) for i in usage.get('issue') or []])
+            for iid, info in usage['ingredients'].items():
+                rows.append((item_id, iid, info['quantity_base'], info.get('base_unit'), issues))
+        cursor.execute("DELETE FROM item_ingredient_usage WHERE item_id = ANY(%s)", (item_ids,))
+        if rows:
+            psycopg2.extras.execute_values(
+                cursor,
+                """
+                INSERT INTO item_ingredient_usage (item_id, ingredient_id, base_qty_per_yield_unit, base_unit, issues)
+                VALUES %s
+                """,
+                rows,
+                template="(%s::int, %s::int, %s::float8, %s, %s::jsonb)",
+                page_size=1000
+            )
+    return len(item_ids)
+
+
+def _refresh_job():
+    cursor = get_db_cursor()
+    try:
+        return refresh_item_usage(cursor)
+    finally:
+        try:
+            cursor.close()
+        except Exception:
+            pass
+
+
+def queue_usage_refresh():
+    """Run refresh_item_usage() on the item-usage pool, unless a refresh is already waiting to start."""
+    global _refresh_future
+    with _refresh_lock:
+        waiting = _refresh_future is not None and not (_refresh_future.running() or _refresh_future.done())
+        if not waiting:
+            _refresh_future = jobs.submit('item-usage', _refresh_job)
+        return _refresh_future
+
+
+def usage_pending(cursor):
+    """True when items are marked for a refresh (their rows may be stale); queues the refresh."""
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM item_ingredient_usage_dirty) AS dirty")
+    if not (cursor.fetchone() or {}).get('dirty'):
+        return False
+    queue_usage_refresh()
+    return True
+
+
+def items_using(cursor, ingredient_ids):
+    """Ids of the items whose active recipes use any of ingredient_ids, directly or through sub-recipes.
+
+    Unlike item_ingredient_usage this includes items whose explosion had to
+    leave the ingredient out (e.g. a sub-recipe with issues).
+    """
+    cursor.execute(
+        """
+        WITH RECURSIVE users(item_id) AS (
+            SELECT item_id FROM recipes
+            WHERE source_type = 'ingredient' AND source_id = ANY(%s)
+              AND (archived IS NULL OR archived = FALSE)
+            UNION
+            SELECT r.item_id
+            FROM recipes r
+            JOIN users u ON r.source_type = 'item' AND r.source_id = u.item_id
+            WHERE r.archived IS NULL OR r.archived = FALSE
+        )
+        SELECT item_id FROM users ORDER BY item_id
+        """,
+        (list(ingredient_ids),)
+    )
+    return [row['item_id'] for row in cursor.fetchall()]
+
+
+def load_item_usage(cursor, ingredient_ids=None, item_ids=None):
+    """item_id -> {'ingredients': {ingredient_id: {'quantity_base', 'base_unit'}}, 'issues': [...]}.
+
+    Limited to rows of the given ingredients and/or items. The table is read as
+    is; see usage_pending().
+    """
+    where, params = [], []
+    if ingredient_ids is not None:
+        where.append("ingredient_id = ANY(%s)")
+        params.append(list(ingredient_ids))
+    if item_ids is not None:
+        where.append("item_id = ANY(%s)")
+        params.append(list(item_ids))
+    cursor.execute(
+        "SELECT item_id, ingredient_id, base_qty_per_yield_unit, base_unit, issues FROM item_ingredient_usage"
+        + (" WHERE " + " AND ".join(where) if where else ""),
+        tuple(params)
+    )
+    usage = {}
+    for row in cursor.fetchall():
+        entry = usage.setdefault(row['item_id'], {'ingredients': {}, 'issues': row.get('issues') or []})
+        entry['ingredients'][row['ingredient_id']] = {
+            'quantity_base': row['base_qty_per_yield_unit'],
+            'base_unit': row.get('base_unit')
+        }
+    return usage
@@ -0,0 +1,59 @@
+"""In-process background job pools.
+
+Long-running work (bulk cost recalculation, ...) is handed to a named
+ThreadPoolExecutor so the request that started it can return straight away.
+Each job runs inside shared_connection(), so all of its get_db_cursor() calls
+share one pooled connection exactly as a request does. Pools are created per
+process on first use, which keeps them valid across gunicorn's fork.
+
+Progress and results belong in the database (e.g. cost_recalculation_runs), not
+in the executor: any instance can then answer a status poll.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .db import shared_connection
+
+logger = logging.getLogger(__name__)
+
+_executors = {}
+_executors_lock = threading.Lock()
+_executors_pid = None
+
+
+def _executor(name, max_workers):
+    global _executors_pid
+    with _executors_lock:
+        if _executors_pid != os.getpid():
+            # Threads don't survive fork(); never reuse a parent's executors.
+            _executors.clear()
+            _executors_pid = os.getpid()
+        executor = _executors.get(name)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+            _executors[name] = executor
+        return executor
+
+
+def _run_job(fn, args, kwargs):
+    with shared_connection():
+        return fn(*args, **kwargs)
+
+
+def _log_failure(name, future):
+    exc = future.exception()
+    if exc is not None:
+        logger.error("Background job in %s failed", name, exc_info=(type(exc), exc, exc.__traceback__))
+
+
+def submit(name, fn, *args, max_workers=1, **kwargs):
+    """Run fn(*args, **kwargs) on the named pool with its own shared connection.
+
+    Returns the Future. Failures are logged; jobs are expected to record their own
+    status in the database.
+    """
+    future = _executor(name, max_workers).submit(_run_job, fn, args, kwargs)
+    future.add_done_callback(lambda f: _log_failure(name, f))
+    return future
@@ -0,0 +1,109 @@
+"""Numeric cell parsing shared by the sales and journal CSV ingest.
+
+POS exports are mostly clean numbers ("22.000", "154.00"), with the odd
+currency-formatted cell ("$1,234.50", "(12.00)" for a negative). Each parser
+tries the plain-number form first and only then runs the precompiled cleanup:
+it drops currency symbols, thousands separators and other stray characters,
+and turns accounting parentheses into a minus sign. Strings that still aren't
+a number parse to None.
+
+parse_column() converts a whole column at once and parses each distinct
+string only once, which is most of the work on real exports where a handful
+of values ("1.000", "0.00") repeat across thousands of rows.
+"""
+import re
+from decimal import Decimal, InvalidOperation
+
+_PLAIN_NUMBER = re.compile(r"-?(?:\d+\.?\d*|\.\d+)")
+_NON_NUMERIC = re.compile(r"[^0-9.\-]")
+
+
+def _clean(text):
+    """Return text reduced to a candidate number string, or None when nothing is left."""
+    text = text.strip()
+    if _PLAIN_NUMBER.fullmatch(text):
+        return text
+    negative = text.startswith('(') and text.endswith(')')
+    cleaned = _NON_NUMERIC.sub('', text)
+    if not cleaned:
+        return None
+    if negative and not cleaned.startswith('-'):
+        cleaned = '-' + cleaned
+    return cleaned
+
+
+def parse_decimal(val):
+    """Parse a cell to Decimal (None when blank or not a number)."""
+    if val is None or val == '':
+        return None
+    if isinstance(val, Decimal):
+        return val
+    if isinstance(val, (int, float)):
+        return Decimal(str(val))
+    cleaned = _clean(str(val))
+    if cleaned is None:
+        return None
+    try:
+        return Decimal(cleaned)
+    except (InvalidOperation, ValueError):
+        return None
+
+
+def parse_float(val):
+    """Parse a cell to float (None when blank or not a number)."""
+    if val is None:
+        return None
+    if isinstance(val, (int, float)):
+        return float(val)
+    cleaned = _clean(str(val))
+    if cleaned is None:
+        return None
+    try:
+        return float(cleaned)
+    except ValueError:
+        return None
+
+
+def normalize_id(val):
+    """Normalize a POS id cell to a plain integer string ("1.23E+12" -> "1230000000000")."""
+    if val is None:
+        return None
+    s = str(val).strip()
+    if s == '':
+        return None
+    # Remove surrounding quotes
+    s = s.strip('"')
+    if s.isdigit() and s.isascii():
+        return str(int(s))
+    # Try to parse as Decimal then int to avoid scientific notation
+    try:
+        d = Decimal(s)
+        # If it's effectively integer, convert to int
+        try:
+            return str(int(d))
+        except (OverflowError, ValueError):
+            # fallback to plain string without decimal part
+            pass
+    except (InvalidOperation, ValueError):
+        pass
+    # Fallback: remove decimal part if present
+    if '.' in s:
+        return s.split('.')[0]
+    return s
+
+
+def parse_column(values, parser=parse_decimal):
+    """Parse every value of a column with parser, parsing each distinct string once."""
+    seen = {}
+    out = []
+    append = out.append
+    for val in values:
+        try:
+            parsed = seen[val]
+        except KeyError:
+            parsed = seen[val] = parser(val)
+        except TypeError:
+            # unhashable input; parse it directly
+            parsed = parser(val)
+        append(parsed)
+    return out
@@ -0,0 +1,373 @@
+"""In-memory recipe graph for resolving many item costs at once.
+
+RecipeGraph loads items, recipes, the latest quote per ingredient and the
+conversion table up front (a handful of queries in one snapshot) instead of
+several queries per recipe node, then resolves costs in memory, memoizing
+shared sub-recipes per (id, unit). It backs resolve_item_cost and
+resolve_ingredient_cost (through cost_cache) as well as the bulk routes.
+"""
+from .conversion_index import ConversionIndex
+from .db import get_db_cursor, transaction
+
+
+def _norm(unit):
+    return (unit or "").strip().lower()
+
+
+class RecipeGraph:
+    def __init__(self, items, recipes, quotes, conversions):
+        self.items = {row["item_id"]: row for row in items}
+        self.recipes = {}
+        for row in recipes:
+            self.recipes.setdefault(row["item_id"], []).append(row)
+        self.quotes = {row["ingredient_id"]: row for row in quotes}
+        self.conversions = conversions if isinstance(conversions, ConversionIndex) else ConversionIndex(conversions)
+        self._ingredient_memo = {}
+        self._item_memo = {}
+        self.loaded_item_ids = None
+        self.loaded_ingredient_ids = None
+
+    @classmethod
+    def load(cls, item_ids=None, ingredient_ids=()):
+        """Load the graph for every item, or only for item_ids and their sub-recipes.
+
+        ingredient_ids adds quotes for ingredients that should be resolvable on
+        their own even if none of the loaded recipes use them.
+        """
+        with transaction(readonly=True, isolation_level="REPEATABLE READ"):
+            cursor = get_db_cursor()
+            try:
+                if item_ids is None:
+                    cursor.execute("SELECT * FROM items")
+                    items = cursor.fetchall()
+                    cursor.execute("SELECT * FROM recipes ORDER BY item_id, recipe_id")
+                    recipes = cursor.fetchall()
+                    cursor.execute("""
+                        SELECT DISTINCT ON (ingredient_id) *
+                        FROM price_quotes
+                        ORDER BY ingredient_id, date_found DESC, id DESC
+                    """)
+                    quotes = cursor.fetchall()
+                    ids = [row["item_id"] for row in items]
+                    quoted = None
+                else:
+                    ids = list({i for i in item_ids if i is not None})
+                    if ids:
+                        cursor.execute("""
+                            WITH RECURSIVE reach(item_id) AS (
+                                SELECT unnest(%s::int[])
+                                UNION
+                                SELECT r.source_id
+                                FROM recipes r
+                                JOIN reach ON r.item_id = reach.item_id
+                                WHERE r.source_type = 'item'
+                            )
+                            SELECT array_agg(item_id) AS ids FROM reach
+                        """, (ids,))
+                        ids = (cursor.fetchone() or {}).get("ids") or []
+                        cursor.execute("SELECT * FROM items WHERE item_id = ANY(%s)", (ids,))
+                        items = cursor.fetchall()
+                        cursor.execute(
+                            "SELECT * FROM recipes WHERE item_id = ANY(%s) ORDER BY item_id, recipe_id",
+                            (ids,)
+                        )
+                        recipes = cursor.fetchall()
+                    else:
+                        items, recipes = [], []
+                    quoted = {
+                        r.get("source_id") for r in recipes
+                        if r.get("source_type") == "ingredient" and r.get("source_id") is not None
+                    }
+                    quoted.update(i for i in ingredient_ids if i is not None)
+                    cursor.execute("""
+                        SELECT DISTINCT ON (ingredient_id) *
+                        FROM price_quotes
+                        WHERE ingredient_id = ANY(%s)
+                        ORDER BY ingredient_id, date_found DESC, id DESC
+                    """, (list(quoted),))
+                    quotes = cursor.fetchall()
+                cursor.execute("SELECT ingredient_id, from_unit, to_unit, factor, is_global FROM ingredient_conversions ORDER BY id")
+                conversions = cursor.fetchall()
+            finally:
+                try:
+                    cursor.close()
+                except Exception:
+                    pass
+        graph = cls(items, recipes, quotes, conversions)
+        # What this graph can answer for: None means everything
+        graph.loaded_item_ids = None if item_ids is None else set(ids)
+        graph.loaded_ingredient_ids = quoted
+        return graph
+
+    def covers(self, item_ids=(), ingredient_ids=()):
+        """True when every given item and ingredient was loaded into this graph."""
+        if self.loaded_item_ids is not None and not set(item_ids) <= self.loaded_item_ids:
+            return False
+        if self.loaded_ingredient_ids is not None and not set(ingredient_ids) <= self.loaded_ingredient_ids:
+            return False
+        return True
+
+    def merged(self, other):
+        """Return a new graph with other's rows added, keeping memoized results.
+
+        Both graphs must come from the same state of the cost inputs.
+        """
+        graph = RecipeGraph.__new__(RecipeGraph)
+        graph.items = {**self.items, **other.items}
+        graph.recipes = {**self.recipes, **other.recipes}
+        graph.quotes = {**self.quotes, **other.quotes}
+        graph.conversions = other.conversions
+        # Results for ids this graph never loaded (e.g. item_not_found) may be wrong now
+        graph._ingredient_memo = {
+            key: value for key, value in self._ingredient_memo.items()
+            if self.loaded_ingredient_ids is None or key[0] in self.loaded_ingredient_ids
+        }
+        graph._item_memo = {
+            key: value for key, value in self._item_memo.items()
+            if self.loaded_item_ids is None or key[0] in self.loaded_item_ids
+        }
+        graph.loaded_item_ids = None if self.loaded_item_ids is None or other.loaded_item_ids is None \
+            else self.loaded_item_ids | other.loaded_item_ids
+        graph.loaded_ingredient_ids = None if self.loaded_ingredient_ids is None or other.loaded_ingredient_ids is None \
+            else self.loaded_ingredient_ids | other.loaded_ingredient_ids
+        return graph
+
+    # Conversions come from a ConversionIndex: shortest path first, per-ingredient
+    # rows before global ones; yield conversions only use global rows.
+
+    def _ingredient_unit_cost(self, ingredient_id, recipe_unit_norm):
+        """Return (price_per_unit, quote) or (None, error_result) for an ingredient in a unit."""
+        key = (ingredient_id, recipe_unit_norm)
+        if key in self._ingredient_memo:
+            return self._ingredient_memo[key]
+
+        quote = self.quotes.get(ingredient_id)
+        if not quote:
+            outcome = (None, {
+                "status": "error",
+                "issue": "missing_price",
+                "message": "No price quote found for this ingredient",
+                "ingredient_id": ingredient_id
+            })
+            self._ingredient_memo[key] = outcome
+            return outcome
+
+        quote_unit = _norm(quote.get("size_unit"))
+        try:
+            quote_qty_val = float(quote.get("size_qty"))
+            quote_price_val = float(quote.get("price"))
+        except Exception:
+            outcome = (None, {
+                "status": "error",
+                "issue": "invalid_quote_format",
+                "message": "Missing or invalid size_qty or price fields",
+                "ingredient_id": ingredient_id
+            })
+            self._ingredient_memo[key] = outcome
+            return outcome
+
+        if quote_qty_val == 0:
+            outcome = (None, {
+                "status": "error",
+                "issue": "invalid_quote_quantity",
+                "message": "Quote size_qty is zero",
+                "ingredient_id": ingredient_id
+            })
+        elif not quote_unit:
+            outcome = (None, {
+                "status": "error",
+                "issue": "invalid_quote_format",
+                "message": "Missing or invalid size_unit field",
+                "ingredient_id": ingredient_id
+            })
+        else:
+            price_per_unit = quote_price_val / quote_qty_val
+            outcome = (price_per_unit, quote)
+            if quote_unit != recipe_unit_norm:
+                conversion_factor = self.conversions.factor(ingredient_id, quote_unit, recipe_unit_norm)
+                if conversion_factor is None:
+                    outcome = (None, {
+                        "status": "error",
+                        "issue": "missing_conversion",
+                        "message": f"Missing conversion from {quote_unit} to {recipe_unit_norm}",
+                        "missing": {
+                            "ingredient_id": ingredient_id,
+                            "from_unit": quote_unit,
+                            "to_unit": recipe_unit_norm
+                        }
+                    })
+                else:
+                    outcome = (price_per_unit / conversion_factor, quote)
+        self._ingredient_memo[key] = outcome
+        return outcome
+
+    def resolve_ingredient(self, ingredient_id, recipe_unit, quantity=1):
+        """Cost `quantity` of an ingredient in recipe_unit; see cost_resolver.resolve_ingredient_cost."""
+        price_per_unit, detail = self._ingredient_unit_cost(ingredient_id, _norm(recipe_unit))
+        if price_per_unit is None:
+            return dict(detail)
+        total_cost = price_per_unit * float(quantity)
+        return {
+            "status": "ok",
+            "ingredient_id": ingredient_id,
+            "recipe_unit": recipe_unit,
+            "quantity": quantity,
+            "cost_per_unit": round(price_per_unit, 4),
+            "total_cost": round(total_cost, 4),
+            "quote_date": detail.get("date_found"),
+            "source": detail.get("source")
+        }
+
+    def _item_unit_cost(self, item_id, recipe_unit_norm, visited):
+        """Return (cost_per_unit, error_result, path_dependent).
+
+        Results that saw a circular_dependency depend on the path they were reached
+        by, so only path-independent results are memoized.
+        """
+        if item_id in visited:
+            return None, {"status": "error", "issue": "circular_dependency", "item_id": item_id}, True
+
+        key = (item_id, recipe_unit_norm)
+        if key in self._item_memo:
+            cost_per_unit, error = self._item_memo[key]
+            return cost_per_unit, error, False
+
+        visited = visited | {item_id}
+        cost_per_unit, error, path_dependent = self._compute_item(item_id, recipe_unit_norm, visited)
+        if not path_dependent:
+            self._item_memo[key] = (cost_per_unit, error)
+        return cost_per_unit, error, path_dependent
+
+    def _compute_item(self, item_id, recipe_unit_norm, visited):
+        item = self.items.get(item_id)
+        if not item:
+            return None, {"status": "error", "issue": "item_not_found", "item_id": item_id}, False
+
+        components = self.recipes.get(item_id)
+        if not components:
+            return None, {
+                "status": "error",
+                "issue": "no_recipe",
+                "message": "No recipe components available to resolve item cost",
+                "item_id": item_id
+            }, False
+
+        total_cost = 0.0
+        issues = []
+        path_dependent = False
+        for idx, c in enumerate(components):
+            comp_info = {
+                "recipe_row": c.get("recipe_id") or idx,
+                "source_type": c.get("source_type"),
+                "source_id": c.get("source_id"),
+                "unit": c.get("unit"),
+                "quantity": c.get("quantity")
+            }
+
+            if c.get("source_type") == "ingredient":
+                cost = self.resolve_ingredient(c.get("source_id"), c.get("unit"), c.get("quantity"))
+            elif c.get("source_type") == "item":
+                cost, child_dependent = self._resolve_item(c.get("source_id"), c.get("unit"), c.get("quantity"), visited)
+                path_dependent = path_dependent or child_dependent
+            else:
+                issues.append({"component": comp_info, "error": "unknown_source_type"})
+                continue
+
+            if not isinstance(cost, dict) or cost.get("status") != "ok":
+                issues.append({"component": comp_info, "result": cost})
+                continue
+
+            try:
+                total_cost += float(cost.get("total_cost", 0))
+            except Exception:
+                issues.append({"component": comp_info, "error": "invalid_child_cost", "child": cost})
+
+        if issues:
+            return None, {
+                "status": "error",
+                "issue": "child_resolution_error",
+                "item_id": item_id,
+                "details": issues
+            }, path_dependent
+
+        effective_yield, error = self._yield_outcome(item, recipe_unit_norm)
+        if error is not None:
+            return None, error, path_dependent
+        return total_cost / effective_yield, None, path_dependent
+
+    def _yield_outcome(self, item, recipe_unit_norm):
+        """Return (effective_yield, None) or (None, error_result) for an item in a unit."""
+        item_id = item.get("item_id")
+        try:
+            raw_yield_qty = item.get("yield_qty")
+            yield_qty = float(raw_yield_qty) if raw_yield_qty is not None else None
+        except Exception:
+            yield_qty = None
+        yield_unit = _norm(item.get("yield_unit")) or None
+
+        if yield_qty is None or not yield_unit:
+            if recipe_unit_norm:
+                yield_qty = 1.0
+                yield_unit = recipe_unit_norm
+            else:
+                return None, {
+                    "status": "error",
+                    "issue": "missing_or_invalid_yield",
+                    "message": "Item yield_unit/qty missing and no recipe unit supplied",
+                    "item_id": item_id
+                }
+
+        if yield_unit != recipe_unit_norm:
+            conversion_factor = self.conversions.factor(None, yield_unit, recipe_unit_norm)
+            if conversion_factor is None:
+                return None, {
+                    "status": "error",
+                    "issue": "missing_conversion",
+                    "from": yield_unit,
+                    "to": recipe_unit_norm
+                }
+        else:
+            conversion_factor = 1.0
+
+        effective_yield = yield_qty * conversion_factor
+        if effective_yield == 0:
+            return None, {
+                "status": "error",
+                "issue": "zero_effective_yield",
+                "message": "Effective yield is zero after conversion",
+                "item_id": item_id
+            }
+
+        return effective_yield, None
+
+    def effective_yield(self, item_id, recipe_unit):
+        """Item yield expressed in recipe_unit, or None when it can't be determined."""
+        item = self.items.get(item_id)
+        if not item:
+            return None
+        return self._yield_outcome(item, _norm(recipe_unit))[0]
+
+    def ingredient_unit_cost(self, ingredient_id, recipe_unit):
+        """Unrounded price per recipe_unit, or None when the ingredient can't be costed."""
+        return self._ingredient_unit_cost(ingredient_id, _norm(recipe_unit))[0]
+
+    def _resolve_item(self, item_id, recipe_unit, quantity, visited):
+        cost_per_unit, error, path_dependent = self._item_unit_cost(item_id, _norm(recipe_unit), visited)
+        if error is not None:
+            return dict(error), path_dependent
+        return {
+            "status": "ok",
+            "item_id": item_id,
+            "recipe_unit": recipe_unit,
+            "quantity": quantity,
+            "cost_per_unit": round(cost_per_unit, 4),
+            "total_cost": round(cost_per_unit * float(quantity), 4)
+        }, path_dependent
+
+    def resolve_item(self, item_id, recipe_unit, quantity=1):
+        """Cost `quantity` of an item in recipe_unit; see cost_resolver.resolve_item_cost."""
+        return self._resolve_item(item_id, recipe_unit, quantity, frozenset())[0]
+
+    def resolve_items(self, requests):
+        """Resolve (item_id, recipe_unit) pairs; returns {item_id: result}."""
+        return {item_id: self.resolve_item(item_id, unit, 1) for item_id, unit in requests}
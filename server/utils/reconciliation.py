@@ -0,0 +1,344 @@
+"""Inventory reconciliation over preloaded data.
+
+ReconciliationEngine answers, for one ingredient and a pair of counts, what the
+later count should have been (previous count + purchases + adjustments - usage
+implied by sales through recipes) and how far the actual count is from it.
+
+It works only on what it is handed: items (from the cached RecipeGraph), a
+ConversionIndex, the exploded per-unit ingredient usage of the sold items
+(item_ingredient_usage) and the purchases, adjustments and daily sales of the
+window. Every unit conversion is a ConversionIndex lookup, so a reconciliation
+of the whole store makes no queries beyond loading those inputs.
+
+Each ingredient's purchases, adjustments and sales usage become EventTimelines
+in the unit being reconciled: events sorted by time with a running total, so
+the total of any window between two counts is two binary searches and a
+subtraction. Timelines are built once per (ingredient, unit) and serve every
+pair of counts reconciled with the same engine.
+"""
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def ensure_datetime(val):
+    """Normalize DB values (datetime/date/str) to timezone-aware UTC datetimes."""
+    if isinstance(val, datetime):
+        return val if val.tzinfo else val.replace(tzinfo=timezone.utc)
+    if isinstance(val, date):
+        return datetime.combine(val, datetime.min.time(), tzinfo=timezone.utc)
+    if isinstance(val, str):
+        try:
+            # Handle trailing Z or offset-naive strings
+            cleaned = val.replace('Z', '+00:00') if val.endswith('Z') else val
+            return datetime.fromisoformat(cleaned)
+        except Exception:
+            return None
+    return None
+
+
+def _micros(ts):
+    return (ts - _EPOCH) // _MICROSECOND
+
+
+class EventTimeline:
+    """One ingredient's events of one kind, sorted by time, with quantities in one unit.
+
+    cum[i] is the total of the first i events, so a window [lo, hi) of events
+    totals cum[hi] - cum[lo]. errors holds the indexes of events whose quantity
+    could not be converted (their unconverted quantity is counted, as before)
+    with the conversion error.
+    """
+
+    def __init__(self, events, convert):
+        """events are dicts with 'ts', 'quantity_base' and 'base_unit'; convert(qty, unit)
+        returns (qty, error) in the timeline's unit."""
+        self.events = sorted(events, key=lambda e: e['ts'])
+        self.ts = np.fromiter((_micros(e['ts']) for e in self.events), dtype=np.int64, count=len(self.events))
+        qty = np.zeros(len(self.events), dtype=np.float64)
+        self.errors = []
+        for i, e in enumerate(self.events):
+            value, err = convert(e.get('quantity_base'), e.get('base_unit'))
+            if err:
+                self.errors.append((i, err))
+                value = e.get('quantity_base')
+            try:
+                qty[i] = float(value or 0)
+            except Exception:
+                pass
+        self.cum = np.concatenate(([0.0], np.cumsum(qty)))
+        self._error_index = np.fromiter((i for i, _ in self.errors), dtype=np.int64, count=len(self.errors))
+
+    def window(self, start=None, end=None, end_inclusive=True):
+        """(lo, hi) of the events with start <= ts and ts <= end (ts < end if not end_inclusive)."""
+        lo = 0 if start is None else int(np.searchsorted(self.ts, _micros(start), 'left'))
+        if end is None:
+            hi = len(self.events)
+        else:
+            hi = int(np.searchsorted(self.ts, _micros(end), 'right' if end_inclusive else 'left'))
+        return lo, max(lo, hi)
+
+    def total(self, lo, hi):
+        return float(self.cum[hi] - self.cum[lo])
+
+    def window_errors(self, lo, hi):
+        """(event, error) for the events of [lo, hi) that could not be converted."""
+        a, b = np.searchsorted(self._error_index, [lo, hi], 'left')
+        return [(self.events[i], err) for i, err in self.errors[a:b]]
+
+
+class ReconciliationEngine:
+    def __init__(self, conversions, items, usage):
+        """conversions is a ConversionIndex, items maps item_id -> items row and
+        usage is load_item_usage() for (at least) the ingredients to reconcile."""
+        self.conversions = conversions
+        self.items = items
+        self.usage = usage
+        self.purchases = defaultdict(list)
+        self.adjustments = defaultdict(list)
+        self.sales_usage = defaultdict(list)
+        self._timelines = {}
+        self._sales_by_item = {}
+        self.skipped_sales = {'no_item_id': 0, 'missing_recipe': defaultdict(float), 'compute_errors': defaultdict(float)}
+
+    def convert(self, qty, from_unit, to_unit, ingredient_id=None):
+        """Convert qty between arbitrary units; returns (qty, error)."""
+        if to_unit is None or from_unit is None or str(from_unit).strip().lower() == str(to_unit).strip().lower():
+            return qty, None  # no conversion needed
+        factor = self.conversions.factor(ingredient_id, from_unit, to_unit)
+        if factor is None:
+            return qty, 'missing_conversion'
+        try:
+            return float(qty) * factor, None
+        except Exception as e:
+            return qty, str(e)
+
+    def load_events(self, purchases=(), adjustments=(), sales=(), default_ts=None):
+        """Convert the window's rows to timestamped base-unit events, once.
+
+        purchases are received_goods rows (ingredient_id, units, unit_type,
+        receive_date), adjustments inventory_adjustments rows (ingredient_id,
+        quantity_base, base_unit, created_at) and sales (business_date, item_id,
+        item_name, item_qty) rows. default_ts stands in for missing timestamps.
+        """
+        for r in purchases:
+            iid = r.get('ingredient_id')
+            qty = r.get('units')
+            unit_type = r.get('unit_type')
+            try:
+                qty_base, base_unit = self.conversions.to_base(iid, qty, unit_type)
+                qty_base = float(qty_base)
+            except Exception:
+                qty_base = float(qty or 0)
+                base_unit = unit_type
+            self.purchases[iid].append({
+                'ts': ensure_datetime(r.get('receive_date')) or default_ts,
+                'quantity': qty,
+                'unit': unit_type,
+                'quantity_base': qty_base,
+                'base_unit': base_unit or unit_type
+            })
+
+        for r in adjustments:
+            try:
+                qty_base = float(r.get('quantity_base') or 0)
+            except Exception:
+                qty_base = 0.0
+            self.adjustments[r.get('ingredient_id')].append({
+                'ts': ensure_datetime(r.get('created_at')) or default_ts,
+                'quantity_base': qty_base,
+                'base_unit': r.get('base_unit')
+            })
+
+        for row in sales:
+            item_id = row.get('item_id')
+            try:
+                qty_sold = float(row.get('item_qty') or 0)
+            except Exception:
+                qty_sold = 0.0
+            if not qty_sold:
+                continue
+            ts = ensure_datetime(row.get('business_date')) or default_ts
+            if not item_id:
+                self.skipped_sales['no_item_id'] += qty_sold
+                continue
+
+            usage = self.usage.get(item_id)
+            if usage is None:
+                # No usage rows: an unknown item, or a recipe whose explosion left every ingredient out
+                reason = 'compute_errors' if item_id in self.items else 'missing_recipe'
+                self.skipped_sales[reason][item_id] += qty_sold
+                continue
+            if usage.get('issues'):
+                self.skipped_sales['compute_errors'][item_id] += qty_sold
+            recipe_unit = (self.items.get(item_id) or {}).get('yield_unit')
+
+            for iid, info in usage.get('ingredients', {}).items():
+                self.sales_usage[iid].append({
+                    'ts': ts,
+                    'quantity_base': (info.get('quantity_base') or 0) * qty_sold,
+                    'base_unit': info.get('base_unit'),
+                    'recipe_unit': recipe_unit,
+                    'item_id': item_id,
+                    'item_name': row.get('item_name') or (self.items.get(item_id) or {}).get('name'),
+                    'qty_sold': qty_sold
+                })
+
+    def timeline(self, kind, iid, unit, item_id=None):
+        """EventTimeline of purchases, adjustments or sales usage (optionally of one item) in unit."""
+        key = (kind, iid, unit, item_id)
+        timeline = self._timelines.get(key)
+        if timeline is None:
+            if item_id is None:
+                events = {'purchase': self.purchases, 'adjustment': self.adjustments, 'sales_usage': self.sales_usage}[kind].get(iid, [])
+            else:
+                events = self.sales_by_item(iid).get(item_id, [])
+            timeline = EventTimeline(events, lambda qty, from_unit: self.convert(qty, from_unit, unit, iid))
+            self._timelines[key] = timeline
+        return timeline
+
+    def sales_by_item(self, iid):
+        """item_id -> sales usage events of ingredient iid, items in order of first sale."""
+        grouped = self._sales_by_item.get(iid)
+        if grouped is None:
+            grouped = {}
+            for e in self.sales_usage.get(iid, []):
+                grouped.setdefault(e.get('item_id'), []).append(e)
+            self._sales_by_item[iid] = grouped
+        return grouped
+
+    def reconcile(self, iid, latest_row, prev_row, cutoff, window_end, start_entry_date=None, end_entry_date=None):
+        """Expected and actual quantity of ingredient iid between prev_row and latest_row.
+
+        Counts are inventory_count_entries rows; either may be None. Events before
+        cutoff are ignored. Returns the result row of /api/inventory/reconciliation/latest
+        without the ingredient name.
+        """
+        latest_dt = ensure_datetime(latest_row.get('created_at')) if latest_row else None
+        prev_dt = ensure_datetime(prev_row.get('created_at')) if prev_row else None
+        effective_start_dt = max([d for d in [prev_dt, cutoff] if d], default=cutoff)
+        start_date_cutoff = prev_dt.date() if prev_dt else (start_entry_date or (effective_start_dt.date() if effective_start_dt else None))
+        end_date_cutoff = latest_dt.date() if latest_dt else (end_entry_date or (window_end.date() if isinstance(window_end, datetime) else None))
+
+        # Pick a canonical unit: prefer latest count's base_unit, else unit, else previous, else first purchase unit
+        canonical_unit = (
+            (latest_row.get('base_unit') or latest_row.get('unit') or '').strip().lower()
+            if latest_row else ''
+        )
+        if not canonical_unit and prev_row:
+            canonical_unit = (prev_row.get('base_unit') or prev_row.get('unit') or '').strip().lower()
+        if not canonical_unit:
+            p_list = self.purchases.get(iid, [])
+            if p_list:
+                canonical_unit = (p_list[0].get('base_unit') or p_list[0].get('unit') or '').strip().lower()
+        canonical_unit = canonical_unit or None
+        conversion_issues = []
+
+        def in_canonical(kind, qty, unit):
+            qty_can, err = self.convert(qty, unit, canonical_unit, iid)
+            if err:
+                conversion_issues.append({'type': kind, 'unit': unit, 'target': canonical_unit, 'detail': err})
+                qty_can = qty
+            return qty_can
+
+        def window_total(kind, timeline, lo, hi):
+            for e, err in timeline.window_errors(lo, hi):
+                conversion_issues.append({'type': kind, 'unit': e.get('base_unit'), 'target': canonical_unit, 'detail': err})
+            return timeline.total(lo, hi)
+
+        # Purchases count by receive date: after the start count's day, up to the end count's day
+        timeline = self.timeline('purchase', iid, canonical_unit)
+        lo, hi = timeline.window(
+            datetime.combine(start_date_cutoff + timedelta(days=1), datetime.min.time(), tzinfo=timezone.utc) if start_date_cutoff else None,
+            datetime.combine(end_date_cutoff + timedelta(days=1), datetime.min.time(), tzinfo=timezone.utc) if end_date_cutoff else None,
+            end_inclusive=False
+        )
+        purchases = window_total('purchase', timeline, lo, hi)
+        # Most recent first for display
+        purchase_details = [{
+            'ts': e['ts'].isoformat() if e.get('ts') else None,
+            'quantity': e.get('quantity'),
+            'unit': e.get('unit'),
+            'quantity_base': e.get('quantity_base'),
+            'base_unit': e.get('base_unit')
+        } for e in reversed(timeline.events[max(lo, hi - 10):hi])]
+
+        timeline = self.timeline('adjustment', iid, canonical_unit)
+        adjustments = window_total('adjustment', timeline, *timeline.window(effective_start_dt, latest_dt))
+
+        timeline = self.timeline('sales_usage', iid, canonical_unit)
+        usage = window_total('sales_usage', timeline, *timeline.window(effective_start_dt, latest_dt))
+
+        expected = None
+        variance = None
+        if prev_row:
+            try:
+                prev_qty_can = in_canonical('previous_count', prev_row.get('quantity_base'), prev_row.get('base_unit'))
+                latest_qty_can = in_canonical('latest_count', latest_row.get('quantity_base'), latest_row.get('base_unit'))
+                expected = float(prev_qty_can or 0) + purchases + adjustments - usage
+                variance = float(latest_qty_can or 0) - expected
+            except Exception:
+                expected = None
+                variance = None
+
+        breakdown = []
+        for item_id in self.sales_by_item(iid):
+            item_usage = self.timeline('sales_usage', iid, canonical_unit, item_id)
+            lo, hi = item_usage.window(effective_start_dt, latest_dt)
+            if lo == hi:
+                continue
+            events = item_usage.events[lo:hi]
+            breakdown.append({
+                'item_id': item_id,
+                'item_name': events[-1].get('item_name'),
+                'qty_sold': sum(e.get('qty_sold') or 0 for e in events),
+                'usage_base': window_total('sales_breakdown', item_usage, lo, hi),
+                'base_unit': canonical_unit,
+                'recipe_unit': next((e['recipe_unit'] for e in events if e.get('recipe_unit')), None)
+            })
+        breakdown.sort(key=lambda x: abs(x['usage_base']), reverse=True)
+
+        return {
+            'ingredient_id': iid,
+            'canonical_unit': canonical_unit,
+            'latest_count': {
+                'quantity_base': latest_row.get('quantity_base'),
+                'base_unit': latest_row.get('base_unit') or latest_row.get('unit'),
+                'quantity': latest_row.get('quantity'),
+                'unit': latest_row.get('unit'),
+                'location': latest_row.get('location'),
+                'created_at': latest_dt.isoformat() if latest_dt else None,
+                'user_id': latest_row.get('user_id')
+            } if latest_row else None,
+            'previous_count': {
+                'quantity_base': prev_row.get('quantity_base'),
+                'base_unit': prev_row.get('base_unit'),
+                'quantity': prev_row.get('quantity'),
+                'unit': prev_row.get('unit'),
+                'location': prev_row.get('location'),
+                'created_at': prev_dt.isoformat() if prev_dt else None,
+                'user_id': prev_row.get('user_id')
+            } if prev_row else None,
+            'purchases_base': purchases,
+            'purchases': purchase_details,
+            'adjustments_base': adjustments,
+            'sales_usage_base': usage,
+            'expected_base': expected,
+            'variance_base': variance,
+            'sales_breakdown': breakdown,
+            'conversion_issues': conversion_issues
+        }
+
+    def skipped_sales_meta(self):
+        """Sales left out of usage, keyed by item name, for the response meta."""
+        def by_name(counts):
+            return {self.items.get(k, {}).get('name', f'item {k}'): v for k, v in counts.items()}
+        return {
+            'sales_skipped_no_item': self.skipped_sales['no_item_id'],
+            'sales_skipped_missing_recipe': by_name(self.skipped_sales['missing_recipe']),
+            'sales_skipped_compute_errors': by_name(self.skipped_sales['compute_errors'])
+        }
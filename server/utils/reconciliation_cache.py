@@ -0,0 +1,114 @@
+"""Stored results of /api/inventory/reconciliation/latest.
+
+Only snapshot-date comparisons whose window has closed are stored: both entry
+dates given and the end date before today, so the result no longer depends on
+the clock. (The lookback cutoff is taken at midnight UTC, so it changes once a
+day rather than with every request.)
+
+A result is stored per (start_entry_date, end_entry_date, lookback_days,
+ingredient filter) with the fingerprint of its inputs taken before it was
+computed: the cost_inputs_version (recipes, items, conversions), the cutoff and
+the sum of the reconciliation_input_days counters over the days the
+reconciliation reads. Triggers bump a day's counter whenever an inventory
+count, purchase, adjustment or daily sales row of that day changes (see
+migrations/20250215_reconciliation_results.sql), and counters only grow, so the
+fingerprint changes exactly when an input inside the window does. A stored
+result is served while its fingerprint still matches and replaced by the next
+computation once it does not. Without the counter tables nothing is stored.
+
+The cutoff moves at midnight UTC, so a result computed on an earlier day can
+never match again; store_reconciliation() deletes those, which keeps the table
+to the comparisons viewed today.
+"""
+import json
+import logging
+
+from psycopg2.extras import Json
+
+logger = logging.getLogger(__name__)
+
+
+def input_window(start_entry_date, end_entry_date, cutoff, today):
+    """(first_day, last_day) of the input rows a storable reconciliation reads, or None.
+
+    None when the result cannot be stored: a lookback comparison, or one whose
+    window reaches today.
+    """
+    if not (start_entry_date and end_entry_date) or end_entry_date >= today:
+        return None
+    return min(start_entry_date, cutoff.date()), end_entry_date
+
+
+def cache_key(start_entry_date, end_entry_date, lookback_days, ingredient_filter):
+    return '|'.join([
+        start_entry_date.isoformat() if start_entry_date else '',
+        end_entry_date.isoformat() if end_entry_date else '',
+        str(lookback_days),
+        str(ingredient_filter or '')
+    ])
+
+
+def input_fingerprint(cursor, window, cutoff):
+    """Fingerprint of the reconciliation inputs in window (first_day, last_day), or None if unavailable."""
+    if window is None:
+        return None
+    first_day, last_day = window
+    try:
+        cursor.execute(
+            """
+            SELECT
+                (SELECT version FROM cost_inputs_version WHERE id = 1) AS cost_version,
+                (SELECT COALESCE(SUM(version), 0) FROM reconciliation_input_days
+                 WHERE day >= %s AND day <= %s) AS day_versions
+            """,
+            (first_day, last_day)
+        )
+        row = cursor.fetchone() or {}
+    except Exception as e:
+        logger.debug("reconciliation input counters unavailable: %s", e)
+        return None
+    if row.get('cost_version') is None:
+        return None
+    return f"{row['cost_version']}:{row['day_versions']}:{first_day.isoformat()}:{last_day.isoformat()}:{cutoff.isoformat()}"
+
+
+def load_reconciliation(cursor, key, fingerprint):
+    """(payload, window_end) stored for key if computed from inputs with this fingerprint, else None."""
+    if fingerprint is None:
+        return None
+    cursor.execute(
+        "SELECT payload, window_end FROM reconciliation_results WHERE cache_key = %s AND fingerprint = %s",
+        (key, fingerprint)
+    )
+    row = cursor.fetchone()
+    return (row.get('payload'), row.get('window_end')) if row else None
+
+
+def store_reconciliation(cursor, key, fingerprint, payload, window_end, start_entry_date, end_entry_date, lookback_days, ingredient_filter):
+    """Store payload for key, replacing the previous result, and drop results of earlier days."""
+    if fingerprint is None:
+        return
+    cursor.execute(
+        "DELETE FROM reconciliation_results WHERE computed_at < date_trunc('day', NOW() AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'"
+    )
+    cursor.execute(
+        """
+        INSERT INTO reconciliation_results (
+            cache_key, start_entry_date, end_entry_date, lookback_days, ingredient_filter,
+            fingerprint, payload, window_end, computed_at
+        )
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW())
+        ON CONFLICT (cache_key) DO UPDATE
+        SET fingerprint = EXCLUDED.fingerprint,
+            payload = EXCLUDED.payload,
+            window_end = EXCLUDED.window_end,
+            computed_at = EXCLUDED.computed_at
+        """,
+        (
+            key, start_entry_date, end_entry_date, lookback_days,
+            str(ingredient_filter) if ingredient_filter else None, fingerprint,
+            # Decimals as strings, as jsonify sends them
+            Json(payload, dumps=lambda v: json.dumps(v, default=str)),
+            window_end
+        )
+    )
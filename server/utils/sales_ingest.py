@@ -0,0 +1,372 @@
+"""Background ingestion of sales (product mix) uploads.
+
+POST /api/sales/upload only stores the raw file as a sales_uploads row with
+status 'queued' and hands its id to queue_upload(). A job on the sales-uploads
+pool then processes it in stages, recording each in sales_uploads.stage:
+
+  ingest     parse the CSV and insert its lines in one transaction, together
+             with the day's sales_item_daily rollup (a failure leaves no lines
+             behind and marks the upload 'failed')
+  mapping    apply sales_item_mappings to lines of the upload still unmapped
+  aggregates refresh what is derived from the day's lines (business_days.has_sales)
+
+The counters (rows_parsed, rows_inserted, rows_skipped, rows_mapped) live on the
+upload row, so GET /api/sales/uploads/<id>/status works from any instance. An
+upload left queued/processing for STALE_UPLOAD_MINUTES (e.g. by a restarted
+instance) is picked up again when its status is polled. The worker holds a
+session advisory lock on the upload while it processes it (released when its
+connection goes away with it), so a slow but live ingest is never claimed twice;
+every stage also refreshes started_at. The raw text is kept only while the upload
+is queued or processing and cleared once it finishes.
+"""
+import csv
+import hashlib
+import io
+import itertools
+import logging
+import os
+
+import psycopg2.extras
+from psycopg2.extras import Json
+
+from .db import get_db_cursor, shared_connection, transaction
+from .header_schema import HeaderSchema
+from .numeric import normalize_id, parse_column, parse_float
+from .sales_mappings import apply_sales_mappings
+from .sales_rollup import refresh_sales_item_daily
+from . import jobs
+
+logger = logging.getLogger(__name__)
+
+# Lines are inserted this many at a time.
+UPLOAD_INSERT_BATCH = 1000
+try:
+    UPLOAD_WORKERS = max(1, int(os.environ.get('SALES_UPLOAD_WORKERS', 1)))
+except (TypeError, ValueError):
+    UPLOAD_WORKERS = 1
+
+# Uploads queued/processing for longer than this are assumed to belong to a dead worker.
+STALE_UPLOAD_MINUTES = 15
+
+# Columns read from sales exports; header names cover Toast's legacy and current layouts.
+SALES_LINE_SCHEMA = HeaderSchema([
+    ('item_name', ('Item', 'item', 'Item Name', 'Menu Item', 'MenuItem', 'Menu_Item')),
+    ('master_id', ('Master ID', 'MasterID', 'master_id', 'masterId'), normalize_id),
+    ('item_id_text', ('Item ID', 'ItemID', 'item_id', 'itemGuid', 'item_guid', 'Item GUID'), normalize_id),
+    ('menu_name', ('Menu Name', 'MenuName')),
+    ('menu_group', ('Sales Category', 'SalesCategory', 'Menu Group', 'MenuGroup')),
+    # Amount columns are parsed a chunk at a time by _iter_sales_lines (see NUMERIC_COLUMNS)
+    # Qty: prefer 'Qty sold', fallback to legacy 'Item Qty' or 'Item qty incl. voids'
+    ('item_qty', ('Qty sold', 'Qty Sold', 'Item Qty', 'ItemQty', 'Item_Qty', 'Item qty incl. voids', 'Item qty incl voids')),
+    ('gross_sales', ('Gross sales', 'Gross Sales', 'Gross Amount', 'GrossAmount', 'Gross amount incl. voids')),
+    ('discount_amount', ('Discount amount', 'Discount Amount', 'DiscountAmount')),
+    ('net_sales', ('Net sales', 'Net Sales', 'Net Amount', 'NetAmount')),
+], required=('item_name',))
+NUMERIC_COLUMNS = slice(5, 9)
+
+
+def _load_sales_mappings(cursor):
+    """normalized sales name -> item_id for every saved mapping (oldest mapping wins)."""
+    cursor.execute("SELECT normalized, item_id FROM sales_item_mappings ORDER BY mapping_id DESC")
+    return {row.get('normalized'): row.get('item_id') for row in cursor.fetchall()}
+
+
+def _iter_sales_lines(compiled, rows, upload_id, business_date, default_sales_category, mappings, stats):
+    """Yield sales_daily_lines value tuples for each sold row of a sales CSV.
+
+    Besides row_hash (unique per upload), each line gets a content_hash built only
+    from what the line says and its business date, so the same line in a re-upload
+    of the day's export hashes the same. Identical lines within one file are told
+    apart by their occurrence count. stats['parsed'] counts rows with an item name,
+    stats['skipped'] those of them that were not sold (zero quantity).
+    """
+    rn = 0
+    occurrences = {}
+    extract = compiled.extract
+    rows = iter(rows)
+    while True:
+        chunk = [extract(r) for r in itertools.islice(rows, UPLOAD_INSERT_BATCH)]
+        if not chunk:
+            break
+        # qty/amount columns are converted column-wise; repeated cells are parsed once
+        amounts = zip(*(parse_column(column, parse_float) for column in list(zip(*chunk))[NUMERIC_COLUMNS]))
+        for (menu_item, master_id, item_id_text, menu_name, menu_group, *_), (item_qty, gross_amount, discount_amount, net_amount) in zip(chunk, amounts):
+            # rows without an item name are skipped
+            if menu_item is None or menu_item.strip() == '':
+                continue
+            rn += 1
+            stats['parsed'] = rn
+            # Skip rows that were not actually sold (zero quantity). Ignore rows where item_qty == 0.
+            if item_qty is not None and item_qty == 0:
+                stats['skipped'] += 1
+                continue
+
+            mapped_item_id = mappings.get(menu_item.strip().lower())
+
+            # row hash for deduplication
+            hash_input = f"{upload_id}|{master_id}|{item_id_text}|{menu_item}|{business_date}|{rn}"
+            row_hash = hashlib.sha256(hash_input.encode('utf-8')).hexdigest()
+
+            resolved_sales_category = str(menu_group or default_sales_category or menu_name or '').strip()
+
+            content_key = (
+                f"{business_date}|{master_id}|{item_id_text}|{menu_item}|{resolved_sales_category}|"
+                f"{item_qty}|{net_amount}|{discount_amount}|{gross_amount}"
+            )
+            occurrence = occurrences[content_key] = occurrences.get(content_key, 0) + 1
+            content_hash = hashlib.sha256(f"{content_key}|{occurrence}".encode('utf-8')).hexdigest()
+
+            yield (
+                upload_id,
+                rn,
+                row_hash,
+                business_date,
+                resolved_sales_category,
+                menu_item,
+                mapped_item_id,
+                item_qty,
+                net_amount,
+                discount_amount,
+                gross_amount,
+                0.0,
+                content_hash
+            )
+
+
+def queue_upload(upload_id):
+    """Process a queued sales_uploads row on the sales-uploads pool."""
+    return jobs.submit('sales-uploads', process_upload, upload_id, max_workers=UPLOAD_WORKERS)
+
+
+def resume_if_stale(upload):
+    """Queue an upload again when its worker went away; returns True when it was requeued."""
+    if upload.get('status') not in ('queued', 'processing') or not upload.get('stale'):
+        return False
+    queue_upload(upload.get('id'))
+    return True
+
+
+def _claim(upload_id):
+    """Mark the upload processing and return it, or None if it isn't waiting for a worker.
+
+    On success the upload's advisory lock is held on the job's connection until _release().
+    """
+    cursor = get_db_cursor()
+    try:
+        cursor.execute("SELECT pg_try_advisory_lock(hashtext('sales_upload_job'), %s) AS locked", (upload_id,))
+        if not cursor.fetchone()['locked']:
+            # Another worker is processing it
+            return None
+        cursor.execute(
+            """
+            UPDATE sales_uploads
+            SET status = 'processing', started_at = now(), error = NULL
+            WHERE id = %s
+              AND (status = 'queued' AND started_at IS NULL
+                   OR status IN ('queued', 'processing')
+                      AND COALESCE(started_at, created_at) < now() - (%s * INTERVAL '1 minute'))
+            RETURNING id, business_date, raw_text, options, rows_inserted
+            """,
+            (upload_id, STALE_UPLOAD_MINUTES)
+        )
+        upload = cursor.fetchone()
+        if not upload:
+            _release(cursor, upload_id)
+        return upload
+    finally:
+        try:
+            cursor.close()
+        except Exception:
+            pass
+
+
+def _release(cursor, upload_id):
+    cursor.execute("SELECT pg_advisory_unlock(hashtext('sales_upload_job'), %s)", (upload_id,))
+
+
+def _set_stage(cursor, upload_id, stage, **counts):
+    # started_at doubles as the heartbeat the stale check reads
+    assignments = ", ".join(["stage = %s", "started_at = now()"] + [f"{name} = %s" for name in counts])
+    cursor.execute(
+        f"UPDATE sales_uploads SET {assignments} WHERE id = %s",
+        (stage, *counts.values(), upload_id)
+    )
+
+
+def _finish(upload_id, status, error=None):
+    # The raw text is only needed while the upload can still be (re)processed
+    cursor = get_db_cursor()
+    try:
+        cursor.execute(
+            "UPDATE sales_uploads SET status = %s, error = %s, completed_at = now(), raw_text = NULL WHERE id = %s",
+            (status, error, upload_id)
+        )
+    finally:
+        try:
+            cursor.close()
+        except Exception:
+            pass
+
+
+def process_upload(upload_id):
+    # One connection throughout: it holds the upload's advisory lock
+    with shared_connection():
+        upload = _claim(upload_id)
+        if not upload:
+            return
+        try:
+            _process(upload_id, upload)
+        finally:
+            cursor = get_db_cursor()
+            try:
+                _release(cursor, upload_id)
+            finally:
+                try:
+                    cursor.close()
+                except Exception:
+                    pass
+
+
+def _process(upload_id, upload):
+    business_date = upload.get('business_date')
+    options = upload.get('options') or {}
+
+    # A retried upload whose lines were already committed goes straight to the follow-up stages
+    if upload.get('rows_inserted') is None:
+        try:
+            _ingest(upload_id, business_date, upload.get('raw_text') or '', options)
+        except Exception as e:
+            logger.exception("Sales upload %s failed to ingest", upload_id)
+            _finish(upload_id, 'failed', str(e))
+            return
+
+    errors = []
+    cursor = get_db_cursor()
+    try:
+        for stage, run in (('mapping', _map_lines), ('aggregates', _refresh_aggregates)):
+            try:
+                _set_stage(cursor, upload_id, stage)
+                run(cursor, upload_id, business_date)
+            except Exception as e:
+                logger.exception("Sales upload %s: %s stage failed", upload_id, stage)
+                errors.append(f"{stage}: {e}")
+        _set_stage(cursor, upload_id, 'done')
+    finally:
+        try:
+            cursor.close()
+        except Exception:
+            pass
+    _finish(upload_id, 'completed_with_errors' if errors else 'completed', '; '.join(errors) or None)
+
+
+def _ingest(upload_id, business_date, raw_text, options):
+    replace = bool(options.get('replace'))
+    reader = csv.reader(io.StringIO(raw_text, newline=''))
+    compiled = SALES_LINE_SCHEMA.compile(next(reader, None))
+    if compiled.missing_required:
+        raise ValueError('The file has no item name column (expected one of: Item, Item Name, Menu Item).')
+    warnings = compiled.warnings('Sales file')
+
+    cursor = get_db_cursor()
+    try:
+        with transaction():
+            # Uploads for one business day are ingested one at a time (replace removes the day's other lines)
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"sales_upload:{business_date}",))
+            _set_stage(cursor, upload_id, 'ingest')
+
+            mappings = _load_sales_mappings(cursor)
+            stats = {'parsed': 0, 'skipped': 0}
+            lines = _iter_sales_lines(compiled, reader, upload_id, business_date, options.get('default_sales_category'), mappings, stats)
+            row_count = 0
+            taken_over = 0
+            while True:
+                batch = list(itertools.islice(lines, UPLOAD_INSERT_BATCH))
+                if not batch:
+                    break
+                # Lines already on file for the day are taken over by this upload (keeping their
+                # ids and edits), so reversing an earlier upload never removes lines this one has
+                written = psycopg2.extras.execute_values(
+                    cursor,
+                    """
+                    INSERT INTO sales_daily_lines (
+                        upload_id, row_num, row_hash, business_date, sales_category,
+                        item_name, item_id, item_qty, net_sales, discount_amount, gross_sales, tax_amount,
+                        content_hash
+                    ) VALUES %s
+                    ON CONFLICT (content_hash) DO UPDATE
+                    SET upload_id = EXCLUDED.upload_id, row_num = EXCLUDED.row_num, row_hash = EXCLUDED.row_hash
+                    RETURNING id, (xmax = 0) AS inserted
+                    """,
+                    batch,
+                    page_size=UPLOAD_INSERT_BATCH,
+                    fetch=True
+                )
+                row_count += len(written)
+                taken_over += sum(1 for row in written if not row['inserted'])
+
+            if replace:
+                # Earlier uploads for the day are superseded; later (still queued) ones are left alone
+                cursor.execute(
+                    """
+                    DELETE FROM sales_daily_lines
+                    WHERE business_date = %s AND upload_id IS DISTINCT FROM %s
+                      AND (upload_id IS NULL OR upload_id < %s)
+                    """,
+                    (business_date, upload_id, upload_id)
+                )
+                removed_lines = max(cursor.rowcount, 0)
+                cursor.execute(
+                    "DELETE FROM sales_uploads WHERE business_date = %s AND id < %s RETURNING id",
+                    (business_date, upload_id)
+                )
+                replaced_uploads = [row.get('id') for row in cursor.fetchall()]
+                warnings.append({
+                    'code': 'info_replaced_uploads',
+                    'severity': 'info',
+                    'message': f"Replaced {len(replaced_uploads)} earlier uploads for {business_date} ({removed_lines} lines removed).",
+                    'upload_ids': replaced_uploads,
+                    'removed_lines': removed_lines
+                })
+            elif taken_over:
+                warnings.append({
+                    'code': 'info_duplicate_lines',
+                    'severity': 'info',
+                    'message': f"{taken_over} lines were already uploaded for {business_date}; they now belong to this upload.",
+                    'count': taken_over
+                })
+
+            refresh_sales_item_daily(cursor, [business_date])
+            cursor.execute(
+                """
+                UPDATE sales_uploads
+                SET row_count = %s, rows_parsed = %s, rows_inserted = %s, rows_skipped = %s, warnings = %s
+                WHERE id = %s
+                """,
+                (row_count, stats['parsed'], row_count - taken_over, stats['skipped'], Json(warnings), upload_id)
+            )
+    finally:
+        try:
+            cursor.close()
+        except Exception:
+            pass
+
+
+def _map_lines(cursor, upload_id, business_date):
+    # Mappings saved while the upload was being ingested
+    apply_sales_mappings(cursor, upload_id=upload_id)
+    cursor.execute(
+        "SELECT COUNT(*) AS cnt FROM sales_daily_lines WHERE upload_id = %s AND item_id IS NOT NULL",
+        (upload_id,)
+    )
+    _set_stage(cursor, upload_id, 'mapping', rows_mapped=int((cursor.fetchone() or {}).get('cnt') or 0))
+
+
+def _refresh_aggregates(cursor, upload_id, business_date):
+    cursor.execute(
+        """
+        INSERT INTO business_days (business_date, status, has_sales, created_at, updated_at)
+        VALUES (%s, 'open', TRUE, now(), now())
+        ON CONFLICT (business_date) DO UPDATE SET has_sales = TRUE, updated_at = now()
+        """,
+        (business_date,)
+    )
@@ -0,0 +1,144 @@
+"""Applying sales_item_mappings to sales_daily_lines.
+
+A mapping ties a normalized sales name (lower(trim(item_name))) to an item.
+sales_daily_lines.name_key stores that normalized name, and the
+(name_key, item_id) index lets every write below find its lines by name
+instead of normalizing the whole table:
+
+  remap_sales_name       saving a mapping re-maps the lines with its name
+  apply_sales_mappings   one upload or one business date, e.g. after ingest
+  queue_mapping_reconcile  every mapping, on the sales-mappings pool, in
+                         chunks of MAPPING_RECONCILE_BATCH mappings per transaction
+
+Each transaction refreshes the sales_item_daily rows of the days it touched.
+"""
+import logging
+
+from .db import get_db_cursor, transaction
+from .sales_rollup import refresh_sales_item_daily
+from . import jobs
+
+logger = logging.getLogger(__name__)
+
+# Mappings applied per transaction by the full reconcile.
+MAPPING_RECONCILE_BATCH = 200
+
+
+def remap_sales_name(cursor, normalized, item_id, previous_item_id=None):
+    """Map the lines named `normalized` to item_id; returns the number of lines updated.
+
+    Unmapped lines are always updated. When the mapping used to point at
+    previous_item_id, lines of that name still on the old item follow it.
+    """
+    with transaction():
+        cursor.execute(
+            """
+            UPDATE sales_daily_lines
+            SET item_id = %s
+            WHERE name_key = %s
+              AND (item_id IS NULL OR item_id = %s)
+              AND item_id IS DISTINCT FROM %s
+            RETURNING business_date
+            """,
+            (item_id, normalized, previous_item_id, item_id)
+        )
+        days = [row.get('business_date') for row in cursor.fetchall()]
+        refresh_sales_item_daily(cursor, days)
+    return len(days)
+
+
+def apply_sales_mappings(cursor, upload_id=None, business_date=None):
+    """Set item_id from sales_item_mappings on unmapped lines; returns the number of lines updated.
+
+    Limited to one upload or one business date when given, else every line (in a
+    single transaction; the reconcile endpoint queues the chunked job instead). When
+    several mappings share a normalized name the oldest wins, as at ingest. The
+    sales_item_daily rows of the days touched are refreshed in the same transaction.
+    """
+    where = ""
+    params = ()
+    if upload_id is not None:
+        where, params = "AND s.upload_id = %s", (upload_id,)
+    elif business_date:
+        where, params = "AND s.business_date = %s", (business_date,)
+    with transaction():
+        cursor.execute(
+            f"""
+            UPDATE sales_daily_lines s
+            SET item_id = m.item_id
+            FROM (
+                SELECT DISTINCT ON (normalized) normalized, item_id
+                FROM sales_item_mappings
+                ORDER BY normalized, mapping_id
+            ) m
+            WHERE s.item_id IS NULL
+            AND s.name_key = m.normalized
+            {where}
+            RETURNING s.business_date
+            """,
+            params
+        )
+        days = [row.get('business_date') for row in cursor.fetchall()]
+        refresh_sales_item_daily(cursor, days)
+    return len(days)
+
+
+def queue_mapping_reconcile():
+    """Apply every mapping to unmapped lines on the sales-mappings pool."""
+    return jobs.submit('sales-mappings', reconcile_all_mappings)
+
+
+def reconcile_all_mappings():
+    """Apply every mapping to unmapped lines, MAPPING_RECONCILE_BATCH mappings per transaction.
+
+    Mappings are taken in mapping_id order, so when two share a normalized name
+    the older one wins, as at ingest. Returns the number of lines updated.
+    """
+    updated = 0
+    last_id = 0
+    cursor = get_db_cursor()
+    try:
+        while True:
+            with transaction():
+                cursor.execute(
+                    """
+                    WITH batch AS (
+                        SELECT mapping_id, normalized, item_id
+                        FROM sales_item_mappings
+                        WHERE mapping_id > %s
+                        ORDER BY mapping_id
+                        LIMIT %s
+                    ),
+                    pick AS (
+                        SELECT DISTINCT ON (normalized) normalized, item_id
+                        FROM batch
+                        ORDER BY normalized, mapping_id
+                    ),
+                    lines AS (
+                        UPDATE sales_daily_lines s
+                        SET item_id = p.item_id
+                        FROM pick p
+                        WHERE s.item_id IS NULL
+                          AND s.name_key = p.normalized
+                        RETURNING s.business_date
+                    )
+                    SELECT
+                        (SELECT MAX(mapping_id) FROM batch) AS last_id,
+                        ARRAY(SELECT DISTINCT business_date FROM lines) AS days,
+                        (SELECT COUNT(*) FROM lines) AS cnt
+                    """,
+                    (last_id, MAPPING_RECONCILE_BATCH)
+                )
+                row = cursor.fetchone() or {}
+                if row.get('last_id') is None:
+                    break
+                refresh_sales_item_daily(cursor, row.get('days') or [])
+            last_id = row['last_id']
+            updated += int(row.get('cnt') or 0)
+    finally:
+        try:
+            cursor.close()
+        except Exception:
+            pass
+    logger.info("Sales mapping reconcile updated %s lines", updated)
+    return updated
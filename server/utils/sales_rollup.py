@@ -0,0 +1,55 @@
+"""sales_item_daily: per-day sales totals by item, sales name and category.
+
+Dashboards and reports read this rollup instead of grouping sales_daily_lines on
+every request. One row covers all lines of a business_date with the same
+item_id, normalized sales name (lower(trim(item_name))) and category
+(COALESCE(sales_category, 'Uncategorized')); besides the summed amounts it keeps
+line counts, including how many lines had each amount filled in.
+
+Whatever changes sales_daily_lines calls refresh_sales_item_daily() with the
+business dates it touched, in the same transaction: the ingest job, reversing an
+upload, editing a line and applying mappings. A refresh recomputes just those
+days, so its cost is one day's lines, not the table's.
+"""
+
+
+def refresh_sales_item_daily(cursor, business_dates):
+    """Recompute the rollup rows of the given business dates from sales_daily_lines."""
+    dates = sorted({d for d in business_dates if d is not None}, key=str)
+    if not dates:
+        return
+    # Concurrent refreshes of one day would each insert its rows; take the days in a fixed order
+    for day in dates:
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"sales_item_daily:{day}",))
+    cursor.execute("DELETE FROM sales_item_daily WHERE business_date = ANY(%s::date[])", (dates,))
+    cursor.execute(
+        """
+        INSERT INTO sales_item_daily (
+            business_date, item_id, name_key, item_name, category,
+            line_count, qty, net_sales, gross_sales, discounts, taxes,
+            qty_lines, net_sales_lines, gross_sales_lines, discount_lines, tax_lines, refreshed_at
+        )
+        SELECT
+            business_date,
+            item_id,
+            COALESCE(LOWER(TRIM(item_name)), ''),
+            MIN(item_name),
+            COALESCE(sales_category, 'Uncategorized'),
+            COUNT(*),
+            SUM(COALESCE(item_qty, 0)),
+            SUM(COALESCE(net_sales, 0)),
+            SUM(COALESCE(gross_sales, 0)),
+            SUM(COALESCE(discount_amount, 0)),
+            SUM(COALESCE(tax_amount, 0)),
+            COUNT(item_qty),
+            COUNT(net_sales),
+            COUNT(gross_sales),
+            COUNT(discount_amount),
+            COUNT(tax_amount),
+            now()
+        FROM sales_daily_lines
+        WHERE business_date = ANY(%s::date[])
+        GROUP BY business_date, item_id, COALESCE(LOWER(TRIM(item_name)), ''), COALESCE(sales_category, 'Uncategorized')
+        """,
+        (dates,)
+    )